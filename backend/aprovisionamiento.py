@@ -0,0 +1,183 @@
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+import database, models, security
+
+# --- ALTA MASIVA DE CLÍNICAS ---
+# Para franquicias: N clínicas con su admin, personal y plantillas de catálogo e
+# inventario. Se valida todo antes de tocar la BD, los passwords se hashean en
+# paralelo y las clínicas se insertan por lotes (un INSERT por tabla y lote).
+# Si un lote falla, se reintenta clínica por clínica para aislar a la culpable.
+
+log = logging.getLogger("clinicsync.aprovisionamiento")
+
+CLINICAS_POR_LOTE = 25
+
+def _usuarios_de(clinica) -> List[dict]:
+    """El admin primero (su id queda como responsable del inventario inicial)."""
+    usuarios = [{
+        "email": clinica.admin_email, "password": clinica.admin_password, "nombre_completo": clinica.admin_nombre,
+        "rol": "admin", "cedula": "PENDIENTE", "comision": 0.0
+    }]
+    for p in clinica.personal:
+        usuarios.append({
+            "email": p.email, "password": p.password, "nombre_completo": p.nombre_completo,
+            "rol": p.rol, "cedula": p.cedula, "comision": p.comision_default
+        })
+    return usuarios
+
+def validar(db: Session, clinicas, inventario_comun) -> Dict[int, str]:
+    """Errores por índice de clínica. Una consulta para todos los emails ya registrados."""
+    errores: Dict[int, str] = {}
+    primera_vez: Dict[str, int] = {}
+    for n, clinica in enumerate(clinicas):
+        for usuario in _usuarios_de(clinica):
+            email = usuario["email"].lower()
+            if email in primera_vez and primera_vez[email] != n:
+                errores.setdefault(n, f"El email {usuario['email']} se repite en la clínica #{primera_vez[email]}")
+            elif email in primera_vez:
+                errores.setdefault(n, f"El email {usuario['email']} se repite en esta clínica")
+            primera_vez.setdefault(email, n)
+
+        skus = [a.sku for a in list(inventario_comun) + list(clinica.inventario)]
+        if len(skus) != len(set(skus)):
+            errores.setdefault(n, "Hay SKUs repetidos en el inventario de la clínica")
+
+    emails = list(primera_vez)
+    for inicio in range(0, len(emails), 500):
+        existentes = db.query(models.User.email).filter(
+            func.lower(models.User.email).in_(emails[inicio:inicio + 500])
+        ).all()
+        for (email,) in existentes:
+            n = primera_vez[email.lower()]
+            errores.setdefault(n, f"El email {email} ya está registrado")
+    return errores
+
+def provisionar(db: Session, clinicas, servicios_comunes, inventario_comun) -> List[dict]:
+    errores = validar(db, clinicas, inventario_comun)
+    validas = [n for n in range(len(clinicas)) if n not in errores]
+
+    # Todos los hashes de golpe, repartidos en hilos
+    pendientes = [(n, u) for n in validas for u in _usuarios_de(clinicas[n])]
+    hashes = security.hashes_en_paralelo([u["password"] for _, u in pendientes])
+    usuarios_por_clinica: Dict[int, List[dict]] = {}
+    for (n, usuario), hash_ in zip(pendientes, hashes):
+        usuarios_por_clinica.setdefault(n, []).append({**usuario, "password_hash": hash_})
+
+    resultados: Dict[int, dict] = {n: {"indice": n, "nombre_comercial": clinicas[n].nombre_comercial,
+                                       "ok": False, "error": error} for n, error in errores.items()}
+
+    for inicio in range(0, len(validas), CLINICAS_POR_LOTE):
+        lote = validas[inicio:inicio + CLINICAS_POR_LOTE]
+        try:
+            resultados.update(_insertar(db, clinicas, lote, usuarios_por_clinica, servicios_comunes, inventario_comun))
+        except Exception:
+            db.rollback()
+            log.exception("Falló un lote de alta masiva; se reintenta clínica por clínica")
+            for n in lote:
+                try:
+                    resultados.update(_insertar(db, clinicas, [n], usuarios_por_clinica, servicios_comunes, inventario_comun))
+                except Exception as e:
+                    db.rollback()
+                    resultados[n] = {"indice": n, "nombre_comercial": clinicas[n].nombre_comercial,
+                                     "ok": False, "error": f"No se pudo crear: {e.__class__.__name__}"}
+
+    return [resultados[n] for n in range(len(clinicas))]
+
+def _insertar(db: Session, clinicas, lote: List[int], usuarios_por_clinica, servicios_comunes, inventario_comun) -> Dict[int, dict]:
+    """Una transacción para el lote: tenants, usuarios y (en BD compartida) catálogos."""
+    tenant_ids = db.execute(
+        insert(models.Tenant).returning(models.Tenant.id, sort_by_parameter_order=True),
+        [{
+            "nombre_comercial": clinicas[n].nombre_comercial,
+            "plan_suscripcion": clinicas[n].plan_suscripcion,
+            "rfc": clinicas[n].rfc,
+            "razon_social": clinicas[n].razon_social or clinicas[n].nombre_comercial,
+            "direccion_fiscal": clinicas[n].direccion_fiscal or "Dirección Pendiente",
+            "config_ui_json": {"logo": None},
+            "estado": "activo"
+        } for n in lote]
+    ).scalars().all()
+    tenant_de = dict(zip(lote, tenant_ids))
+
+    filas_usuarios = [(n, u) for n in lote for u in usuarios_por_clinica[n]]
+    user_ids = db.execute(
+        insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+        [{
+            "tenant_id": tenant_de[n],
+            "rol": u["rol"],
+            "email": u["email"],
+            "password_hash": u["password_hash"],
+            "nombre_completo": u["nombre_completo"],
+            "cedula_profesional": u["cedula"],
+            "porcentaje_comision_default": u["comision"]
+        } for n, u in filas_usuarios]
+    ).scalars().all()
+    admin_de: Dict[int, int] = {}
+    for (n, u), user_id in zip(filas_usuarios, user_ids):
+        if u["rol"] == "admin":
+            admin_de.setdefault(n, user_id)
+
+    conteos = {}
+    if not database.BD_POR_CLINICA:
+        conteos = _insertar_catalogos(db, clinicas, lote, tenant_de, admin_de, servicios_comunes, inventario_comun)
+    db.commit()
+
+    if database.BD_POR_CLINICA:
+        # Cada clínica en su archivo: el catálogo se carga ya con la clínica confirmada en el directorio
+        for n in lote:
+            clinica_db = database.sesion_de_clinica(tenant_de[n])
+            try:
+                conteos.update(_insertar_catalogos(clinica_db, clinicas, [n], tenant_de, admin_de,
+                                                   servicios_comunes, inventario_comun))
+                clinica_db.commit()
+            except Exception:
+                clinica_db.rollback()
+                log.exception("Clínica %s creada sin catálogo", tenant_de[n])
+                conteos[n] = {"servicios": 0, "articulos": 0, "aviso": "Clínica creada, pero no se cargaron las plantillas"}
+            finally:
+                clinica_db.close()
+
+    return {n: {
+        "indice": n,
+        "nombre_comercial": clinicas[n].nombre_comercial,
+        "ok": True,
+        "tenant_id": tenant_de[n],
+        "admin_email": clinicas[n].admin_email,
+        "usuarios": len(usuarios_por_clinica[n]),
+        **conteos.get(n, {})
+    } for n in lote}
+
+def _insertar_catalogos(db: Session, clinicas, lote, tenant_de, admin_de, servicios_comunes, inventario_comun) -> Dict[int, dict]:
+    servicios = [
+        {"tenant_id": tenant_de[n], "codigo": s.codigo, "nombre": s.nombre, "precio": s.precio,
+         "costo": s.costo, "categoria": s.categoria, "activo": True}
+        for n in lote for s in list(servicios_comunes) + list(clinicas[n].servicios)
+    ]
+    if servicios:
+        db.execute(insert(models.ServiceCatalog), servicios)
+
+    articulos = [(n, a) for n in lote for a in list(inventario_comun) + list(clinicas[n].inventario)]
+    if articulos:
+        item_ids = db.execute(
+            insert(models.InventoryItem).returning(models.InventoryItem.id, sort_by_parameter_order=True),
+            [{"tenant_id": tenant_de[n], "nombre": a.nombre, "sku": a.sku, "unidad": a.unidad,
+              "stock": a.stock_inicial, "costo": a.costo, "costo_promedio": a.costo} for n, a in articulos]
+        ).scalars().all()
+
+        ahora = datetime.now()
+        kardex = [{
+            "item_id": item_id, "user_id": admin_de.get(n), "tipo": "entrada", "cantidad": a.stock_inicial,
+            "costo_unitario": a.costo, "motivo": "Inventario inicial (alta de clínica)", "fecha": ahora
+        } for (n, a), item_id in zip(articulos, item_ids) if a.stock_inicial > 0]
+        if kardex:
+            db.execute(insert(models.InventoryMovement), kardex)
+
+    return {n: {
+        "servicios": len(servicios_comunes) + len(clinicas[n].servicios),
+        "articulos": len(inventario_comun) + len(clinicas[n].inventario)
+    } for n in lote}
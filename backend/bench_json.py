@@ -0,0 +1,143 @@
+"""
+Comparativa de serialización: camino normal de FastAPI (objetos ORM + response_model)
+contra json_rapido (columnas + dicts + orjson), en una BD SQLite en memoria.
+
+    python bench_json.py              # 5000 filas por tabla
+    python bench_json.py --filas 20000
+
+Mide la petición completa con TestClient (consulta + serialización + envío).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+os.environ.setdefault("CLINICSYNC_TAREAS", "0")
+os.environ.setdefault("CLINICSYNC_LIMITES", "0")
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session, joinedload, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database, models, schemas, security, json_rapido
+from routers import pacientes, inventario, finanzas, citas
+
+TENANT = 1
+
+def _poblar(db: Session, n: int):
+    ahora = datetime.now()
+    db.add(models.Tenant(id=TENANT, nombre_comercial="Bench", estado="activo"))
+    db.add(models.User(id=1, tenant_id=TENANT, rol="admin", email="bench@clinicsync.com", nombre_completo="Bench"))
+    db.execute(insert(models.Patient), [{
+        "tenant_id": TENANT, "nombre": f"Paciente {i}", "apellidos": "Pérez López", "telefono_movil": "5512345678",
+        "email": f"p{i}@correo.com", "fecha_nacimiento": date(1990, 1, 1), "sexo": "F", "ocupacion": "Docente",
+        "datos_personales": {"tipo_sangre": "O+", "aseguradora": "GNP", "alergias": "Ninguna"},
+        "saldo_actual": 150.5, "created_at": ahora
+    } for i in range(n)])
+    db.execute(insert(models.InventoryItem), [{
+        "tenant_id": TENANT, "nombre": f"Artículo {i}", "sku": f"SKU-{i:06d}", "stock": 40, "unidad": "pza", "costo": 12.5
+    } for i in range(n)])
+    db.execute(insert(models.Appointment), [{
+        "tenant_id": TENANT, "patient_id": i % n + 1, "doctor_id": 1, "fecha_hora": ahora + timedelta(minutes=30 * i),
+        "estado": "programada", "motivo": "Limpieza dental", "duracion_minutos": 30
+    } for i in range(n)])
+    db.execute(insert(models.Transaction), [{
+        "tenant_id": TENANT, "patient_id": i % n + 1, "monto": 800.0, "metodo_pago": "Efectivo",
+        "estado": "pagado", "tipo": "ingreso", "appointment_id": i + 1, "created_at": ahora - timedelta(minutes=i)
+    } for i in range(n)])
+    db.commit()
+
+# --- CAMINO ANTERIOR (objetos ORM + validación del response_model) ---
+antes = FastAPI()
+
+@antes.get("/pacientes/", response_model=List[schemas.PatientResponse])
+def pacientes_antes(db: Session = Depends(database.get_db)):
+    return db.query(models.Patient).filter(models.Patient.tenant_id == TENANT, models.Patient.deleted_at == None).all()
+
+@antes.get("/inventario/items", response_model=List[inventario.ItemResponse])
+def items_antes(db: Session = Depends(database.get_db)):
+    return db.query(models.InventoryItem).filter(
+        models.InventoryItem.tenant_id == TENANT, models.InventoryItem.deleted_at == None
+    ).all()
+
+@antes.get("/citas/", response_model=List[schemas.AppointmentResponse])
+def citas_antes(limit: int = 100, db: Session = Depends(database.get_db)):
+    return db.query(models.Appointment).filter(
+        models.Appointment.tenant_id == TENANT
+    ).order_by(models.Appointment.fecha_hora.asc()).limit(limit).all()
+
+@antes.get("/finanzas/reporte-ventas", response_model=List[finanzas.ReporteVentaItem])
+def reporte_antes(start_date: str, end_date: str, db: Session = Depends(database.get_db)):
+    ventas = db.query(models.Transaction).options(
+        joinedload(models.Transaction.paciente),
+        joinedload(models.Transaction.presupuesto).joinedload(models.Budget.items).joinedload(models.BudgetItem.servicio)
+    ).filter(models.Transaction.tenant_id == TENANT, models.Transaction.tipo == "ingreso").all()
+    return [{
+        "fecha": v.created_at, "paciente": f"{v.paciente.nombre} {v.paciente.apellidos}" if v.paciente else "General",
+        "concepto": f"Consulta #{v.appointment_id}", "metodo_pago": v.metodo_pago, "monto": v.monto
+    } for v in ventas]
+
+# --- CAMINO RÁPIDO (los routers reales) ---
+rapido = FastAPI()
+for modulo in (pacientes, inventario, finanzas, citas):
+    rapido.include_router(modulo.router)
+
+def _medir(cliente: TestClient, ruta: str, repeticiones: int):
+    tiempos, tamano = [], 0
+    cliente.get(ruta) # Calentar
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = cliente.get(ruta)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        assert respuesta.status_code == 200, respuesta.text[:200]
+        tamano = len(respuesta.content)
+    return statistics.median(tiempos), tamano
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=5000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    Sesion = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Sesion()
+    _poblar(db, args.filas)
+    usuario = db.get(models.User, 1)
+
+    def get_db():
+        sesion = Sesion()
+        try:
+            yield sesion
+        finally:
+            sesion.close()
+
+    for app in (antes, rapido):
+        app.dependency_overrides[database.get_db] = get_db
+        app.dependency_overrides[database.get_db_lectura] = get_db
+        app.dependency_overrides[security.get_current_user] = lambda: usuario
+
+    hoy = date.today()
+    rutas = [
+        "/pacientes/",
+        "/inventario/items",
+        f"/citas/?limit={args.filas}",
+        f"/finanzas/reporte-ventas?start_date={hoy - timedelta(days=30)}&end_date={hoy}",
+    ]
+    motor = "orjson" if json_rapido.orjson is not None else "pydantic-core"
+    print(f"{args.filas} filas por tabla, mediana de {args.repeticiones} peticiones, JSON rápido con {motor}\n")
+    print(f"{'Ruta':<32}{'Antes (ms)':>12}{'Rápido (ms)':>13}{'Mejora':>9}{'Bytes':>12}")
+    with TestClient(antes) as cliente_antes, TestClient(rapido) as cliente_rapido:
+        for ruta in rutas:
+            t_antes, _ = _medir(cliente_antes, ruta, args.repeticiones)
+            t_rapido, tamano = _medir(cliente_rapido, ruta, args.repeticiones)
+            print(f"{ruta.split('?')[0]:<32}{t_antes:>12.1f}{t_rapido:>13.1f}{t_antes / t_rapido:>8.1f}x{tamano:>12,}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import json
+import logging
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import and_, event, insert, inspect, or_, select
+from sqlalchemy.engine import IteratorResult
+from sqlalchemy.engine.result import SimpleResultMetaData
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import database, models
+
+# --- BITÁCORA DE CAMBIOS (CDC) ---
+# Cada alta, cambio, baja lógica o borrado de los modelos principales deja una
+# fila en change_log, en la MISMA transacción (after_flush): si el commit falla,
+# la bitácora tampoco queda. El id autoincremental es el orden.
+#
+# Se guardan solo los nombres de las columnas que cambiaron, no los valores:
+# el consumidor relee la fila actual por id (así la bitácora no duplica datos
+# clínicos). Los INSERT/UPDATE/DELETE en bloque (insert(Modelo), query.update) no pasan por el flush:
+# se les agrega RETURNING id + clínica y quedan igual, una fila de bitácora por id.
+# (Las entradas "masivo" sin fila_id de versiones anteriores significan "relee esa tabla".)
+#
+# Consumidores (índices, cachés, acumulados, exportaciones) leen desde su
+# checkpoint con leer() y avanzan con confirmar(), o todo junto con procesar().
+
+log = logging.getLogger("clinicsync.cambios")
+
+RASTREADOS = (
+    models.Tenant, models.User, models.Patient, models.PatientMedicalHistory,
+    models.Appointment, models.ClinicalNote, models.Prescription,
+    models.ServiceCatalog, models.InventoryItem, models.InventoryMovement,
+    models.Budget, models.Transaction, models.PaymentPlan,
+)
+_TABLAS = {m.__table__.name for m in RASTREADOS}
+
+# Modelos sin tenant_id: de quién heredan la clínica
+PADRES = {
+    models.PatientMedicalHistory: (models.Patient, "patient_id"),
+    models.ClinicalNote: (models.Appointment, "appointment_id"),
+    models.Prescription: (models.Appointment, "appointment_id"),
+    models.InventoryMovement: (models.InventoryItem, "item_id"),
+}
+
+def _tenant_de(session: Session, obj) -> Optional[int]:
+    if isinstance(obj, models.Tenant):
+        return obj.id
+    if hasattr(obj, "tenant_id"):
+        return obj.tenant_id
+    if "tenant_id" in session.info:
+        return session.info["tenant_id"]
+    padre = PADRES.get(type(obj))
+    if padre:
+        modelo, llave = padre
+        padre_id = getattr(obj, llave)
+        fila = session.get(modelo, padre_id) if padre_id else None # Casi siempre ya está en el mapa de identidad
+        return fila.tenant_id if fila else None
+    return None
+
+def _campos_cambiados(obj) -> List[str]:
+    estado = inspect(obj)
+    return [attr.key for attr in estado.mapper.column_attrs if estado.attrs[attr.key].history.has_changes()]
+
+# --- ESCRITURA (EVENTOS DE SESIÓN) ---
+
+@event.listens_for(database.SessionLocal, "after_flush")
+def _registrar(session, flush_context):
+    ahora = datetime.now()
+    filas = []
+    for obj in session.new:
+        if isinstance(obj, RASTREADOS):
+            filas.append((obj, "alta", None))
+    for obj in session.dirty:
+        if not isinstance(obj, RASTREADOS) or not session.is_modified(obj, include_collections=False):
+            continue
+        campos = _campos_cambiados(obj)
+        if not campos:
+            continue
+        baja = "deleted_at" in campos and getattr(obj, "deleted_at", None) is not None
+        filas.append((obj, "baja" if baja else "cambio", campos))
+    for obj in session.deleted:
+        if isinstance(obj, RASTREADOS):
+            filas.append((obj, "borrado", None))
+    if not filas:
+        return
+
+    session.connection().execute(insert(models.ChangeLogEntry), [{
+        "tenant_id": _tenant_de(session, obj),
+        "tabla": obj.__table__.name,
+        "fila_id": obj.id,
+        "operacion": operacion,
+        "campos": json.dumps(campos) if campos else None,
+        "creado_en": ahora
+    } for obj, operacion, campos in filas])
+
+def _columna_clinica(modelo):
+    """Columna que dice de qué clínica es la fila: tenant_id, el id del tenant o la llave al padre."""
+    if modelo is models.Tenant:
+        return modelo.id
+    if "tenant_id" in modelo.__table__.c:
+        return modelo.__table__.c.tenant_id
+    padre = PADRES.get(modelo)
+    return modelo.__table__.c[padre[1]] if padre else None
+
+def _clinicas_de_padres(session: Session, modelo, llaves) -> dict:
+    padre = PADRES[modelo][0]
+    llaves = {k for k in llaves if k is not None}
+    if not llaves:
+        return {}
+    return dict(session.connection().execute(
+        select(padre.id, padre.tenant_id).where(padre.id.in_(llaves))
+    ).all())
+
+def _campos_de(estado) -> Optional[List[str]]:
+    valores = getattr(estado.statement, "_values", None)
+    if not valores:
+        return None
+    return sorted(getattr(c, "key", str(c)) for c in valores)
+
+@event.listens_for(database.SessionLocal, "do_orm_execute")
+def _registrar_masivo(estado):
+    if not (estado.is_insert or estado.is_update or estado.is_delete) or estado.bind_mapper is None:
+        return None
+    modelo = estado.bind_mapper.class_
+    if modelo.__table__.name not in _TABLAS:
+        return None
+    operacion = "alta" if estado.is_insert else "borrado" if estado.is_delete else "cambio"
+    campos = _campos_de(estado) if estado.is_update else None
+    if campos and "deleted_at" in campos:
+        operacion = "baja"
+    clinica = _columna_clinica(modelo)
+    if clinica is None:
+        return None
+    sentencia = estado.statement
+
+    # UPDATE por llave primaria con lista de parámetros (executemany): no admite RETURNING,
+    # pero los ids vienen en los parámetros
+    if estado.is_update and isinstance(estado.parameters, list):
+        campos = sorted({k for p in estado.parameters for k in p if k != "id"})
+        ids = [p["id"] for p in estado.parameters if p.get("id") is not None]
+        _escribir(estado.session, modelo, operacion, campos, estado.session.connection().execute(
+            select(modelo.__table__.c.id, clinica).where(modelo.__table__.c.id.in_(ids))
+        ).all() if ids else [])
+        return None
+
+    # Se agregan id y clínica al final del RETURNING del llamador; a él se le devuelven solo sus columnas
+    propias = len(sentencia._returning)
+    resultado = estado.invoke_statement(statement=sentencia.returning(modelo.__table__.c.id, clinica))
+    llaves = list(resultado.keys())[:propias]
+    filas = resultado.all()
+    _escribir(estado.session, modelo, operacion, campos, [tuple(f[propias:]) for f in filas])
+
+    salida = IteratorResult(SimpleResultMetaData(llaves), iter([tuple(f[:propias]) for f in filas]))
+    salida.rowcount = len(filas)
+    return salida
+
+def _escribir(session: Session, modelo, operacion: str, campos, filas):
+    """filas = [(fila_id, clínica o llave al padre)]"""
+    if not filas:
+        return
+    if modelo in PADRES:
+        clinicas = _clinicas_de_padres(session, modelo, [c for _, c in filas])
+        filas = [(fila_id, clinicas.get(llave)) for fila_id, llave in filas]
+    ahora = datetime.now()
+    session.connection().execute(insert(models.ChangeLogEntry), [{
+        "tenant_id": tenant_id,
+        "tabla": modelo.__table__.name,
+        "fila_id": fila_id,
+        "operacion": operacion,
+        "campos": json.dumps(campos) if campos else None,
+        "creado_en": ahora
+    } for fila_id, tenant_id in filas])
+
+# --- LECTURA Y CHECKPOINTS ---
+
+def leer(db: Session, desde_id: int = 0, limite: int = 500, tenant_id: Optional[int] = None,
+         tablas: Optional[Sequence[str]] = None) -> List[models.ChangeLogEntry]:
+    query = db.query(models.ChangeLogEntry).filter(models.ChangeLogEntry.id > desde_id)
+    if tenant_id is not None:
+        # Los cambios en bloque sin clínica conocida se entregan a todos (solo dicen qué tabla releer)
+        query = query.filter(or_(
+            models.ChangeLogEntry.tenant_id == tenant_id,
+            and_(models.ChangeLogEntry.tenant_id == None, models.ChangeLogEntry.fila_id == None)
+        ))
+    if tablas:
+        query = query.filter(models.ChangeLogEntry.tabla.in_(list(tablas)))
+    return query.order_by(models.ChangeLogEntry.id.asc()).limit(limite).all()
+
+def checkpoint(db: Session, consumidor: str, tenant_id: int = 0) -> int:
+    """Último id procesado por el consumidor (0 si nunca ha corrido). tenant_id 0 = global."""
+    ultimo = db.query(models.ChangeCheckpoint.ultimo_id).filter(
+        models.ChangeCheckpoint.consumidor == consumidor,
+        models.ChangeCheckpoint.tenant_id == tenant_id
+    ).scalar()
+    return ultimo or 0
+
+def confirmar(db: Session, consumidor: str, hasta_id: int, tenant_id: int = 0) -> int:
+    """Avanza el checkpoint (nunca retrocede) y hace commit. Devuelve el checkpoint vigente."""
+    avanzados = db.query(models.ChangeCheckpoint).filter(
+        models.ChangeCheckpoint.consumidor == consumidor,
+        models.ChangeCheckpoint.tenant_id == tenant_id,
+        models.ChangeCheckpoint.ultimo_id < hasta_id
+    ).update({"ultimo_id": hasta_id, "actualizado_en": datetime.now()}, synchronize_session=False)
+    if not avanzados:
+        try:
+            with db.begin_nested():
+                db.add(models.ChangeCheckpoint(consumidor=consumidor, tenant_id=tenant_id, ultimo_id=hasta_id))
+        except IntegrityError:
+            pass # Ya existía con un id igual o mayor
+    db.commit()
+    return checkpoint(db, consumidor, tenant_id)
+
+def procesar(db: Session, consumidor: str, funcion: Callable[[List[models.ChangeLogEntry]], None],
+             tablas: Optional[Sequence[str]] = None, lote: int = 500) -> int:
+    """
+    Entrega a funcion() lo nuevo desde el checkpoint, lote por lote, y confirma después
+    de cada lote. Si funcion() falla, el lote se volverá a entregar en la siguiente corrida.
+    """
+    procesadas = 0
+    while True:
+        entradas = leer(db, checkpoint(db, consumidor), lote, tablas=tablas)
+        if not entradas:
+            return procesadas
+        funcion(entradas)
+        confirmar(db, consumidor, entradas[-1].id)
+        procesadas += len(entradas)
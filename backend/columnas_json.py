@@ -0,0 +1,88 @@
+import logging
+import re
+
+from sqlalchemy import JSON, inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.types import String
+
+# --- COLUMNAS JSON NATIVAS ---
+# datos_personales, soap_data, signos_vitales y config_ui_json antes eran Text
+# con json.dumps/json.loads a mano en cada endpoint. Ahora son JSON nativo:
+# SQLite guarda el texto (JSON1), Postgres usa JSONB. Se asignan y se leen dicts.
+#
+# clave(columna, "aseguradora") extrae un valor como texto DENTRO de la BD, con
+# la ruta escrita literal en el SQL: así la consulta coincide con el índice de
+# expresión declarado en models.py (con un parámetro ? el planificador no lo usa).
+
+log = logging.getLogger("clinicsync.db")
+
+# None se guarda como NULL de SQL, no como el texto 'null'
+TipoJSON = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+# Llaves de datos_personales con índice de expresión (ver models.Patient) y filtro en /pacientes/por-datos
+CLAVES_PACIENTE = ("aseguradora", "tipo_sangre")
+
+_NOMBRE_VALIDO = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+class clave(ColumnElement):
+    """Valor de una llave de primer nivel de una columna JSON, como texto (NULL si no está)."""
+    inherit_cache = True
+    type = String()
+    _traverse_internals = [("columna", InternalTraversal.dp_clauseelement), ("nombre", InternalTraversal.dp_string)]
+
+    def __init__(self, columna, nombre: str):
+        if not _NOMBRE_VALIDO.match(nombre):
+            raise ValueError(f"Nombre de llave JSON no válido: {nombre!r}") # Va literal en el SQL
+        self.columna = columna
+        self.nombre = nombre
+
+@compiles(clave)
+def _clave_sqlite(elemento, compiler, **kw):
+    return f"json_extract({compiler.process(elemento.columna, **kw)}, '$.{elemento.nombre}')"
+
+@compiles(clave, "postgresql")
+def _clave_postgres(elemento, compiler, **kw):
+    return f"({compiler.process(elemento.columna, **kw)} ->> '{elemento.nombre}')"
+
+@compiles(clave, "mysql")
+def _clave_mysql(elemento, compiler, **kw):
+    return f"JSON_UNQUOTE(JSON_EXTRACT({compiler.process(elemento.columna, **kw)}, '$.{elemento.nombre}'))"
+
+# --- MIGRACIÓN DE DATOS EXISTENTES ---
+
+COLUMNAS = (
+    ("tenants", "config_ui_json"),
+    ("patients", "datos_personales"),
+    ("clinical_notes", "soap_data"),
+    ("clinical_notes", "signos_vitales"),
+)
+
+def migrar(bind):
+    """
+    Deja las columnas listas para el tipo JSON. Idempotente; se corre al arrancar.
+    SQLite: el tipo declarado no importa, pero un texto vacío o roto haría fallar
+    la lectura, así que se pasa a NULL. Postgres: ALTER ... TYPE jsonb.
+    """
+    inspector = inspect(bind)
+    tablas = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for tabla, columna in COLUMNAS:
+            if tabla not in tablas:
+                continue
+            if bind.dialect.name == "postgresql":
+                tipo = next(c["type"] for c in inspector.get_columns(tabla) if c["name"] == columna)
+                if not isinstance(tipo, JSONB):
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {tabla} ALTER COLUMN {columna} TYPE jsonb "
+                        f"USING NULLIF(trim({columna}), '')::jsonb"
+                    )
+                continue
+            rotas = conn.execute(text(
+                f"UPDATE {tabla} SET {columna} = NULL "
+                f"WHERE {columna} IS NOT NULL AND (trim({columna}) = '' OR json_valid({columna}) = 0)"
+            )).rowcount
+            if rotas:
+                log.warning("%s.%s: %s valores que no eran JSON válido quedaron en NULL", tabla, columna, rotas)
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+import anyio
+
+try:
+    import brotli
+except ImportError: # Opcional
+    brotli = None
+try:
+    import zstandard
+except ImportError: # Opcional
+    zstandard = None
+
+# --- COMPRESIÓN DE RESPUESTAS ---
+# Reportes y listas son JSON muy repetitivo y muchas clínicas tienen enlaces
+# lentos. Este middleware comprime con br o zstd (si la librería está instalada
+# y el cliente lo acepta) o gzip. Respuestas completas: solo arriba del umbral.
+# Respuestas en streaming (CSV, XLSX...): se comprime pedazo por pedazo con flush,
+# así el cliente sigue recibiendo datos conforme se generan.
+# Las métricas por ruta (bytes ahorrados y CPU) quedan en memoria del proceso.
+
+MINIMO_BYTES = int(os.getenv("CLINICSYNC_COMPRESION_MINIMO", "1024"))
+NIVELES = {
+    "br": int(os.getenv("CLINICSYNC_COMPRESION_NIVEL_BR", "5")), # 0-11
+    "zstd": int(os.getenv("CLINICSYNC_COMPRESION_NIVEL_ZSTD", "3")), # 1-22
+    "gzip": int(os.getenv("CLINICSYNC_COMPRESION_NIVEL_GZIP", "6")), # 1-9
+}
+A_HILO_BYTES = 256 * 1024 # Cuerpos más grandes se comprimen fuera del event loop
+
+DISPONIBLES = [nombre for nombre, libreria in (("br", brotli), ("zstd", zstandard), ("gzip", zlib)) if libreria]
+
+# Ya vienen comprimidos o no deben retenerse (SSE)
+NO_COMPRIMIR = ("image/", "video/", "audio/", "application/pdf", "application/zip",
+                "application/vnd.openxmlformats", "text/event-stream", "application/gzip")
+
+def elegir(accept_encoding: str) -> Optional[str]:
+    """La mejor codificación disponible que el cliente acepta (q > 0)."""
+    aceptadas = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        if parametros.strip().startswith("q="):
+            try:
+                q = float(parametros.strip()[2:])
+            except ValueError:
+                q = 0.0
+        aceptadas[nombre.strip()] = q
+    for nombre in DISPONIBLES:
+        if aceptadas.get(nombre, aceptadas.get("*", 0)) > 0:
+            return nombre
+    return None
+
+class Compresor:
+    """Compresor incremental con la misma interfaz para los tres algoritmos."""
+
+    def __init__(self, algoritmo: str):
+        nivel = NIVELES[algoritmo]
+        self.algoritmo = algoritmo
+        if algoritmo == "br":
+            self._c = brotli.Compressor(quality=nivel)
+        elif algoritmo == "zstd":
+            self._c = zstandard.ZstdCompressor(level=nivel).compressobj()
+        else:
+            self._c = zlib.compressobj(nivel, zlib.DEFLATED, 31) # wbits 31 = formato gzip
+
+    def agregar(self, datos: bytes, vaciar: bool) -> bytes:
+        """Comprime datos; con vaciar=True lo que sale ya se puede enviar (flush sin cerrar)."""
+        if self.algoritmo == "br":
+            salida = self._c.process(datos)
+            return salida + self._c.flush() if vaciar else salida
+        salida = self._c.compress(datos)
+        if not vaciar:
+            return salida
+        if self.algoritmo == "zstd":
+            return salida + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return salida + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self) -> bytes:
+        if self.algoritmo == "br":
+            return self._c.finish()
+        return self._c.flush()
+
+def comprimir(algoritmo: str, datos: bytes) -> tuple:
+    """(comprimido, segundos de CPU) de un cuerpo completo."""
+    inicio = time.thread_time()
+    compresor = Compresor(algoritmo)
+    salida = compresor.agregar(datos, False) + compresor.terminar()
+    return salida, time.thread_time() - inicio
+
+# --- MÉTRICAS POR RUTA ---
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas: Dict[str, dict] = {}
+
+    def registrar(self, ruta: str, algoritmo: Optional[str], original: int, enviado: int, cpu: float):
+        with self._lock:
+            m = self._rutas.setdefault(ruta, {
+                "respuestas": 0, "comprimidas": 0, "bytes_originales": 0, "bytes_enviados": 0,
+                "cpu_ms": 0.0, "algoritmos": {}
+            })
+            m["respuestas"] += 1
+            m["bytes_originales"] += original
+            m["bytes_enviados"] += enviado
+            if algoritmo:
+                m["comprimidas"] += 1
+                m["cpu_ms"] += cpu * 1000
+                m["algoritmos"][algoritmo] = m["algoritmos"].get(algoritmo, 0) + 1
+
+    def resumen(self) -> List[dict]:
+        with self._lock:
+            filas = [{"ruta": ruta, **{k: (dict(v) if isinstance(v, dict) else v) for k, v in m.items()}}
+                     for ruta, m in self._rutas.items()]
+        for fila in filas:
+            fila["bytes_ahorrados"] = fila["bytes_originales"] - fila["bytes_enviados"]
+            fila["cpu_ms"] = round(fila["cpu_ms"], 2)
+            fila["proporcion"] = round(fila["bytes_enviados"] / fila["bytes_originales"], 3) if fila["bytes_originales"] else 1.0
+        return sorted(filas, key=lambda f: f["bytes_ahorrados"], reverse=True)
+
+    def reiniciar(self):
+        with self._lock:
+            self._rutas.clear()
+
+metricas = Metricas()
+
+# --- MIDDLEWARE ---
+
+def _ruta(scope) -> str:
+    ruta = scope.get("route")
+    return getattr(ruta, "path", None) or "(sin ruta)"
+
+def _cabecera(headers, nombre: bytes) -> Optional[bytes]:
+    for clave, valor in headers:
+        if clave.lower() == nombre:
+            return valor
+    return None
+
+class Compresion:
+    """Middleware ASGI puro (no BaseHTTPMiddleware): soporta cuerpos en streaming."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        algoritmo = elegir((_cabecera(scope.get("headers", []), b"accept-encoding") or b"").decode("latin-1"))
+        if algoritmo is None:
+            await self.app(scope, receive, send)
+            return
+
+        estado = {"inicio": None, "compresor": None, "original": 0, "enviado": 0, "cpu": 0.0,
+                  "pasar": False, "comprimida": False}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                headers = list(mensaje.get("headers", []))
+                tipo = (_cabecera(headers, b"content-type") or b"").decode("latin-1").lower()
+                if (mensaje["status"] < 200 or mensaje["status"] in (204, 304)
+                        or _cabecera(headers, b"content-encoding") is not None
+                        or tipo.startswith(NO_COMPRIMIR)):
+                    estado["pasar"] = True
+                    await send(mensaje)
+                else:
+                    estado["inicio"] = mensaje # Se decide con el primer pedazo del cuerpo
+                return
+
+            if mensaje["type"] != "http.response.body":
+                await send(mensaje)
+                return
+
+            cuerpo = mensaje.get("body", b"")
+            mas = mensaje.get("more_body", False)
+            estado["original"] += len(cuerpo)
+            if estado["pasar"]:
+                estado["enviado"] += len(cuerpo)
+                await send(mensaje)
+                return
+
+            if estado["inicio"] is not None:
+                inicio, estado["inicio"] = estado["inicio"], None
+                headers = [(k, v) for k, v in inicio["headers"] if k.lower() != b"content-length"]
+                if not mas and len(cuerpo) < MINIMO_BYTES:
+                    # Respuesta completa y chica: no vale la pena
+                    estado["pasar"] = True
+                    estado["enviado"] += len(cuerpo)
+                    await send(inicio)
+                    await send(mensaje)
+                    return
+                estado["comprimida"] = True
+                headers.append((b"content-encoding", algoritmo.encode()))
+                vary = _cabecera(headers, b"vary")
+                if vary is None:
+                    headers.append((b"vary", b"Accept-Encoding"))
+                elif b"accept-encoding" not in vary.lower():
+                    headers = [(k, v + b", Accept-Encoding" if k.lower() == b"vary" else v) for k, v in headers]
+
+                if not mas:
+                    if len(cuerpo) > A_HILO_BYTES:
+                        comprimido, cpu = await anyio.to_thread.run_sync(comprimir, algoritmo, cuerpo)
+                    else:
+                        comprimido, cpu = comprimir(algoritmo, cuerpo)
+                    estado["cpu"] += cpu
+                    estado["enviado"] += len(comprimido)
+                    headers.append((b"content-length", str(len(comprimido)).encode()))
+                    await send({**inicio, "headers": headers})
+                    await send({"type": "http.response.body", "body": comprimido})
+                    return
+
+                estado["compresor"] = Compresor(algoritmo)
+                await send({**inicio, "headers": headers}) # Sin content-length: va en chunks
+
+            inicio_cpu = time.thread_time()
+            salida = estado["compresor"].agregar(cuerpo, vaciar=True)
+            if not mas:
+                salida += estado["compresor"].terminar()
+            estado["cpu"] += time.thread_time() - inicio_cpu
+            estado["enviado"] += len(salida)
+            await send({"type": "http.response.body", "body": salida, "more_body": mas})
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            metricas.registrar(_ruta(scope), algoritmo if estado["comprimida"] else None,
+                               estado["original"], estado["enviado"], estado["cpu"])
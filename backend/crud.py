@@ -1,7 +1,6 @@
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import models, schemas
-import json
 
 # --- CRUD DE PACIENTES ---
 
@@ -9,8 +8,6 @@ def get_patients(db: Session, tenant_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.Patient).filter(models.Patient.tenant_id == tenant_id).offset(skip).limit(limit).all()
 
 def create_patient(db: Session, patient: schemas.PatientCreate, tenant_id: int):
-    # Convertimos el diccionario de datos_personales a string para SQLite
-    datos_json = json.dumps(patient.datos_personales) if patient.datos_personales else "{}"
     
     db_patient = models.Patient(
         tenant_id=tenant_id,
@@ -21,7 +18,7 @@ def create_patient(db: Session, patient: schemas.PatientCreate, tenant_id: int):
         telefono_movil=patient.telefono_movil,
         email=patient.email,
         ocupacion=patient.ocupacion,
-        datos_personales=datos_json,
+        datos_personales=patient.datos_personales or {},
         saldo_actual=0.0
     )
     db.add(db_patient)
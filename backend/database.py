@@ -1,4 +1,8 @@
-from sqlalchemy import create_engine
+import logging
+import os
+from fastapi import Request
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -13,9 +17,127 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+# Una BD por clínica (ver particion.py). Apagado: todas comparten este archivo.
+BD_POR_CLINICA = os.getenv("CLINICSYNC_BD_POR_CLINICA", "0") == "1"
+# Réplicas de solo lectura (ver replicas.py), separadas por comas. Vacío = sin réplicas.
+REPLICAS_URL = [u.strip() for u in os.getenv("CLINICSYNC_REPLICAS_URL", "").split(",") if u.strip()]
+
+def claims_de_peticion(request: Request) -> dict:
+    """Claims del JWT (header Bearer o ?token= de EventSource); {} si no hay token válido."""
+    import security # security importa database: import diferido
+    from jose import JWTError, jwt
+
+    token = None
+    autorizacion = request.headers.get("authorization", "")
+    if autorizacion.lower().startswith("bearer "):
+        token = autorizacion[7:]
+    elif "token" in request.query_params:
+        token = request.query_params["token"]
+    if not token:
+        return {}
+    try:
+        return jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+    except JWTError:
+        return {} # get_current_user responderá 401
+
+def get_db(request: Request):
+    if BD_POR_CLINICA:
+        import particion
+        db = particion.sesion_para_peticion(request)
+    else:
+        db = SessionLocal()
+    if REPLICAS_URL:
+        import replicas # Registra el aviso de escritura (after_commit)
+        # Para la lectura-de-lo-escrito: quién escribe en esta sesión
+        db.info["usuario_escritura"] = claims_de_peticion(request).get("sub")
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_db_lectura(request: Request):
+    """
+    Para rutas declaradas de solo lectura (reportes, historiales, agenda).
+    Va a una réplica, salvo que el usuario haya escrito hace muy poco.
+    Sin réplicas configuradas (o en modo BD por clínica) es igual que get_db.
+    """
+    if not REPLICAS_URL or BD_POR_CLINICA:
+        yield from get_db(request)
+        return
+    import replicas
+    db = replicas.sesion_lectura(claims_de_peticion(request).get("sub"))
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def sesion_de_clinica(tenant_id: int):
+    """Sesión para trabajos fuera de una petición (tareas nocturnas, streaming)."""
+    if BD_POR_CLINICA:
+        import particion
+        return particion.sesion_de_clinica(tenant_id)
+    return SessionLocal()
+
+def sincronizar_columnas(bind):
+    """
+    create_all() tampoco agrega columnas nuevas a tablas existentes.
+    Agregamos con ALTER TABLE las columnas declaradas en models.py que falten
+    (deben ser nullable o traer server_default).
+    """
+    inspector = inspect(bind)
+    tablas = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for tabla in Base.metadata.sorted_tables:
+            if tabla.name not in tablas:
+                continue
+            existentes = {col["name"] for col in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name in existentes:
+                    continue
+                tipo = columna.type.compile(dialect=bind.dialect)
+                ddl = f"ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}"
+                if columna.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT {columna.server_default.arg}"
+                conn.exec_driver_sql(ddl)
+
+def _indices_existentes(bind, inspector, tabla: str) -> set:
+    if bind.dialect.name == "sqlite":
+        # El inspector de SQLite omite los índices de expresión (columnas_json); sqlite_master los lista todos
+        with bind.connect() as conn:
+            return {fila[0] for fila in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (tabla,)
+            )}
+    return {ix["name"] for ix in inspector.get_indexes(tabla)}
+
+def sincronizar_indices(bind):
+    """
+    create_all() solo crea índices de tablas NUEVAS.
+    Aquí creamos los índices declarados en models.py que falten en tablas existentes.
+    """
+    inspector = inspect(bind)
+    tablas = set(inspector.get_table_names())
+    for tabla in Base.metadata.sorted_tables:
+        if tabla.name not in tablas:
+            continue
+        existentes = _indices_existentes(bind, inspector, tabla.name)
+        for indice in tabla.indexes:
+            if indice.name not in existentes:
+                deduplicar = indice.info.get("deduplicar")
+                if deduplicar:
+                    # Índice único que protege contra duplicados ya ocurridos: se limpian antes
+                    with bind.begin() as conn:
+                        arreglados = conn.exec_driver_sql(deduplicar).rowcount
+                    if arreglados:
+                        logging.getLogger("clinicsync.db").warning(
+                            "%s: %s filas duplicadas en %s se resolvieron antes de crear el índice",
+                            indice.name, arreglados, tabla.name
+                        )
+                try:
+                    indice.create(bind=bind)
+                except IntegrityError:
+                    if deduplicar:
+                        raise RuntimeError(f"No se pudo crear {indice.name}: siguen datos duplicados en {tabla.name}")
+                    # Índice único con datos duplicados previos: no tumbamos el arranque
+                    logging.getLogger("clinicsync.db").warning(
+                        "No se pudo crear %s: hay datos duplicados en %s", indice.name, tabla.name
+                    )
@@ -0,0 +1,110 @@
+"""
+Divide la BD compartida en una BD por clínica (modo CLINICSYNC_BD_POR_CLINICA=1).
+
+    python dividir_bd.py                 # copia cada clínica a ./clinicas/clinica_<id>.db
+    python dividir_bd.py --tenant 3      # solo una clínica
+    python dividir_bd.py --purgar        # además borra del directorio los datos ya copiados
+
+La BD actual queda como directorio (clínicas, usuarios, estadísticas). La copia se hace
+con ATTACH + INSERT ... SELECT dentro de SQLite, sin pasar las filas por Python.
+"""
+import argparse
+import os
+
+from sqlalchemy import create_engine
+
+import columnas_json, database, models, particion
+
+# Tablas que se quedan en el directorio además de copiarse (o que solo viven ahí)
+SOLO_DIRECTORIO = {"tenant_usage_stats", "daily_reports"}
+NO_PURGAR = {"tenants", "users", "tenant_usage_stats", "daily_reports"}
+
+def _condiciones():
+    """
+    Para cada tabla, el WHERE que selecciona las filas de una clínica (:tenant).
+    Las tablas sin tenant_id se resuelven por su llave foránea hacia una tabla ya resuelta
+    (preferimos el "dueño" real: un movimiento pertenece a su artículo, no a su usuario).
+    """
+    condiciones = {}
+    for tabla in models.Base.metadata.sorted_tables:
+        if tabla.name == "tenants":
+            condiciones[tabla.name] = "id = :tenant"
+        elif "tenant_id" in tabla.c:
+            condiciones[tabla.name] = "tenant_id = :tenant"
+        else:
+            llaves = sorted(
+                (fk for fk in tabla.foreign_keys if fk.column.table.name in condiciones),
+                key=lambda fk: fk.column.table.name == "users"
+            )
+            if not llaves:
+                continue
+            fk = llaves[0]
+            padre = fk.column.table.name
+            condiciones[tabla.name] = (
+                f"{fk.parent.name} IN (SELECT {fk.column.name} FROM main.{padre} WHERE {condiciones[padre]})"
+            )
+    return condiciones
+
+def dividir(tenant_ids=None, purgar: bool = False):
+    os.makedirs(particion.DIRECTORIO_CLINICAS, exist_ok=True)
+    condiciones = _condiciones()
+
+    with database.engine.connect() as conn:
+        if tenant_ids is None:
+            tenant_ids = [fila[0] for fila in conn.exec_driver_sql("SELECT id FROM tenants ORDER BY id")]
+
+    for tenant_id in tenant_ids:
+        ruta = os.path.join(particion.DIRECTORIO_CLINICAS, f"clinica_{tenant_id}.db")
+        if os.path.exists(ruta):
+            print(f"  Clínica {tenant_id}: {ruta} ya existe, se omite")
+            continue
+
+        # Esquema completo (mismas tablas e índices que el directorio)
+        destino = create_engine(particion.url_clinica(tenant_id))
+        models.Base.metadata.create_all(bind=destino)
+        destino.dispose()
+
+        copiadas = 0
+        with database.engine.connect() as conn:
+            # ATTACH/DETACH no pueden ir dentro de una transacción
+            conn.exec_driver_sql("ATTACH DATABASE ? AS clinica", (ruta,))
+            try:
+                for tabla in models.Base.metadata.sorted_tables:
+                    if tabla.name in SOLO_DIRECTORIO or tabla.name not in condiciones:
+                        continue
+                    origen = {fila[1] for fila in conn.exec_driver_sql(f"PRAGMA main.table_info({tabla.name})")}
+                    columnas = ", ".join(c.name for c in tabla.columns if c.name in origen)
+                    where = condiciones[tabla.name].replace(":tenant", str(int(tenant_id)))
+                    resultado = conn.exec_driver_sql(
+                        f"INSERT INTO clinica.{tabla.name} ({columnas}) "
+                        f"SELECT {columnas} FROM main.{tabla.name} WHERE {where}"
+                    )
+                    copiadas += resultado.rowcount
+                conn.commit()
+            finally:
+                conn.exec_driver_sql("DETACH DATABASE clinica")
+
+        print(f"  Clínica {tenant_id}: {copiadas} filas -> {ruta}")
+
+    if purgar:
+        # Al revés del orden de dependencias: primero hijos, luego padres
+        with database.engine.begin() as conn:
+            for tabla in reversed(models.Base.metadata.sorted_tables):
+                if tabla.name in NO_PURGAR or tabla.name not in condiciones:
+                    continue
+                for tenant_id in tenant_ids:
+                    where = condiciones[tabla.name].replace(":tenant", str(int(tenant_id)))
+                    conn.exec_driver_sql(f"DELETE FROM main.{tabla.name} WHERE {where}")
+        print("  Datos clínicos eliminados del directorio")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Divide la BD compartida en una BD por clínica")
+    parser.add_argument("--tenant", type=int, action="append", help="Solo esta clínica (repetible)")
+    parser.add_argument("--purgar", action="store_true", help="Borrar del directorio lo ya copiado")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    database.sincronizar_columnas(database.engine)
+    columnas_json.migrar(database.engine)
+    print("🔀 Dividiendo la BD compartida...")
+    dividir(args.tenant, args.purgar)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict
+
+from sqlalchemy import event
+from database import SessionLocal
+
+# --- CANAL DE EVENTOS POR CLÍNICA (SSE) ---
+# Los routers publican "cita_creada", "cita_estado", "cita_cancelada"...
+# y cada pantalla conectada (agenda, recepción) los recibe al instante
+# en lugar de volver a pedir toda la agenda.
+# El reparto es en memoria, dentro de un solo proceso (ver la nota en tareas.py).
+
+MAX_PENDIENTES = 100 # Si una pantalla no consume, no dejamos crecer la cola sin límite
+
+class Suscripcion:
+    def __init__(self, tenant_id: int, loop: asyncio.AbstractEventLoop):
+        self.tenant_id = tenant_id
+        self.loop = loop
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDIENTES)
+
+    def _entregar(self, mensaje: str):
+        # Corre dentro del loop de la conexión
+        if self.cola.full():
+            # Cliente lento: vaciamos y le pedimos recargar todo una vez
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait(_formatear("resync", {}))
+            return
+        self.cola.put_nowait(mensaje)
+
+class Broker:
+    """Fan-out en memoria: un mensaje se serializa una vez y se reparte a N pantallas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscripciones: Dict[int, set] = defaultdict(set)
+
+    def suscribir(self, tenant_id: int) -> Suscripcion:
+        sub = Suscripcion(tenant_id, asyncio.get_running_loop())
+        with self._lock:
+            self._suscripciones[tenant_id].add(sub)
+        return sub
+
+    def cancelar(self, sub: Suscripcion):
+        with self._lock:
+            subs = self._suscripciones.get(sub.tenant_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._suscripciones[sub.tenant_id]
+
+    def publicar(self, tenant_id: int, tipo: str, datos: Dict[str, Any]):
+        """Se puede llamar desde los handlers síncronos (threadpool) sin bloquear."""
+        with self._lock:
+            destinos = list(self._suscripciones.get(tenant_id, ()))
+        if not destinos:
+            return
+        mensaje = _formatear(tipo, datos)
+        for sub in destinos:
+            try:
+                sub.loop.call_soon_threadsafe(sub._entregar, mensaje)
+            except RuntimeError:
+                # El loop de esa conexión ya cerró
+                self.cancelar(sub)
+
+    def conexiones(self, tenant_id: int) -> int:
+        with self._lock:
+            return len(self._suscripciones.get(tenant_id, ()))
+
+broker = Broker()
+
+def _formatear(tipo: str, datos: Dict[str, Any]) -> str:
+    cuerpo = json.dumps(datos, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v))
+    return f"event: {tipo}\ndata: {cuerpo}\n\n"
+
+# --- PUBLICAR SOLO DESPUÉS DEL COMMIT ---
+# Los handlers encolan el evento en la sesión; si el commit falla o hay
+# rollback, nadie se entera de un cambio que no existió.
+
+def publicar_al_confirmar(db, tenant_id: int, tipo: str, datos: Dict[str, Any]):
+    db.info.setdefault("eventos_pendientes", []).append((tenant_id, tipo, datos))
+
+@event.listens_for(SessionLocal, "after_commit")
+def _despachar_eventos(session):
+    for tenant_id, tipo, datos in session.info.pop("eventos_pendientes", []):
+        broker.publicar(tenant_id, tipo, datos)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _descartar_eventos(session):
+    session.info.pop("eventos_pendientes", None)
+
+def datos_cita(cita, patient_name: str = None) -> Dict[str, Any]:
+    datos = {
+        "id": cita.id,
+        "estado": cita.estado,
+        "fecha_hora": cita.fecha_hora,
+        "patient_id": cita.patient_id,
+        "doctor_id": cita.doctor_id,
+        "motivo": cita.motivo,
+        "duracion_minutos": cita.duracion_minutos or 60,
+    }
+    if patient_name is not None:
+        datos["patient_name"] = patient_name
+    return datos
@@ -0,0 +1,350 @@
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Session
+
+import database, models, tabulares
+
+# --- IMPORTACIÓN MASIVA DE PACIENTES ---
+# Clínicas que migran de otro software traen decenas de miles de pacientes.
+# El archivo se guarda en disco al subirlo y un hilo lo procesa por bloques:
+# una validación Pydantic por bloque, una consulta de duplicados y dos INSERT
+# en bloque (pacientes y su historia clínica). El avance (filas_leidas) se
+# guarda en la MISMA transacción que el bloque, así que si el proceso muere el
+# trabajo se reanuda justo después del último bloque confirmado, sin duplicar.
+#
+# Memoria acotada: nunca hay más de un bloque en memoria (lectura en streaming
+# con tabulares.leer_filas) y solo se guardan los primeros MAX_ERRORES errores.
+
+log = logging.getLogger("clinicsync.importacion")
+
+DIRECTORIO = os.getenv("CLINICSYNC_IMPORTACIONES_DIR", "./importaciones")
+MAX_MB = int(os.getenv("CLINICSYNC_IMPORTACION_MAX_MB", "200"))
+BLOQUE = 1000
+MAX_ERRORES = 500
+ARRIENDO = timedelta(minutes=5) # Sin latido en este tiempo: el hilo murió y otro lo retoma
+CADA_SEGUNDOS = 60
+
+# Columnas que pasan a la historia clínica (mismas claves que el formulario del expediente)
+CLAVES_HISTORIA = (
+    "enfermedades", "medicamentos", "alergias", "anticonceptivos", "neurologico",
+    "heredofamiliares", "diagnostico", "tratamiento",
+)
+SEXOS = {"m": "M", "h": "M", "masculino": "M", "hombre": "M", "f": "F", "femenino": "F", "mujer": "F"}
+FORMATOS_FECHA = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y")
+
+# --- VALIDACIÓN DE FILAS ---
+
+class FilaPaciente(BaseModel):
+    nombre: str = Field(min_length=1, max_length=100)
+    apellidos: str = Field("", max_length=100)
+    fecha_nacimiento: date
+    sexo: str = ""
+    telefono_movil: str = Field("", max_length=20)
+    email: Optional[str] = Field(None, max_length=100)
+    ocupacion: Optional[str] = Field(None, max_length=100)
+    aseguradora: Optional[str] = None
+    tipo_sangre: Optional[str] = None
+    enfermedades: Optional[str] = None
+    medicamentos: Optional[str] = None
+    alergias: Optional[str] = None
+    anticonceptivos: Optional[str] = None
+    neurologico: Optional[str] = None
+    heredofamiliares: Optional[str] = None
+    diagnostico: Optional[str] = None
+    tratamiento: Optional[str] = None
+
+    class Config:
+        str_strip_whitespace = True
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def texto_de_celda(cls, v):
+        # Excel entrega teléfonos como 5512345678.0 y celdas vacías como None
+        if isinstance(v, float) and v.is_integer():
+            return str(int(v))
+        if isinstance(v, int) and not isinstance(v, bool):
+            return str(v)
+        return v
+
+    @field_validator("apellidos", "sexo", "telefono_movil", mode="before")
+    @classmethod
+    def vacio_como_texto(cls, v):
+        return "" if v is None else v
+
+    @field_validator("email", "ocupacion", "aseguradora", "tipo_sangre", *CLAVES_HISTORIA, mode="before")
+    @classmethod
+    def vacio_como_nulo(cls, v):
+        return None if isinstance(v, str) and not v.strip() else v
+
+    @field_validator("fecha_nacimiento", mode="before")
+    @classmethod
+    def leer_fecha(cls, v):
+        if isinstance(v, datetime):
+            return v.date()
+        if isinstance(v, str) and v.strip():
+            try:
+                return date.fromisoformat(v.strip())
+            except ValueError:
+                pass
+            for formato in FORMATOS_FECHA[1:]:
+                try:
+                    return datetime.strptime(v.strip(), formato).date()
+                except ValueError:
+                    continue
+            raise ValueError("fecha no reconocida (use AAAA-MM-DD o DD/MM/AAAA)")
+        return v # Vacía o de otro tipo: Pydantic reporta el error
+
+    @field_validator("sexo")
+    @classmethod
+    def normalizar_sexo(cls, v):
+        return SEXOS.get(v.lower(), v[:10])
+
+_LISTA = TypeAdapter(List[FilaPaciente])
+
+def validar_bloque(bloque: List[Tuple[int, dict]]) -> Tuple[List[Tuple[int, FilaPaciente]], List[dict]]:
+    """
+    Valida todas las filas del bloque en una sola llamada. Si alguna falla, se
+    apartan las malas y el resto se valida de nuevo (a lo más dos pasadas).
+    """
+    numeros = [numero for numero, _ in bloque]
+    datos = [fila for _, fila in bloque]
+    try:
+        return list(zip(numeros, _LISTA.validate_python(datos))), []
+    except ValidationError as e:
+        malas: Dict[int, str] = {}
+        for error in e.errors():
+            indice, campo = error["loc"][0], ".".join(str(p) for p in error["loc"][1:])
+            malas.setdefault(indice, f"{campo}: {error['msg']}" if campo else error["msg"])
+    errores = [{"fila": numeros[i], "error": mensaje} for i, mensaje in sorted(malas.items())]
+    buenas = [i for i in range(len(datos)) if i not in malas]
+    validas = _LISTA.validate_python([datos[i] for i in buenas])
+    return [(numeros[i], fila) for i, fila in zip(buenas, validas)], errores
+
+# --- CREAR EL TRABAJO ---
+
+def _ruta(job: models.PatientImportJob) -> str:
+    return os.path.join(DIRECTORIO, f"pacientes_{job.tenant_id}_{job.id}.{job.formato}")
+
+def _estimar_filas(ruta: str, formato: str) -> Optional[int]:
+    """Filas de datos aproximadas (sin leer el archivo completo a memoria)."""
+    if formato == "xlsx":
+        try:
+            libro = tabulares.requiere_openpyxl().load_workbook(ruta, read_only=True)
+            maximo = libro.active.max_row
+            libro.close()
+            return maximo - 1 if maximo else None
+        except Exception:
+            return None
+    lineas = 0
+    with open(ruta, "rb") as f:
+        for pedazo in iter(lambda: f.read(1024 * 1024), b""):
+            lineas += pedazo.count(b"\n")
+    return max(lineas - 1, 0)
+
+def crear(db: Session, archivo: UploadFile, usuario: models.User) -> models.PatientImportJob:
+    """Guarda el archivo en disco (en pedazos) y registra el trabajo. No procesa nada aún."""
+    formato = tabulares.formato_de(archivo.filename)
+    if formato == "xlsx":
+        tabulares.requiere_openpyxl()
+    job = models.PatientImportJob(
+        tenant_id=usuario.tenant_id, user_id=usuario.id, nombre_archivo=(archivo.filename or "")[:200],
+        formato=formato, estado="pendiente", errores=[]
+    )
+    db.add(job)
+    db.flush()
+
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    ruta = _ruta(job)
+    with open(ruta, "wb") as destino:
+        for pedazo in iter(lambda: archivo.file.read(1024 * 1024), b""):
+            destino.write(pedazo)
+            if destino.tell() > MAX_MB * 1024 * 1024:
+                break
+        excedido = destino.tell() > MAX_MB * 1024 * 1024
+    if excedido:
+        os.remove(ruta)
+        db.rollback()
+        raise HTTPException(413, f"El archivo excede {MAX_MB} MB")
+    job.filas_totales = _estimar_filas(ruta, formato)
+    db.commit()
+    db.refresh(job)
+    return job
+
+# --- PROCESAR ---
+
+def _apartar(db: Session, job_id: int) -> Optional[models.PatientImportJob]:
+    """Toma el trabajo si está pendiente o si su hilo dejó de dar señales (UPDATE condicionado)."""
+    J = models.PatientImportJob
+    ahora = datetime.now()
+    tomado = db.query(J).filter(
+        J.id == job_id,
+        or_(J.estado == "pendiente", and_(J.estado == "procesando", J.actualizado_en < ahora - ARRIENDO))
+    ).update({"estado": "procesando", "actualizado_en": ahora}, synchronize_session=False)
+    db.commit()
+    return db.get(J, job_id) if tomado else None
+
+def _existentes(db: Session, tenant_id: int, filas: List[FilaPaciente]) -> set:
+    """Pacientes ya registrados (mismo nombre, apellidos y fecha de nacimiento): una consulta por bloque."""
+    P = models.Patient
+    encontrados = db.query(P.nombre, P.apellidos, P.fecha_nacimiento).filter(
+        P.tenant_id == tenant_id,
+        P.deleted_at == None,
+        P.nombre.in_({f.nombre for f in filas}),
+        P.fecha_nacimiento.in_({f.fecha_nacimiento for f in filas})
+    ).all()
+    return {(n.lower(), (a or "").lower(), f) for n, a, f in encontrados}
+
+def _insertar(db: Session, tenant_id: int, filas: List[FilaPaciente]):
+    ids = db.execute(
+        insert(models.Patient).returning(models.Patient.id, sort_by_parameter_order=True),
+        [{
+            "tenant_id": tenant_id,
+            "nombre": f.nombre,
+            "apellidos": f.apellidos,
+            "fecha_nacimiento": f.fecha_nacimiento,
+            "sexo": f.sexo,
+            "telefono_movil": f.telefono_movil,
+            "email": f.email,
+            "ocupacion": f.ocupacion,
+            "datos_personales": {"registro": "Importación", **{
+                clave: getattr(f, clave) for clave in ("aseguradora", "tipo_sangre") if getattr(f, clave)
+            }}
+        } for f in filas]
+    ).scalars().all()
+
+    historia = [{
+        "patient_id": patient_id,
+        "tipo": "historia_clinica",
+        "clave": clave,
+        "valor": getattr(f, clave)[:200],
+        "observaciones": "Importación"
+    } for patient_id, f in zip(ids, filas) for clave in CLAVES_HISTORIA if getattr(f, clave)]
+    if historia:
+        db.execute(insert(models.PatientMedicalHistory), historia)
+
+def procesar(db: Session, job_id: int) -> bool:
+    """Procesa el trabajo desde su último bloque confirmado. False si otro hilo ya lo tiene."""
+    job = _apartar(db, job_id)
+    if job is None:
+        return False
+    J = models.PatientImportJob
+    tenant_id = job.tenant_id
+    creados, omitidos, errores = job.creados or 0, job.omitidos or 0, list(job.errores or [])
+
+    try:
+        with open(_ruta(job), "rb") as f:
+            archivo = UploadFile(f, filename=f"importacion.{job.formato}")
+            filas = tabulares.leer_filas(archivo, saltar=job.filas_leidas or 0, numerar=True)
+            for bloque in tabulares.en_bloques(filas, BLOQUE):
+                validas, malas = validar_bloque(bloque)
+                omitidos += len(malas)
+
+                existentes = _existentes(db, tenant_id, [fila for _, fila in validas]) if validas else set()
+                nuevas, vistas = [], set()
+                for numero, fila in validas:
+                    llave = (fila.nombre.lower(), fila.apellidos.lower(), fila.fecha_nacimiento)
+                    if llave in existentes or llave in vistas:
+                        omitidos += 1
+                        malas.append({"fila": numero, "error": "El paciente ya existe (nombre, apellidos y fecha de nacimiento)"})
+                        continue
+                    vistas.add(llave)
+                    nuevas.append(fila)
+
+                if nuevas:
+                    _insertar(db, tenant_id, nuevas)
+                    creados += len(nuevas)
+                errores.extend(malas[:max(0, MAX_ERRORES - len(errores))])
+
+                # Avance y bloque en la misma transacción: reanudar nunca duplica
+                db.query(J).filter(J.id == job_id).update({
+                    "filas_leidas": bloque[-1][0] - 1, "creados": creados, "omitidos": omitidos,
+                    "errores": errores, "actualizado_en": datetime.now()
+                }, synchronize_session=False)
+                db.commit()
+    except Exception as e:
+        db.rollback()
+        log.exception("Falló la importación de pacientes %s", job_id)
+        db.query(J).filter(J.id == job_id).update(
+            {"estado": "fallido", "error": str(e)[:500], "actualizado_en": datetime.now()}, synchronize_session=False
+        )
+        db.commit()
+        return True
+
+    db.query(J).filter(J.id == job_id).update({
+        "estado": "completado", "error": None, "terminado_en": datetime.now(), "actualizado_en": datetime.now()
+    }, synchronize_session=False)
+    db.commit()
+    try:
+        os.remove(_ruta(job))
+    except OSError:
+        pass
+    return True
+
+def _procesar_en_sesion(tenant_id: int, job_id: int):
+    db = database.sesion_de_clinica(tenant_id)
+    try:
+        procesar(db, job_id)
+    finally:
+        db.close()
+
+def iniciar(tenant_id: int, job_id: int):
+    """Arranca el trabajo en un hilo propio; la petición responde de inmediato."""
+    threading.Thread(
+        target=_procesar_en_sesion, args=(tenant_id, job_id), name=f"importacion-{job_id}", daemon=True
+    ).start()
+
+def reintentar(db: Session, job: models.PatientImportJob):
+    """Un trabajo fallido vuelve a pendiente y continúa desde su último bloque confirmado."""
+    if job.estado != "fallido":
+        raise HTTPException(400, "Solo se pueden reanudar importaciones fallidas")
+    if not os.path.exists(_ruta(job)):
+        raise HTTPException(410, "El archivo de esta importación ya no existe; súbalo de nuevo")
+    job.estado = "pendiente"
+    job.error = None
+    db.commit()
+    iniciar(job.tenant_id, job.id)
+
+# --- REANUDAR (TRABAJO PERIÓDICO) ---
+
+def _reanudar_sesion(db: Session):
+    J = models.PatientImportJob
+    # Los pendientes recién creados ya tienen su hilo: solo lo que lleva un arriendo sin latido
+    abandonados = [job_id for (job_id,) in db.query(J.id).filter(
+        J.estado.in_(("pendiente", "procesando")),
+        J.actualizado_en < datetime.now() - ARRIENDO
+    ).order_by(J.id).all()]
+    for job_id in abandonados:
+        log.info("Reanudando importación de pacientes %s", job_id)
+        procesar(db, job_id)
+
+def reanudar_pendientes():
+    """Entrada del trabajo periódico: retoma importaciones cuyo hilo murió (reinicio, despliegue)."""
+    if not database.BD_POR_CLINICA:
+        db = database.SessionLocal()
+        try:
+            _reanudar_sesion(db)
+        finally:
+            db.close()
+        return
+
+    directorio = database.SessionLocal()
+    try:
+        tenants = [t.id for t in directorio.query(models.Tenant.id).filter(models.Tenant.deleted_at == None).all()]
+    finally:
+        directorio.close()
+    for tenant_id in tenants:
+        db = database.sesion_de_clinica(tenant_id)
+        try:
+            _reanudar_sesion(db)
+        except Exception:
+            db.rollback()
+            log.exception("No se pudieron reanudar las importaciones del tenant %s", tenant_id)
+        finally:
+            db.close()
@@ -0,0 +1,82 @@
+import decimal
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type
+
+import pydantic_core
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError: # Opcional: sin orjson se usa el serializador de pydantic-core
+    orjson = None
+
+# --- RUTA RÁPIDA DE JSON PARA LISTAS GRANDES ---
+# Por defecto FastAPI valida cada objeto ORM contra el response_model, lo pasa
+# por jsonable_encoder y luego por json.dumps: con miles de filas eso cuesta más
+# que la consulta. Las rutas que se apuntan aquí consultan solo las columnas del
+# esquema (sin instanciar objetos ORM), arman dicts y los serializan de una vez
+# con orjson. No se re-valida: la BD ya es la fuente confiable.
+#
+# El esquema Pydantic sigue siendo el contrato (define columnas y documentación).
+# CLINICSYNC_JSON_RAPIDO=0 regresa al camino normal (FastAPI valida los dicts).
+# Comparativa: python bench_json.py
+#
+# Campos dispersos: las listas aceptan ?fields=id,nombre,apellidos. campos_pedidos()
+# valida contra el esquema y la consulta proyecta solo esas columnas (el buscador
+# de la agenda no necesita leer ni enviar datos_personales). El id va siempre.
+
+HABILITADO = os.getenv("CLINICSYNC_JSON_RAPIDO", "1") == "1"
+
+def _por_defecto(valor):
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    raise TypeError
+
+def dumps(valor: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(valor, default=_por_defecto)
+    return pydantic_core.to_json(valor)
+
+class RespuestaJSON(Response):
+    media_type = "application/json"
+
+    def render(self, contenido: Any) -> bytes:
+        return dumps(contenido)
+
+def campos_pedidos(fields: Optional[str], esquema: Type[BaseModel]) -> Optional[List[str]]:
+    """Lista de ?fields= validada contra el esquema (id primero); None = todos los campos."""
+    if not fields or not fields.strip():
+        return None
+    pedidos = list(dict.fromkeys(c.strip() for c in fields.split(",") if c.strip()))
+    desconocidos = [c for c in pedidos if c not in esquema.model_fields]
+    if desconocidos:
+        raise HTTPException(400, f"Campos no válidos: {', '.join(desconocidos)}. "
+                                 f"Disponibles: {', '.join(esquema.model_fields)}")
+    if "id" in esquema.model_fields and "id" not in pedidos:
+        pedidos.insert(0, "id")
+    return pedidos
+
+def columnas(modelo_orm, esquema: Type[BaseModel], campos: Optional[List[str]] = None) -> list:
+    """Las columnas del modelo ORM que pide el esquema (o solo campos), en el mismo orden."""
+    return [getattr(modelo_orm, campo) for campo in (campos or esquema.model_fields)]
+
+def filas_a_dicts(filas: Iterable[tuple], esquema: Type[BaseModel],
+                  convertir: Optional[Dict[str, Callable[[Any], Any]]] = None,
+                  campos: Optional[List[str]] = None) -> List[dict]:
+    """Tuplas de columnas (ver columnas()) a dicts; convertir ajusta campos puntuales (ej. JSON en texto)."""
+    campos = campos or list(esquema.model_fields)
+    resultado = [dict(zip(campos, fila)) for fila in filas]
+    convertir = {campo: funcion for campo, funcion in (convertir or {}).items() if campo in campos}
+    if convertir:
+        for fila in resultado:
+            for campo, funcion in convertir.items():
+                fila[campo] = funcion(fila[campo])
+    return resultado
+
+def responder(datos: Any, parcial: bool = False):
+    """
+    RespuestaJSON directa (FastAPI ya no valida contra response_model) o, apagado, los datos tal cual.
+    Con parcial=True (?fields=) siempre sale directa: el response_model completo la rechazaría.
+    """
+    return RespuestaJSON(datos) if HABILITADO or parcial else datos
@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+
+import database
+
+# --- LÍMITE DE PETICIONES POR CLÍNICA Y POR USUARIO (TOKEN BUCKET) ---
+# Cada petición gasta una ficha de la cubeta de su clínica y otra de la de su
+# usuario; las rutas costosas (reportes, exportaciones, búsquedas) tienen cubetas
+# aparte y más chicas. Sin fichas: 429 inmediato con Retry-After.
+# El estado vive en un SQLite local compartido, así todos los workers de uvicorn
+# ven las mismas cubetas.
+
+HABILITADO = os.getenv("CLINICSYNC_LIMITES", "1") == "1"
+RUTA_BD = os.getenv("CLINICSYNC_LIMITES_BD", "./limites.db")
+
+# (fichas por minuto, ráfaga máxima). Se pueden ajustar con
+# CLINICSYNC_LIMITE_<NOMBRE>="por_minuto,rafaga", ej. CLINICSYNC_LIMITE_USUARIO_COSTOSA="60,20"
+PRESUPUESTOS: Dict[str, Tuple[float, float]] = {
+    "clinica_general": (1200, 200),
+    "usuario_general": (300, 60),
+    "clinica_costosa": (60, 20),
+    "usuario_costosa": (30, 10),
+    "anonimo": (60, 20), # Sin token (login): por IP
+}
+for _nombre in PRESUPUESTOS:
+    _valor = os.getenv(f"CLINICSYNC_LIMITE_{_nombre.upper()}")
+    if _valor:
+        _por_minuto, _rafaga = (float(x) for x in _valor.split(","))
+        PRESUPUESTOS[_nombre] = (_por_minuto, _rafaga)
+
+RUTAS_COSTOSAS = (
+    "/finanzas/reporte-ventas",
+    "/finanzas/caja/cortes",
+    "/inventario/exportar",
+    "/inventario/importar",
+    "/inventario/kardex",
+    "/inventario/valuacion",
+    "/pacientes/search",
+    "/clinica/recetas/lote",
+    "/superadmin/clinicas/lote",
+)
+SUFIJOS_COSTOSOS = ("/historial-clinico-completo",)
+
+# --- ALMACÉN COMPARTIDO ---
+
+class AlmacenCubetas:
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._local = threading.local()
+        with self._conexion() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cubetas (clave TEXT PRIMARY KEY, fichas REAL NOT NULL, actualizado REAL NOT NULL)"
+            )
+
+    def _conexion(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF") # Si se pierde el estado solo se "regalan" fichas
+            self._local.conn = conn
+        return conn
+
+    def consumir(self, cubetas: List[Tuple[str, float, float]]) -> float:
+        """
+        Gasta una ficha de cada cubeta [(clave, por_segundo, rafaga)] solo si TODAS tienen.
+        Devuelve 0 si pasó, o los segundos a esperar. BEGIN IMMEDIATE serializa entre procesos.
+        """
+        ahora = time.time()
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            claves = [c[0] for c in cubetas]
+            filas = dict(
+                (clave, (fichas, actualizado)) for clave, fichas, actualizado in conn.execute(
+                    f"SELECT clave, fichas, actualizado FROM cubetas WHERE clave IN ({','.join('?' * len(claves))})",
+                    claves
+                )
+            )
+            saldos, espera = [], 0.0
+            for clave, por_segundo, rafaga in cubetas:
+                fichas, actualizado = filas.get(clave, (rafaga, ahora))
+                fichas = min(rafaga, fichas + (ahora - actualizado) * por_segundo)
+                if fichas < 1:
+                    espera = max(espera, (1 - fichas) / por_segundo)
+                saldos.append((clave, fichas))
+
+            if espera == 0:
+                conn.executemany(
+                    "INSERT INTO cubetas (clave, fichas, actualizado) VALUES (?, ?, ?) "
+                    "ON CONFLICT(clave) DO UPDATE SET fichas = excluded.fichas, actualizado = excluded.actualizado",
+                    [(clave, fichas - 1, ahora) for clave, fichas in saldos]
+                )
+            conn.execute("COMMIT")
+            return espera
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def limpiar(self, antiguedad_segundos: float = 86400):
+        """Las cubetas inactivas ya están llenas: borrarlas no cambia nada."""
+        self._conexion().execute("DELETE FROM cubetas WHERE actualizado < ?", (time.time() - antiguedad_segundos,))
+
+_almacen: Optional[AlmacenCubetas] = None
+_almacen_lock = threading.Lock()
+
+def almacen() -> AlmacenCubetas:
+    global _almacen
+    with _almacen_lock:
+        if _almacen is None:
+            _almacen = AlmacenCubetas(RUTA_BD)
+    return _almacen
+
+def limpiar_cubetas():
+    almacen().limpiar()
+
+# --- MIDDLEWARE ---
+
+def _claims(scope) -> dict:
+    # Header Bearer o ?token= (el EventSource de /eventos/agenda no puede mandar headers)
+    return database.claims_de_peticion(Request(scope))
+
+def cubetas_para(scope) -> List[Tuple[str, float, float]]:
+    ruta = scope["path"]
+    costosa = ruta.startswith(RUTAS_COSTOSAS) or ruta.endswith(SUFIJOS_COSTOSOS)
+    clase = "costosa" if costosa else "general"
+    claims = _claims(scope)
+
+    def cubeta(nombre: str, clave: str):
+        por_minuto, rafaga = PRESUPUESTOS[nombre]
+        return (f"{nombre}:{clave}", por_minuto / 60.0, rafaga)
+
+    if not claims.get("sub"):
+        ip = (scope.get("client") or ("desconocido", 0))[0]
+        return [cubeta("anonimo", ip)]
+
+    cubetas = [cubeta(f"usuario_{clase}", claims["sub"])]
+    if claims.get("tenant_id") is not None:
+        cubetas.append(cubeta(f"clinica_{clase}", str(claims["tenant_id"])))
+    return cubetas
+
+class LimiteDePeticiones:
+    """Middleware ASGI puro: no envuelve la respuesta, así no afecta al streaming."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not HABILITADO or scope["type"] != "http" or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            # sqlite3 bloquea (BEGIN IMMEDIATE con timeout): fuera del event loop
+            espera = await anyio.to_thread.run_sync(almacen().consumir, cubetas_para(scope))
+        except sqlite3.OperationalError:
+            espera = 0 # Almacén ocupado/bloqueado: preferimos atender a tumbar la API
+
+        if espera > 0:
+            reintentar = max(1, math.ceil(espera))
+            cuerpo = json.dumps({"detail": f"Demasiadas solicitudes. Intenta de nuevo en {reintentar} s"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(reintentar).encode()),
+                    (b"content-length", str(len(cuerpo)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": cuerpo})
+            return
+
+        await self.app(scope, receive, send)
@@ -1,7 +1,8 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import models
-from database import engine
+import models, columnas_json, tareas, valuacion, uso_clinicas, limites, reporte_diario, recordatorios, compresion, importacion_pacientes
+from database import engine, sincronizar_columnas, sincronizar_indices, REPLICAS_URL, BD_POR_CLINICA
 
 # --- AQUÍ ESTABA EL ERROR: FALTABA IMPORTAR 'citas' ---
 # Importamos todos los módulos del sistema
@@ -14,13 +15,54 @@ from routers import (
     finanzas, 
     inventario, 
     configuracion,
-    citas  # <--- ¡ESTA ES LA IMPORTACIÓN NUEVA!
+    citas,  # <--- ¡ESTA ES LA IMPORTACIÓN NUEVA!
+    odontograma,
+    en_vivo,
+    cambios
 )
 
 # Crear las tablas en la BD (si no existen)
 models.Base.metadata.create_all(bind=engine)
+sincronizar_columnas(engine)
+columnas_json.migrar(engine) # Antes de los índices: los de expresión leen el JSON
+sincronizar_indices(engine)
 
-app = FastAPI(title="ClinicSync Enterprise V5.0", version="5.0 - GOLD MASTER")
+# --- TAREAS EN SEGUNDO PLANO ---
+def _reorden_nocturno():
+    import reorden # NumPy solo se carga en el hilo del trabajo
+    reorden.recalcular_todos()
+
+tareas.programar_diario("valuacion-inventario", "00:15", valuacion.recalcular_todos)
+tareas.programar_diario("reorden-inventario", "02:00", _reorden_nocturno)
+tareas.programar_cada("uso-clinicas", uso_clinicas.CADA_SEGUNDOS, uso_clinicas.recalcular)
+tareas.programar_cada("limpiar-cubetas", 3600, limites.limpiar_cubetas)
+tareas.programar_cada("reporte-diario", 60, reporte_diario.despachar) # Cada clínica a su hora
+tareas.programar_cada("recordatorios", recordatorios.CADA_SEGUNDOS, recordatorios.drenar)
+tareas.programar_cada("importar-pacientes", importacion_pacientes.CADA_SEGUNDOS, importacion_pacientes.reanudar_pendientes)
+
+# Una BD por clínica: reintento de las réplicas clínica -> directorio que fallaron
+if BD_POR_CLINICA:
+    import particion
+    tareas.programar_cada("replicar-directorio", particion.REINTENTAR_CADA, particion.reintentar_replicas)
+
+# Réplica SQLite local para desarrollo: copia inicial y refresco periódico
+if REPLICAS_URL:
+    import replicas
+    if replicas.COPIA_CADA > 0:
+        replicas.copiar_sqlite()
+        tareas.programar_cada("copia-replica", replicas.COPIA_CADA, replicas.copiar_sqlite)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tareas.iniciar()
+    yield
+    tareas.detener()
+
+app = FastAPI(title="ClinicSync Enterprise V5.0", version="5.0 - GOLD MASTER", lifespan=lifespan)
+
+# --- LÍMITE DE PETICIONES POR CLÍNICA ---
+# Va antes que CORS para que CORS quede por fuera y el 429 también lleve sus cabeceras
+app.add_middleware(limites.LimiteDePeticiones)
 
 # --- CONFIGURACIÓN DE CORS ---
 origins = [
@@ -36,6 +78,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- COMPRESIÓN (gzip / br / zstd) ---
+# La última en agregarse queda por fuera de todas: comprime también los 429 y las respuestas con CORS
+app.add_middleware(compresion.Compresion)
+
 # --- ACTIVAR ROUTERS ---
 app.include_router(auth.router)
 app.include_router(superadmin.router)
@@ -45,6 +91,9 @@ app.include_router(clinica.router)
 app.include_router(finanzas.router)
 app.include_router(inventario.router)
 app.include_router(configuracion.router)
+app.include_router(odontograma.router)
+app.include_router(en_vivo.router)
+app.include_router(cambios.router)
 
 # --- ¡ACTIVAMOS EL CEREBRO DE CITAS NUEVO! ---
 app.include_router(citas.router) 
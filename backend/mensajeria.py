@@ -0,0 +1,83 @@
+import importlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import List, Optional, Union
+
+# --- TRANSPORTE DE MENSAJES (WHATSAPP) ---
+# Los reportes y recordatorios no hablan con el proveedor directamente, sino con
+# un Transporte. Mientras no haya proveedor contratado se usa la bandeja local:
+# cada mensaje queda como una línea JSON en CLINICSYNC_BANDEJA_DIR.
+# Para conectar uno real: CLINICSYNC_TRANSPORTE="modulo:Clase" (clase con enviar()).
+
+BANDEJA_DIR = os.getenv("CLINICSYNC_BANDEJA_DIR", "./bandeja_salida")
+
+class ErrorDeEnvio(Exception):
+    """El proveedor rechazó o no pudo entregar el mensaje (se puede reintentar)."""
+
+class Transporte:
+    canal = "whatsapp"
+
+    def enviar(self, destino: str, texto: str, remitente: Optional[str] = None) -> str:
+        """Entrega el mensaje y devuelve el id del proveedor. Lanza ErrorDeEnvio si falla."""
+        raise NotImplementedError
+
+    def enviar_lote(self, mensajes: List[dict], remitente: Optional[str] = None) -> List[Union[str, Exception]]:
+        """
+        Varios mensajes de una misma clínica [{"destino", "texto"}]. Por mensaje devuelve
+        el id del proveedor o la excepción; un fallo no detiene a los demás.
+        Los proveedores con API de lote pueden sobrescribirlo.
+        """
+        resultados: List[Union[str, Exception]] = []
+        for mensaje in mensajes:
+            try:
+                resultados.append(self.enviar(mensaje["destino"], mensaje["texto"], remitente))
+            except Exception as e:
+                resultados.append(e)
+        return resultados
+
+class TransporteBandeja(Transporte):
+    """Escribe en ./bandeja_salida/whatsapp-AAAA-MM-DD.jsonl en lugar de enviar."""
+
+    def __init__(self, directorio: str = BANDEJA_DIR):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+
+    def enviar(self, destino: str, texto: str, remitente: Optional[str] = None) -> str:
+        if not destino:
+            raise ErrorDeEnvio("Sin número de destino")
+        ahora = datetime.now()
+        mensaje_id = uuid.uuid4().hex
+        linea = json.dumps({
+            "id": mensaje_id, "canal": self.canal, "de": remitente, "para": destino,
+            "texto": texto, "fecha": ahora.isoformat(timespec="seconds")
+        }, ensure_ascii=False)
+        ruta = os.path.join(self.directorio, f"{self.canal}-{ahora:%Y-%m-%d}.jsonl")
+        with self._lock:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(ruta, "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+        return mensaje_id
+
+_transporte: Optional[Transporte] = None
+_transporte_lock = threading.Lock()
+
+def transporte() -> Transporte:
+    global _transporte
+    with _transporte_lock:
+        if _transporte is None:
+            ruta = os.getenv("CLINICSYNC_TRANSPORTE")
+            if ruta:
+                modulo, clase = ruta.split(":")
+                _transporte = getattr(importlib.import_module(modulo), clase)()
+            else:
+                _transporte = TransporteBandeja()
+    return _transporte
+
+def registrar_transporte(nuevo: Transporte):
+    """Reemplaza el transporte (útil para pruebas manuales o integraciones)."""
+    global _transporte
+    with _transporte_lock:
+        _transporte = nuevo
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Text, DateTime, Boolean, DECIMAL
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Text, DateTime, Boolean, DECIMAL, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
+from columnas_json import TipoJSON, clave
 import datetime
 
 # Utility Mixin para borrado lógico
@@ -17,18 +18,48 @@ class Tenant(Base, SoftDeleteMixin):
     razon_social = Column(String(100)) 
     direccion_fiscal = Column(String(200))
     telefono_contacto = Column(String(20))
-    config_ui_json = Column(Text)
+    config_ui_json = Column(TipoJSON)
     estado = Column(String(20))
     whatsapp_enabled = Column(Boolean, default=False)
     whatsapp_number = Column(String(20))
     doctor_phone = Column(String(20))
     hora_reporte_diario = Column(String(5), default="08:00")
+    version = Column(Integer, default=1) # Sube en cada cambio (caché de perfil, ver perfil_clinica.py)
 
     users = relationship("User", back_populates="tenant")
     patients = relationship("Patient", back_populates="tenant")
     servicios = relationship("ServiceCatalog", back_populates="tenant")
     inventario = relationship("InventoryItem", back_populates="tenant")
 
+class TenantUsageStats(Base):
+    """Uso por clínica para el backoffice, calculado por un trabajo periódico (ver uso_clinicas.py)."""
+    __tablename__ = "tenant_usage_stats"
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), primary_key=True)
+    usuarios = Column(Integer, default=0)
+    pacientes = Column(Integer, default=0)
+    citas_mes = Column(Integer, default=0)
+    ingresos_mes = Column(Float, default=0.0)
+    archivos = Column(Integer, default=0)
+    almacenamiento_bytes = Column(Integer, default=0) # PDFs generados en disco
+    calculado_en = Column(DateTime, default=datetime.datetime.now)
+
+class DailyReport(Base):
+    """Un reporte diario por clínica y día; la fila aparta el envío (ver reporte_diario.py)."""
+    __tablename__ = "daily_reports"
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"))
+    fecha = Column(Date)
+    destino = Column(String(20))
+    estado = Column(String(20)) # generando | enviado | error
+    error = Column(Text, nullable=True)
+    enviado_en = Column(DateTime, nullable=True) # Fin del último intento (enviado o error)
+    intentos = Column(Integer, default=0, server_default="0", nullable=False)
+    apartado_en = Column(DateTime, nullable=True) # Inicio del último intento
+
+    __table_args__ = (
+        Index("ux_daily_reports_tenant_fecha", "tenant_id", "fecha", unique=True),
+    )
+
 class User(Base, SoftDeleteMixin):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -65,10 +96,16 @@ class Patient(Base, SoftDeleteMixin):
     telefono_movil = Column(String(20))
     email = Column(String(100))
     ocupacion = Column(String(100))
-    datos_personales = Column(Text)
+    datos_personales = Column(TipoJSON)
     saldo_actual = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.datetime.now)
 
+    # Índices de expresión sobre las llaves de datos_personales que más se filtran
+    __table_args__ = (
+        Index("ix_patients_aseguradora", "tenant_id", clave(datos_personales, "aseguradora")),
+        Index("ix_patients_tipo_sangre", "tenant_id", clave(datos_personales, "tipo_sangre")),
+    )
+
     tenant = relationship("Tenant", back_populates="patients")
     citas = relationship("Appointment", back_populates="paciente")
     transacciones = relationship("Transaction", back_populates="paciente")
@@ -83,6 +120,29 @@ class PatientMedicalHistory(Base):
     valor = Column(String(200))
     observaciones = Column(Text)
 
+class PatientImportJob(Base):
+    """Importación masiva de pacientes desde CSV/XLSX, reanudable por bloques (ver importacion_pacientes.py)."""
+    __tablename__ = "patient_import_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"))
+    user_id = Column(Integer, ForeignKey("users.id"))
+    nombre_archivo = Column(String(200))
+    formato = Column(String(10)) # csv | xlsx
+    estado = Column(String(20), default="pendiente") # pendiente | procesando | completado | fallido
+    filas_totales = Column(Integer, nullable=True) # Estimado al subir el archivo (para el porcentaje)
+    filas_leidas = Column(Integer, default=0) # Filas de datos ya procesadas: desde aquí se reanuda
+    creados = Column(Integer, default=0)
+    omitidos = Column(Integer, default=0)
+    errores = Column(TipoJSON) # [{"fila": 15, "error": "..."}], hasta MAX_ERRORES
+    error = Column(Text, nullable=True) # Falla del trabajo completo (archivo ilegible, etc.)
+    creado_en = Column(DateTime, default=datetime.datetime.now)
+    actualizado_en = Column(DateTime, default=datetime.datetime.now) # Latido: sube con cada bloque
+    terminado_en = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_patient_import_jobs_estado", "estado", "actualizado_en"),
+    )
+
 class PatientFile(Base):
     __tablename__ = "patient_files"
     id = Column(Integer, primary_key=True, index=True)
@@ -104,12 +164,18 @@ class Appointment(Base, SoftDeleteMixin):
 
     paciente = relationship("Patient", back_populates="citas")
     clinical_record = relationship("ClinicalNote", back_populates="cita", uselist=False)
+    receta = relationship("Prescription", back_populates="cita", uselist=False)
     archivos = relationship("AppointmentFile", back_populates="cita")
 
+    # Historial del paciente paginado por (fecha_hora, id)
+    __table_args__ = (
+        Index("ix_appointments_paciente_fecha", "tenant_id", "patient_id", "fecha_hora", "id"),
+    )
+
 class AppointmentFile(Base):
     __tablename__ = "appointment_files"
     id = Column(Integer, primary_key=True, index=True)
-    appointment_id = Column(Integer, ForeignKey("appointments.id"))
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), index=True)
     nombre_archivo = Column(String(150))
     tipo_mime = Column(String(50))
     url_archivo = Column(String(500)) 
@@ -119,11 +185,37 @@ class AppointmentFile(Base):
 class ClinicalNote(Base):
     __tablename__ = "clinical_notes"
     id = Column(Integer, primary_key=True, index=True)
-    appointment_id = Column(Integer, ForeignKey("appointments.id"))
-    soap_data = Column(Text)
-    signos_vitales = Column(Text)
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), index=True)
+    soap_data = Column(TipoJSON)
+    signos_vitales = Column(TipoJSON)
+    version = Column(Integer, default=0, server_default="0", nullable=False)
     cita = relationship("Appointment", back_populates="clinical_record")
 
+    # Una nota por cita: dos pestañas que crean la nota a la vez no la duplican.
+    # En BDs con duplicados previos se conserva la de mayor versión; las demás se
+    # desligan de la cita (appointment_id NULL) sin borrar su contenido.
+    __table_args__ = (
+        Index("ux_clinical_notes_appointment", "appointment_id", unique=True, info={"deduplicar": (
+            "UPDATE clinical_notes SET appointment_id = NULL "
+            "WHERE appointment_id IS NOT NULL AND EXISTS (SELECT 1 FROM clinical_notes otra "
+            "WHERE otra.appointment_id = clinical_notes.appointment_id AND (otra.version > clinical_notes.version "
+            "OR (otra.version = clinical_notes.version AND otra.id > clinical_notes.id)))"
+        )}),
+    )
+
+class ClinicalNoteRevision(Base):
+    __tablename__ = "clinical_note_revisions"
+    id = Column(Integer, primary_key=True, index=True)
+    note_id = Column(Integer, ForeignKey("clinical_notes.id"))
+    version = Column(Integer)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    cambios = Column(Text) # Solo los campos modificados: {"soap.plan": "...", "vitales.ta": "..."}
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ix_note_revisions_nota_version", "note_id", "version"),
+    )
+
 class DentalChart(Base):
     __tablename__ = "dental_charts"
     id = Column(Integer, primary_key=True, index=True)
@@ -133,12 +225,66 @@ class DentalChart(Base):
     estado = Column(String(20))
     appointment_id = Column(Integer, ForeignKey("appointments.id"))
 
+    # Bitácora de cambios (solo se agregan filas); el id es el número de evento
+    __table_args__ = (
+        Index("ix_dental_charts_paciente_evento", "patient_id", "id"),
+    )
+
+class DentalChartState(Base):
+    """Odontograma actual del paciente empaquetado (160 bytes, ver odontograma.py)."""
+    __tablename__ = "dental_chart_states"
+    patient_id = Column(Integer, ForeignKey("patients.id"), primary_key=True)
+    estado = Column(LargeBinary)
+    ultimo_evento_id = Column(Integer, default=0)
+    eventos_desde_snapshot = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class DentalChartSnapshot(Base):
+    """Foto periódica del odontograma para reconstruir cualquier visita con un replay corto."""
+    __tablename__ = "dental_chart_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("patients.id"))
+    ultimo_evento_id = Column(Integer)
+    estado = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ix_dental_snapshots_paciente_evento", "patient_id", "ultimo_evento_id"),
+    )
+
 class Prescription(Base):
     __tablename__ = "prescriptions"
     id = Column(Integer, primary_key=True, index=True)
-    appointment_id = Column(Integer, ForeignKey("appointments.id"))
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), index=True)
     texto_medicamentos = Column(Text)
     pdf_url = Column(String(255))
+    cita = relationship("Appointment", back_populates="receta")
+
+class OutboundMessage(Base):
+    """Cola persistente de mensajes salientes (recordatorios de cita, ver recordatorios.py)."""
+    __tablename__ = "outbound_messages"
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"))
+    appointment_id = Column(Integer, nullable=True) # Sin FK: la cita puede borrarse y el historial queda
+    canal = Column(String(20), default="whatsapp")
+    clave = Column(String(100)) # Deduplicación: cita + anticipación + fecha de la cita
+    destino = Column(String(20))
+    texto = Column(Text)
+    programado_para = Column(DateTime)
+    vence_en = Column(DateTime) # Pasada esta hora ya no tiene caso enviarlo
+    estado = Column(String(20), default="pendiente") # pendiente | enviando | enviado | cancelado | vencido | fallido
+    intentos = Column(Integer, default=0)
+    siguiente_intento = Column(DateTime)
+    ultimo_error = Column(Text, nullable=True)
+    proveedor_id = Column(String(100), nullable=True)
+    enviado_en = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ux_outbound_messages_tenant_clave", "tenant_id", "clave", unique=True),
+        Index("ix_outbound_messages_estado_siguiente", "estado", "siguiente_intento"),
+        Index("ix_outbound_messages_cita", "appointment_id"),
+    )
 
 # --- MÓDULO D: INVENTARIO ---
 class ServiceCatalog(Base, SoftDeleteMixin):
@@ -162,8 +308,14 @@ class InventoryItem(Base, SoftDeleteMixin):
     stock = Column(Integer)
     unidad = Column(String(20))
     costo = Column(Float, default=0.0)
+    costo_promedio = Column(Float, nullable=True) # Promedio ponderado; None = aún sin entradas valuadas (se usa costo)
     tenant = relationship("Tenant", back_populates="inventario")
 
+    # Un SKU por clínica (también respalda la búsqueda por lote al importar)
+    __table_args__ = (
+        Index("ux_inventory_items_tenant_sku", "tenant_id", "sku", unique=True),
+    )
+
 class ServiceMaterial(Base):
     __tablename__ = "service_materials"
     id = Column(Integer, primary_key=True, index=True)
@@ -171,6 +323,23 @@ class ServiceMaterial(Base):
     item_id = Column(Integer, ForeignKey("inventory_items.id"))
     cantidad = Column(Integer)
 
+class ServiceConsumption(Base):
+    """Servicios de un paciente cuyos materiales ya se descontaron (ver stock.consumir_servicios)."""
+    __tablename__ = "service_consumptions"
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"))
+    patient_id = Column(Integer, ForeignKey("patients.id"))
+    service_id = Column(Integer, ForeignKey("services_catalog.id"))
+    origen = Column(String(20)) # cita | presupuesto
+    referencia_id = Column(Integer) # id de la cita o del presupuesto
+    cantidad = Column(Integer)
+    pendiente = Column(Integer) # Unidades que descontó este evento y el otro aún no empareja
+    fecha = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ix_service_consumptions_paciente", "tenant_id", "patient_id", "service_id", "origen"),
+    )
+
 class InventoryMovement(Base):
     __tablename__ = "inventory_movements"
     id = Column(Integer, primary_key=True, index=True)
@@ -178,9 +347,48 @@ class InventoryMovement(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     tipo = Column(String(20))
     cantidad = Column(Integer)
+    motivo = Column(String(100), nullable=True)
+    costo_unitario = Column(Float, nullable=True) # Entrada: costo de compra. Salida: costo promedio al momento
     fecha = Column(DateTime, default=datetime.datetime.now)
     usuario = relationship("User", back_populates="movimientos_inventario")
 
+    # Kardex: saldo acumulado por artículo en orden (fecha, id)
+    __table_args__ = (
+        Index("ix_inventory_movements_item_fecha", "item_id", "fecha", "id"),
+    )
+
+class InventoryReorderPoint(Base):
+    """Resultado del cálculo nocturno de reorden (ver reorden.py)."""
+    __tablename__ = "inventory_reorder_points"
+    item_id = Column(Integer, ForeignKey("inventory_items.id"), primary_key=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), index=True)
+    consumo_diario = Column(Float) # Promedio suavizado (EWMA)
+    desviacion = Column(Float)
+    demanda_lead_time = Column(Float)
+    punto_reorden = Column(Integer)
+    cantidad_sugerida = Column(Integer)
+    dias_cobertura = Column(Float, nullable=True) # None = sin consumo
+    calculado_en = Column(DateTime, default=datetime.datetime.now)
+
+class InventoryValuationSnapshot(Base):
+    """Foto diaria del valor de inventario por artículo (ver valuacion.py)."""
+    __tablename__ = "inventory_valuation_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"))
+    item_id = Column(Integer, ForeignKey("inventory_items.id"))
+    fecha = Column(Date) # Existencia y valor al cierre de este día
+    existencia = Column(Integer)
+    costo_promedio = Column(Float)
+    valor = Column(Float)
+    entradas = Column(Integer, default=0) # Movimientos del día
+    valor_entradas = Column(Float, default=0.0)
+    salidas = Column(Integer, default=0)
+    costo_consumo = Column(Float, default=0.0) # Costo de lo consumido en el día (COGS)
+
+    __table_args__ = (
+        Index("ux_inventory_valuation_tenant_fecha_item", "tenant_id", "fecha", "item_id", unique=True),
+    )
+
 # --- MÓDULO E: FINANZAS Y PRESUPUESTOS ---
 class Budget(Base, SoftDeleteMixin):
     __tablename__ = "budgets"
@@ -288,4 +496,34 @@ class DoctorCommission(Base):
     doctor_id = Column(Integer, ForeignKey("users.id"))
     transaction_id = Column(Integer, ForeignKey("transactions.id"))
     monto_comision = Column(Float)
-    estado_pago = Column(String(20))
\ No newline at end of file
+    estado_pago = Column(String(20))
+
+# --- BITÁCORA DE CAMBIOS (ver cambios.py) ---
+class ChangeLogEntry(Base):
+    """Solo se agregan filas; el id es el orden de los cambios."""
+    __tablename__ = "change_log"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(Integer, nullable=True)
+    tabla = Column(String(50))
+    fila_id = Column(Integer, nullable=True) # None = cambio en bloque
+    operacion = Column(String(20)) # alta | cambio | baja | borrado | masivo
+    campos = Column(Text, nullable=True) # JSON con las columnas modificadas (solo en "cambio"/"baja")
+    creado_en = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ix_change_log_tenant_id", "tenant_id", "id"),
+        Index("ix_change_log_tabla_id", "tabla", "id"),
+    )
+
+class ChangeCheckpoint(Base):
+    """Hasta dónde leyó cada consumidor de la bitácora (tenant_id 0 = todas las clínicas)."""
+    __tablename__ = "change_checkpoints"
+    id = Column(Integer, primary_key=True, index=True)
+    consumidor = Column(String(50))
+    tenant_id = Column(Integer, default=0)
+    ultimo_id = Column(Integer, default=0)
+    actualizado_en = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ux_change_checkpoints_consumidor_tenant", "consumidor", "tenant_id", unique=True),
+    )
@@ -0,0 +1,78 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+# --- ODONTOGRAMA EMPAQUETADO ---
+# 32 dientes (FDI, cuadrantes 1-4, piezas 1-8) x 5 caras = 160 posiciones.
+# Cada posición guarda 1 byte con el código del estado, así el odontograma
+# completo de un paciente cabe en 160 bytes en lugar de 160 filas.
+
+CARAS = ["vestibular", "lingual", "mesial", "distal", "oclusal"]
+ALIAS_CARAS = {"palatino": "lingual", "incisal": "oclusal"}
+CARA_COMPLETA = "completo" # Afecta las 5 caras (ej. ausente, corona)
+
+# El código es el índice en esta lista; solo se agregan estados AL FINAL
+ESTADOS = [
+    "sano", "caries", "obturado", "ausente", "corona", "endodoncia", "extraccion",
+    "fractura", "sellante", "implante", "protesis", "seleccionado", "presupuesto", "realizado",
+]
+CODIGO_ESTADO = {nombre: codigo for codigo, nombre in enumerate(ESTADOS)}
+
+N_DIENTES = 32
+N_CARAS = len(CARAS)
+TAMANO = N_DIENTES * N_CARAS
+VACIO = bytes(TAMANO)
+
+# Cada cuántos eventos guardamos una foto completa (acota el replay)
+SNAPSHOT_CADA = 64
+
+def indice_diente(diente: int) -> int:
+    """FDI 11..48 -> 0..31. Lanza ValueError si no es un diente permanente válido."""
+    cuadrante, pieza = divmod(diente, 10)
+    if cuadrante not in (1, 2, 3, 4) or not 1 <= pieza <= 8:
+        raise ValueError(f"Diente inválido: {diente}")
+    return (cuadrante - 1) * 8 + (pieza - 1)
+
+def diente_de_indice(indice: int) -> int:
+    cuadrante, pieza = divmod(indice, 8)
+    return (cuadrante + 1) * 10 + pieza + 1
+
+def caras_de(cara: str) -> Tuple[str, ...]:
+    cara = ALIAS_CARAS.get(cara.lower(), cara.lower())
+    if cara == CARA_COMPLETA:
+        return tuple(CARAS)
+    if cara not in CARAS:
+        raise ValueError(f"Cara inválida: {cara}")
+    return (cara,)
+
+def codigo_estado(estado: str) -> int:
+    try:
+        return CODIGO_ESTADO[estado.lower()]
+    except KeyError:
+        raise ValueError(f"Estado inválido: {estado}")
+
+def posicion(diente: int, cara: str) -> int:
+    return indice_diente(diente) * N_CARAS + CARAS.index(cara)
+
+def aplicar(estado: Optional[bytes], eventos: Iterable[Tuple[int, str, str]]) -> bytes:
+    """Reproduce eventos (diente, cara, estado) sobre un odontograma empaquetado."""
+    buffer = bytearray(estado or VACIO)
+    for diente, cara, nombre_estado in eventos:
+        for c in caras_de(cara):
+            buffer[posicion(diente, c)] = codigo_estado(nombre_estado)
+    return bytes(buffer)
+
+def desempaquetar(estado: Optional[bytes]) -> Dict[str, Dict[str, str]]:
+    """
+    Formato para el frontend: solo dientes con alguna cara distinta de "sano".
+    {"16": {"oclusal": "caries"}, "21": {"vestibular": "corona", ...}}
+    """
+    resultado = {}
+    datos = estado or VACIO
+    for indice in range(N_DIENTES):
+        inicio = indice * N_CARAS
+        caras = {
+            CARAS[i]: ESTADOS[codigo]
+            for i, codigo in enumerate(datos[inicio:inicio + N_CARAS]) if codigo
+        }
+        if caras:
+            resultado[str(diente_de_indice(indice))] = caras
+    return resultado
@@ -0,0 +1,31 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException
+
+# --- PAGINACIÓN POR CURSOR (KEYSET) ---
+# En lugar de OFFSET (que recorre todas las filas anteriores), el cliente
+# devuelve el último (fecha, id) que vio y pedimos "lo que sigue" usando el índice.
+
+def codificar_cursor(fecha: datetime, id_: int) -> str:
+    """Convierte la llave (fecha, id) de la última fila en un cursor opaco."""
+    crudo = f"{fecha.isoformat()}|{id_}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode()
+
+def decodificar_cursor(cursor: str):
+    """Devuelve (fecha, id) o lanza 400 si el cursor no es válido."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor.encode()).decode()
+        fecha_txt, id_txt = crudo.split("|")
+        return datetime.fromisoformat(fecha_txt), int(id_txt)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(400, "Cursor de paginación inválido")
+
+def codificar_cursor_id(id_: int) -> str:
+    """Cursor para listas ordenadas solo por id."""
+    return base64.urlsafe_b64encode(str(id_).encode()).decode()
+
+def decodificar_cursor_id(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(400, "Cursor de paginación inválido")
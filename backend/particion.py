@@ -0,0 +1,226 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+import columnas_json, database, models
+
+# --- MODO UNA BD POR CLÍNICA ---
+# Se activa con CLINICSYNC_BD_POR_CLINICA=1. La BD compartida pasa a ser el
+# DIRECTORIO (clínicas, usuarios para el login, estadísticas del backoffice) y
+# cada clínica vive en su propio archivo. get_db elige el engine a partir del
+# tenant del token; los engines abiertos se guardan en un LRU acotado.
+#
+# Usuarios y datos de la clínica existen en ambos lados: el directorio es la
+# fuente de los ids de usuario y recibe (después del commit) los cambios que
+# la clínica haga a su fila de `tenants` o a sus `users`. La clínica manda sobre
+# sus datos: del directorio solo baja lo que le falta (altas del backoffice) o una
+# fila de `tenants` con versión mayor. Si la réplica falla, se reintenta.
+
+log = logging.getLogger("clinicsync.particion")
+
+DIRECTORIO_CLINICAS = os.getenv("CLINICSYNC_DIR_CLINICAS", "./clinicas")
+MAX_ENGINES = int(os.getenv("CLINICSYNC_MAX_ENGINES", "32"))
+
+TABLAS_DIRECTORIO = ("tenants", "users") # Se replican clínica -> directorio
+REINTENTAR_CADA = 60 # segundos entre reintentos de réplicas fallidas
+
+def url_clinica(tenant_id: int) -> str:
+    return f"sqlite:///{os.path.join(DIRECTORIO_CLINICAS, f'clinica_{tenant_id}.db')}"
+
+class EnginesPorClinica:
+    """LRU de engines: las clínicas activas mantienen su pool, las inactivas se cierran."""
+
+    def __init__(self, maximo: int):
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._engines: "OrderedDict[int, object]" = OrderedDict()
+
+    def obtener(self, tenant_id: int):
+        with self._lock:
+            engine = self._engines.get(tenant_id)
+            if engine is not None:
+                self._engines.move_to_end(tenant_id)
+                return engine
+
+            engine = _abrir_engine(tenant_id)
+            self._engines[tenant_id] = engine
+            while len(self._engines) > self.maximo:
+                _, viejo = self._engines.popitem(last=False)
+                # Las conexiones en uso terminan su petición; solo se cierra el pool
+                viejo.dispose()
+            return engine
+
+    def abiertos(self) -> int:
+        with self._lock:
+            return len(self._engines)
+
+def _abrir_engine(tenant_id: int):
+    os.makedirs(DIRECTORIO_CLINICAS, exist_ok=True)
+    engine = create_engine(url_clinica(tenant_id), connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    database.sincronizar_columnas(engine)
+    columnas_json.migrar(engine)
+    database.sincronizar_indices(engine)
+    _copiar_desde_directorio(engine, tenant_id)
+    return engine
+
+def _copiar_desde_directorio(engine, tenant_id: int):
+    """
+    Al abrir la BD de la clínica: recibe su fila de `tenants` si la del directorio es más
+    nueva (o si no la tiene) y los usuarios que le falten. Nunca pisa datos propios más
+    nuevos; después sube al directorio lo que una réplica fallida haya dejado pendiente.
+    """
+    directorio = database.SessionLocal()
+    clinica = database.SessionLocal(bind=engine)
+    try:
+        tenant = directorio.get(models.Tenant, tenant_id)
+        if tenant is None:
+            return
+        propio = clinica.get(models.Tenant, tenant_id)
+        if propio is None or (tenant.version or 0) > (propio.version or 0):
+            _volcar(clinica, tenant)
+        existentes = {uid for (uid,) in clinica.query(models.User.id).filter(models.User.tenant_id == tenant_id)}
+        usuarios = directorio.query(models.User).filter(
+            models.User.tenant_id == tenant_id,
+            models.User.email != None
+        ).all()
+        for usuario in usuarios:
+            if usuario.id not in existentes:
+                _volcar(clinica, usuario)
+        clinica.commit()
+    finally:
+        directorio.close()
+        clinica.close()
+    _subir_al_directorio(engine, tenant_id)
+
+def _subir_al_directorio(engine, tenant_id: int):
+    """Clínica -> directorio: su fila de `tenants` (si es más nueva) y todos sus usuarios."""
+    clinica = database.SessionLocal(bind=engine)
+    directorio = database.SessionLocal()
+    try:
+        tenant = clinica.get(models.Tenant, tenant_id)
+        central = directorio.get(models.Tenant, tenant_id)
+        if tenant is not None and (central is None or (tenant.version or 0) > (central.version or 0)):
+            _volcar(directorio, tenant)
+        for usuario in clinica.query(models.User).filter(models.User.tenant_id == tenant_id).all():
+            _volcar(directorio, usuario)
+        directorio.commit()
+    finally:
+        directorio.close()
+        clinica.close()
+
+def _volcar(session: Session, obj):
+    """
+    Escribe la fila tal cual en la otra BD (UPDATE por id, o INSERT si no está) con SQL
+    directo: no pasa por el flush, así no sube `version` ni vuelve a disparar la réplica.
+    """
+    tabla = obj.__table__
+    valores = {c.key: getattr(obj, c.key) for c in obj.__mapper__.column_attrs}
+    if not session.execute(tabla.update().where(tabla.c.id == obj.id).values(**valores)).rowcount:
+        session.execute(tabla.insert().values(**valores))
+
+def _copia(obj):
+    """Instancia desligada con los mismos valores de columna (para merge en otra BD)."""
+    return type(obj)(**{c.key: getattr(obj, c.key) for c in obj.__mapper__.column_attrs})
+
+engines = EnginesPorClinica(MAX_ENGINES)
+
+# --- ELEGIR LA BD DE LA PETICIÓN ---
+
+def tenant_de_peticion(request: Request) -> Optional[int]:
+    """tenant_id del JWT. None = directorio (login, super admin, token inválido -> 401 después)."""
+    tenant_id = database.claims_de_peticion(request).get("tenant_id")
+    return int(tenant_id) if tenant_id is not None else None
+
+def sesion_de_clinica(tenant_id: Optional[int]) -> Session:
+    if tenant_id is None:
+        return database.SessionLocal()
+    db = database.SessionLocal(bind=engines.obtener(tenant_id))
+    db.info["tenant_id"] = tenant_id
+    return db
+
+def sesion_para_peticion(request: Request) -> Session:
+    return sesion_de_clinica(tenant_de_peticion(request))
+
+# --- ALTAS DE USUARIO Y RÉPLICA AL DIRECTORIO ---
+
+@event.listens_for(database.SessionLocal, "before_flush")
+def _reservar_ids_usuario(session, flush_context, instances):
+    """
+    Los ids de usuario los asigna el directorio (son globales: el login y los JWT
+    los comparten). Se reserva una fila vacía y dada de baja; si la transacción
+    de la clínica se revierte, queda como hueco inofensivo.
+    """
+    if "tenant_id" not in session.info:
+        return
+    nuevos = [obj for obj in session.new if isinstance(obj, models.User) and obj.id is None]
+    if not nuevos:
+        return
+    directorio = database.SessionLocal()
+    try:
+        for usuario in nuevos:
+            reserva = models.User(tenant_id=usuario.tenant_id, deleted_at=datetime.now())
+            directorio.add(reserva)
+            directorio.flush()
+            usuario.id = reserva.id
+        directorio.commit()
+    finally:
+        directorio.close()
+
+@event.listens_for(database.SessionLocal, "after_flush")
+def _anotar_cambios_directorio(session, flush_context):
+    if "tenant_id" not in session.info:
+        return
+    pendientes = session.info.setdefault("replicar_directorio", {})
+    for obj in list(session.new) + list(session.dirty):
+        if getattr(obj, "__tablename__", None) in TABLAS_DIRECTORIO:
+            pendientes[(obj.__tablename__, obj.id)] = _copia(obj)
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _replicar_directorio(session):
+    pendientes = session.info.pop("replicar_directorio", None)
+    if not pendientes:
+        return
+    tenant_id = session.info.get("tenant_id")
+    directorio = database.SessionLocal()
+    try:
+        for copia in pendientes.values():
+            _volcar(directorio, copia)
+        directorio.commit()
+    except Exception:
+        directorio.rollback()
+        log.exception("No se pudo replicar al directorio (clínica %s); se reintentará", tenant_id)
+        with _lock_reintentos:
+            _reintentos.add(tenant_id)
+    finally:
+        directorio.close()
+
+# --- REINTENTOS DE RÉPLICA ---
+# Si el proceso se reinicia antes de reintentar, la réplica pendiente se sube al
+# volver a abrir la BD de la clínica (_copiar_desde_directorio).
+
+_reintentos = set()
+_lock_reintentos = threading.Lock()
+
+def reintentar_replicas():
+    with _lock_reintentos:
+        pendientes = list(_reintentos)
+        _reintentos.clear()
+    for tenant_id in pendientes:
+        try:
+            _subir_al_directorio(engines.obtener(tenant_id), tenant_id)
+        except Exception:
+            log.exception("Sigue fallando la réplica al directorio (clínica %s)", tenant_id)
+            with _lock_reintentos:
+                _reintentos.add(tenant_id)
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _descartar_replica(session):
+    session.info.pop("replicar_directorio", None)
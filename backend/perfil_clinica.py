@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+import database, models
+
+# --- PERFIL DE LA CLÍNICA EN CACHÉ ---
+# Nombre, datos fiscales, contacto y config_ui_json (ya parseado) casi nunca
+# cambian, pero se leen en cada impresión, ticket y aviso. Cada fila de `tenants`
+# lleva una `version` que sube en cada cambio (ver _subir_version); el caché la
+# revalida cada REVALIDAR_CADA segundos con una consulta de un solo entero, así
+# los otros workers se enteran de los cambios sin releer la fila completa.
+#
+# El dict que devuelve obtener() es compartido: solo lectura.
+
+REVALIDAR_CADA = float(os.getenv("CLINICSYNC_PERFIL_REVALIDAR", "30")) # segundos
+
+CAMPOS = (
+    "id", "nombre_comercial", "plan_suscripcion", "rfc", "razon_social", "direccion_fiscal",
+    "telefono_contacto", "config_ui_json", "estado", "whatsapp_enabled", "whatsapp_number",
+    "doctor_phone", "hora_reporte_diario",
+)
+
+def _config_ui(valor: Any) -> Dict[str, Any]:
+    return valor if isinstance(valor, dict) else {} # Columna JSON: ya llega parseada
+
+def _armar(tenant: models.Tenant) -> Dict[str, Any]:
+    perfil = {campo: getattr(tenant, campo) for campo in CAMPOS}
+    perfil["config_ui"] = _config_ui(tenant.config_ui_json)
+    perfil["version"] = tenant.version or 0
+    return perfil
+
+def etag(perfil: Dict[str, Any]) -> str:
+    return f'W/"clinica-{perfil["id"]}-v{perfil["version"]}"'
+
+class CachePerfiles:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._perfiles: Dict[int, tuple] = {} # tenant_id -> (perfil, revisado_en)
+
+    def obtener(self, db: Session, tenant_id: int) -> Optional[Dict[str, Any]]:
+        ahora = time.monotonic()
+        with self._lock:
+            guardado = self._perfiles.get(tenant_id)
+
+        if guardado:
+            perfil, revisado_en = guardado
+            if ahora - revisado_en < REVALIDAR_CADA:
+                return perfil
+            version = db.query(func.coalesce(models.Tenant.version, 0)).filter(
+                models.Tenant.id == tenant_id
+            ).scalar()
+            if version == perfil["version"]:
+                with self._lock:
+                    self._perfiles[tenant_id] = (perfil, ahora)
+                return perfil
+
+        tenant = db.query(models.Tenant).filter(models.Tenant.id == tenant_id).first()
+        if not tenant:
+            return None
+        perfil = _armar(tenant)
+        with self._lock:
+            self._perfiles[tenant_id] = (perfil, ahora)
+        return perfil
+
+    def invalidar(self, tenant_id: int):
+        with self._lock:
+            self._perfiles.pop(tenant_id, None)
+
+perfiles = CachePerfiles()
+
+def obtener(db: Session, tenant_id: int) -> Optional[Dict[str, Any]]:
+    return perfiles.obtener(db, tenant_id)
+
+# --- INVALIDACIÓN POR VERSIÓN ---
+
+@event.listens_for(database.SessionLocal, "before_flush")
+def _subir_version(session, flush_context, instances):
+    for obj in session.dirty:
+        if isinstance(obj, models.Tenant) and session.is_modified(obj, include_collections=False):
+            obj.version = (obj.version or 0) + 1
+            session.info.setdefault("perfiles_cambiados", set()).add(obj.id)
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _invalidar_al_confirmar(session):
+    for tenant_id in session.info.pop("perfiles_cambiados", ()):
+        perfiles.invalidar(tenant_id)
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _descartar(session):
+    session.info.pop("perfiles_cambiados", None)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import textwrap
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# --- RECETAS EN PDF (CACHÉ EN DISCO) ---
+# Cada PDF se guarda con el hash de su contenido: si la receta no cambia,
+# reimprimir (o imprimir el lote del día) solo lee el archivo ya generado.
+
+RECETAS_DIR = Path(os.getenv("CLINICSYNC_RECETAS_DIR", "./recetas_pdf"))
+WORKERS_PDF = int(os.getenv("CLINICSYNC_WORKERS_PDF", "2"))
+
+# Carta (612 x 792 puntos)
+ANCHO, ALTO = 612, 792
+MARGEN = 56
+LINEAS_POR_PAGINA = 38
+CARACTERES_POR_LINEA = 90
+
+_pool = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Crea el pool de procesos la primera vez que se necesita."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS_PDF)
+    return _pool
+
+def huella_receta(datos: Dict[str, Any]) -> str:
+    """Hash estable del contenido impreso (mismo contenido = mismo PDF)."""
+    canonico = json.dumps(datos, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+def ruta_receta(tenant_id: int, huella: str) -> Path:
+    return RECETAS_DIR / str(tenant_id) / f"{huella}.pdf"
+
+# --- RENDER (se ejecuta dentro de los workers) ---
+
+def _texto_pdf(texto: str) -> str:
+    """Escapa texto para un string literal de PDF (WinAnsi)."""
+    texto = texto.encode("cp1252", errors="replace").decode("cp1252")
+    return texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def _linea(x: int, y: int, tamano: int, texto: str, negrita: bool = False) -> str:
+    fuente = "F2" if negrita else "F1"
+    return f"BT /{fuente} {tamano} Tf {x} {y} Td ({_texto_pdf(texto)}) Tj ET\n"
+
+@lru_cache(maxsize=256)
+def _membrete(nombre: str, direccion: str, telefono: str) -> str:
+    """
+    Operadores PDF del encabezado de la clínica. Es igual para todas las recetas
+    del tenant, así que cada worker lo arma una sola vez.
+    """
+    ops = _linea(MARGEN, ALTO - 60, 18, nombre, negrita=True)
+    ops += _linea(MARGEN, ALTO - 78, 9, direccion)
+    ops += _linea(MARGEN, ALTO - 90, 9, f"Tel. {telefono}" if telefono else "")
+    ops += f"0.31 0.27 0.9 RG 2 w {MARGEN} {ALTO - 100} m {ANCHO - MARGEN} {ALTO - 100} l S 0 0 0 RG\n"
+    return ops
+
+def _lineas_receta(texto: str) -> List[str]:
+    lineas = []
+    for parrafo in (texto or "").splitlines() or [""]:
+        lineas.extend(textwrap.wrap(parrafo, CARACTERES_POR_LINEA) or [""])
+    return lineas
+
+def render_receta(datos: Dict[str, Any]) -> bytes:
+    """Genera el PDF completo (una o más páginas) sin dependencias externas."""
+    clinica, doctor, paciente = datos["clinica"], datos["doctor"], datos["paciente"]
+    membrete = _membrete(clinica["nombre"], clinica["direccion"] or "", clinica["telefono"] or "")
+
+    cabecera = membrete
+    cabecera += _linea(MARGEN, ALTO - 120, 11, f"Dr(a). {doctor['nombre']}", negrita=True)
+    cabecera += _linea(MARGEN, ALTO - 134, 9, f"Céd. Prof. {doctor['cedula'] or '-'}  {doctor['universidad'] or ''}")
+    cabecera += _linea(MARGEN, ALTO - 146, 9, doctor["especialidad"] or "")
+    cabecera += _linea(MARGEN, ALTO - 172, 10, f"Paciente: {paciente['nombre']}")
+    cabecera += _linea(ANCHO - MARGEN - 150, ALTO - 172, 10, f"Fecha: {datos['fecha']}")
+    cabecera += _linea(MARGEN, ALTO - 200, 14, "Rx", negrita=True)
+
+    lineas = _lineas_receta(datos["receta"])
+    paginas = [lineas[i:i + LINEAS_POR_PAGINA] for i in range(0, len(lineas), LINEAS_POR_PAGINA)]
+
+    contenidos = []
+    for pagina in paginas:
+        ops = cabecera
+        y = ALTO - 222
+        for texto in pagina:
+            ops += _linea(MARGEN, y, 11, texto)
+            y -= 14
+        contenidos.append(ops.encode("cp1252", errors="replace"))
+
+    return _armar_pdf(contenidos)
+
+def _armar_pdf(contenidos: List[bytes]) -> bytes:
+    """Escribe los objetos PDF y la tabla xref."""
+    n_paginas = len(contenidos)
+    # 1 catálogo, 2 páginas, 3-4 fuentes, luego (página, contenido) por cada hoja
+    ids_pagina = [5 + 2 * i for i in range(n_paginas)]
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in ids_pagina)}] /Count {n_paginas} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    for id_pagina, contenido in zip(ids_pagina, contenidos):
+        objetos.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {ANCHO} {ALTO}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {id_pagina + 1} 0 R >>".encode()
+        )
+        objetos.append(b"<< /Length " + str(len(contenido)).encode() + b" >>\nstream\n" + contenido + b"\nendstream")
+
+    salida = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, cuerpo in enumerate(objetos, start=1):
+        offsets.append(len(salida))
+        salida += f"{num} 0 obj\n".encode() + cuerpo + b"\nendobj\n"
+
+    inicio_xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        salida += f"{off:010d} 00000 n \n".encode()
+    salida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode()
+    return bytes(salida)
+
+# --- CACHÉ ---
+
+def _guardar(ruta: Path, contenido: bytes):
+    """Escritura atómica: nunca se sirve un PDF a medio escribir."""
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+    temporal.write_bytes(contenido)
+    os.replace(temporal, ruta)
+
+def obtener_o_generar(tenant_id: int, datos: Dict[str, Any]) -> Tuple[str, Path]:
+    """Devuelve (huella, ruta) del PDF; lo genera en el pool solo si no existe."""
+    huella = huella_receta(datos)
+    ruta = ruta_receta(tenant_id, huella)
+    if not ruta.exists():
+        _guardar(ruta, _get_pool().submit(render_receta, datos).result())
+    return huella, ruta
+
+def obtener_o_generar_lote(tenant_id: int, lote: List[Dict[str, Any]]) -> List[Tuple[str, Path]]:
+    """
+    Igual que obtener_o_generar pero para muchas recetas: las faltantes
+    se reparten entre los workers en paralelo.
+    """
+    resultado = []
+    pendientes = {}
+    for datos in lote:
+        huella = huella_receta(datos)
+        ruta = ruta_receta(tenant_id, huella)
+        resultado.append((huella, ruta))
+        if not ruta.exists() and huella not in pendientes:
+            pendientes[huella] = (ruta, _get_pool().submit(render_receta, datos))
+
+    for ruta, futuro in pendientes.values():
+        _guardar(ruta, futuro.result())
+    return resultado
@@ -0,0 +1,217 @@
+import logging
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+import database, models, mensajeria, perfil_clinica
+
+# --- RECORDATORIOS DE CITA (COLA PERSISTENTE) ---
+# Los endpoints de citas solo escriben en outbound_messages, en la misma
+# transacción que la cita (programar()). Un trabajo en segundo plano drena la
+# cola: aparta los mensajes que ya tocan, los agrupa por clínica, los envía en
+# un pool de hilos y reintenta los fallidos con espera exponencial.
+#
+# Deduplicación: la clave de cada mensaje lleva la fecha de la cita. Al
+# reprogramar o cancelar, programar() cancela lo que ya no aplica y reactiva lo
+# que vuelve a aplicar, así nunca salen dos recordatorios para la misma cita.
+
+log = logging.getLogger("clinicsync.recordatorios")
+
+# Horas antes de la cita; cada clínica puede cambiarlas en config_ui_json: {"recordatorios_horas": [24, 2]}
+HORAS_ANTES = [float(h) for h in os.getenv("CLINICSYNC_RECORDATORIOS_HORAS", "24,2").split(",") if h.strip()]
+CADA_SEGUNDOS = 30
+LOTE = 500 # Mensajes apartados por ciclo
+HILOS = int(os.getenv("CLINICSYNC_RECORDATORIOS_HILOS", "4"))
+MAX_INTENTOS = 6
+ESPERA_BASE = 60 # segundos; se duplica en cada intento
+ESPERA_MAXIMA = 3600
+ARRIENDO = timedelta(minutes=10) # Si el proceso muere con mensajes "enviando", se reintentan pasado esto
+
+ESTADOS_SIN_RECORDATORIO = ("cancel", "finaliz", "complet", "en proceso", "atendid", "no asist")
+
+# --- ENCOLAR ---
+
+def _horas_antes(clinica: dict) -> List[float]:
+    horas = clinica["config_ui"].get("recordatorios_horas")
+    if isinstance(horas, list) and all(isinstance(h, (int, float)) for h in horas):
+        return [float(h) for h in horas]
+    return HORAS_ANTES
+
+def _texto(nombre: str, cita: models.Appointment, clinica: dict) -> str:
+    texto = (f"Hola {nombre}, le recordamos su cita en {clinica['nombre_comercial'] or 'la clínica'} "
+             f"el {cita.fecha_hora:%d/%m/%Y} a las {cita.fecha_hora:%H:%M}.")
+    if clinica["telefono_contacto"]:
+        texto += f" Para cambios llame al {clinica['telefono_contacto']}."
+    return texto
+
+def _deseados(db: Session, cita: models.Appointment, ahora: datetime) -> Dict[str, dict]:
+    if cita.deleted_at or not cita.fecha_hora or cita.fecha_hora <= ahora:
+        return {}
+    if (cita.estado or "").lower().startswith(ESTADOS_SIN_RECORDATORIO):
+        return {}
+    clinica = perfil_clinica.obtener(db, cita.tenant_id)
+    if not clinica or not clinica["whatsapp_enabled"]:
+        return {}
+    paciente = db.query(models.Patient.nombre, models.Patient.telefono_movil).filter(
+        models.Patient.id == cita.patient_id
+    ).first()
+    if not paciente or not paciente.telefono_movil:
+        return {}
+
+    deseados = {}
+    for horas in _horas_antes(clinica):
+        cuando = cita.fecha_hora - timedelta(hours=horas)
+        if cuando <= ahora:
+            continue # Esa anticipación ya pasó (cita agendada con poco tiempo)
+        clave = f"cita:{cita.id}:{horas:g}h:{cita.fecha_hora:%Y%m%d%H%M}"
+        deseados[clave] = {
+            "tenant_id": cita.tenant_id, "appointment_id": cita.id, "clave": clave,
+            "destino": paciente.telefono_movil, "texto": _texto(paciente.nombre, cita, clinica),
+            "programado_para": cuando, "vence_en": cita.fecha_hora, "siguiente_intento": cuando,
+            "estado": "pendiente", "intentos": 0
+        }
+    return deseados
+
+def programar(db: Session, cita: models.Appointment):
+    """
+    Deja la cola de la cita como debe estar según su fecha y estado.
+    Llamar después de db.flush() (la cita necesita id) y antes del commit.
+    """
+    deseados = _deseados(db, cita, datetime.now())
+    existentes = db.query(models.OutboundMessage).filter(
+        models.OutboundMessage.tenant_id == cita.tenant_id,
+        models.OutboundMessage.appointment_id == cita.id
+    ).all()
+
+    for mensaje in existentes:
+        nuevo = deseados.pop(mensaje.clave, None)
+        if nuevo and mensaje.estado == "cancelado":
+            # Reprogramada de vuelta a la misma hora: se reactiva
+            mensaje.estado = "pendiente"
+            mensaje.intentos = 0
+            mensaje.siguiente_intento = nuevo["siguiente_intento"]
+            mensaje.texto = nuevo["texto"]
+        elif not nuevo and mensaje.estado in ("pendiente", "enviando"):
+            mensaje.estado = "cancelado"
+
+    for datos in deseados.values():
+        db.add(models.OutboundMessage(**datos))
+
+def cancelar(db: Session, tenant_id: int, appointment_id: int):
+    """Para citas que se borran: lo pendiente se cancela en la misma transacción."""
+    db.query(models.OutboundMessage).filter(
+        models.OutboundMessage.tenant_id == tenant_id,
+        models.OutboundMessage.appointment_id == appointment_id,
+        models.OutboundMessage.estado.in_(("pendiente", "enviando"))
+    ).update({"estado": "cancelado"}, synchronize_session=False)
+
+# --- DRENAR LA COLA ---
+
+def _espera(intentos: int) -> timedelta:
+    segundos = min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** (intentos - 1))
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2)) # Jitter: no reintentar todos juntos
+
+def _apartar(db: Session, ahora: datetime) -> List[tuple]:
+    M = models.OutboundMessage
+    db.query(M).filter(M.estado.in_(("pendiente", "enviando")), M.vence_en <= ahora).update(
+        {"estado": "vencido"}, synchronize_session=False
+    )
+    listos = db.query(M.id).filter(
+        M.estado.in_(("pendiente", "enviando")), M.siguiente_intento <= ahora
+    ).order_by(M.siguiente_intento).limit(LOTE).subquery()
+
+    # UPDATE ... RETURNING: solo nos quedamos con lo que nadie más apartó entre tanto
+    apartados = db.execute(
+        update(M).where(
+            M.id.in_(listos.select()),
+            M.estado.in_(("pendiente", "enviando")),
+            M.siguiente_intento <= ahora
+        ).values(estado="enviando", siguiente_intento=ahora + ARRIENDO, intentos=M.intentos + 1)
+        .returning(M.id, M.tenant_id, M.destino, M.texto, M.intentos)
+    ).all()
+    db.commit()
+    return apartados
+
+def _enviar_clinica(tenant_id: int, mensajes: List[tuple], remitente):
+    return mensajeria.transporte().enviar_lote(
+        [{"destino": m.destino, "texto": m.texto} for m in mensajes], remitente
+    )
+
+def drenar_sesion(db: Session, ahora: datetime = None) -> Dict[str, int]:
+    ahora = ahora or datetime.now()
+    apartados = _apartar(db, ahora)
+    if not apartados:
+        return {"enviados": 0, "reintentos": 0, "fallidos": 0}
+
+    por_clinica = defaultdict(list)
+    for fila in apartados:
+        por_clinica[fila.tenant_id].append(fila)
+    remitentes = {}
+    for tenant_id in por_clinica:
+        clinica = perfil_clinica.obtener(db, tenant_id)
+        remitentes[tenant_id] = clinica["whatsapp_number"] if clinica else None
+
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="recordatorios") as pool:
+        futuros = {tenant_id: pool.submit(_enviar_clinica, tenant_id, mensajes, remitentes[tenant_id])
+                   for tenant_id, mensajes in por_clinica.items()}
+        for tenant_id, futuro in futuros.items():
+            try:
+                respuestas = futuro.result()
+            except Exception as e:
+                log.exception("Falló el envío de recordatorios del tenant %s", tenant_id)
+                respuestas = [e] * len(por_clinica[tenant_id])
+            for fila, respuesta in zip(por_clinica[tenant_id], respuestas):
+                resultados[fila.id] = (fila, respuesta)
+
+    conteo = {"enviados": 0, "reintentos": 0, "fallidos": 0}
+    M = models.OutboundMessage
+    despues = datetime.now()
+    for mensaje_id, (fila, respuesta) in resultados.items():
+        if not isinstance(respuesta, Exception):
+            valores = {"estado": "enviado", "proveedor_id": respuesta, "enviado_en": despues, "ultimo_error": None}
+            conteo["enviados"] += 1
+        elif fila.intentos >= MAX_INTENTOS:
+            valores = {"estado": "fallido", "ultimo_error": str(respuesta)[:500]}
+            conteo["fallidos"] += 1
+        else:
+            valores = {"estado": "pendiente", "ultimo_error": str(respuesta)[:500],
+                       "siguiente_intento": despues + _espera(fila.intentos)}
+            conteo["reintentos"] += 1
+        # Solo si sigue apartado: una cancelación durante el envío no se pisa
+        db.query(M).filter(M.id == mensaje_id, M.estado == "enviando").update(valores, synchronize_session=False)
+    db.commit()
+    return conteo
+
+def drenar():
+    """Entrada del trabajo periódico. Con una BD por clínica se recorre cada archivo."""
+    if not database.BD_POR_CLINICA:
+        db = database.SessionLocal()
+        try:
+            drenar_sesion(db)
+        finally:
+            db.close()
+        return
+
+    directorio = database.SessionLocal()
+    try:
+        tenants = [t.id for t in directorio.query(models.Tenant.id).filter(
+            models.Tenant.deleted_at == None, models.Tenant.whatsapp_enabled == True
+        ).all()]
+    finally:
+        directorio.close()
+    for tenant_id in tenants:
+        db = database.sesion_de_clinica(tenant_id)
+        try:
+            drenar_sesion(db)
+        except Exception:
+            db.rollback()
+            log.exception("No se pudo drenar la cola del tenant %s", tenant_id)
+        finally:
+            db.close()
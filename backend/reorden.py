@@ -0,0 +1,114 @@
+import logging
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+import database, models
+
+# --- PUNTOS DE REORDEN (TRABAJO NOCTURNO) ---
+# Convierte el kardex de salidas en una serie diaria por artículo y, con NumPy
+# sobre TODOS los artículos a la vez, calcula consumo suavizado, demanda durante
+# el tiempo de entrega, punto de reorden y cantidad sugerida a pedir.
+
+log = logging.getLogger("clinicsync.reorden")
+
+DIAS_HISTORIA = 90 # Ventana de consumo analizada
+ALFA = 0.1 # Suavizado exponencial (más alto = reacciona más rápido)
+LEAD_TIME_DIAS = 7 # Días que tarda el proveedor en surtir
+DIAS_REVISION = 30 # El pedido sugerido cubre este periodo
+Z_SERVICIO = 1.65 # ~95% de probabilidad de no quedarse sin stock
+
+def calcular_tenant(db: Session, tenant_id: int, hoy: datetime = None) -> int:
+    """Recalcula y guarda los puntos de reorden de un tenant. Devuelve cuántos artículos procesó."""
+    hoy = (hoy or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    # Solo días completos: de ayer hacia atrás (el día en curso sesgaría el suavizado a la baja)
+    inicio = hoy - timedelta(days=DIAS_HISTORIA)
+
+    items = db.query(models.InventoryItem.id, models.InventoryItem.stock).filter(
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryItem.deleted_at == None
+    ).order_by(models.InventoryItem.id).all()
+    if not items:
+        return 0
+
+    ids = np.array([i.id for i in items])
+    stock = np.array([i.stock or 0 for i in items], dtype=float)
+    fila_de = {item_id: n for n, item_id in enumerate(ids.tolist())}
+
+    # Consumo diario agregado en SQL (una fila por artículo y día con salidas)
+    dia = func.date(models.InventoryMovement.fecha)
+    consumos = db.query(
+        models.InventoryMovement.item_id, dia.label("dia"), func.sum(models.InventoryMovement.cantidad)
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == models.InventoryMovement.item_id
+    ).filter(
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryMovement.tipo == "salida",
+        models.InventoryMovement.fecha >= inicio,
+        models.InventoryMovement.fecha < hoy
+    ).group_by(models.InventoryMovement.item_id, dia).all()
+
+    serie = np.zeros((len(ids), DIAS_HISTORIA))
+    if consumos:
+        filas = np.array([fila_de.get(item_id, -1) for item_id, _, _ in consumos])
+        columnas = np.array([(datetime.strptime(str(d)[:10], "%Y-%m-%d") - inicio).days for _, d, _ in consumos])
+        cantidades = np.array([q or 0 for _, _, q in consumos], dtype=float)
+        validos = (filas >= 0) & (columnas >= 0) & (columnas < DIAS_HISTORIA)
+        np.add.at(serie, (filas[validos], columnas[validos]), cantidades[validos])
+
+    # EWMA como producto matricial: pesos (1-a)^k, el día más reciente pesa más
+    pesos = ALFA * (1 - ALFA) ** np.arange(DIAS_HISTORIA - 1, -1, -1)
+    pesos /= pesos.sum()
+    consumo = serie @ pesos
+    desviacion = np.sqrt(((serie - consumo[:, None]) ** 2) @ pesos)
+
+    demanda_lt = consumo * LEAD_TIME_DIAS
+    seguridad = Z_SERVICIO * desviacion * math.sqrt(LEAD_TIME_DIAS)
+    punto_reorden = np.ceil(demanda_lt + seguridad)
+    sugerida = np.maximum(np.ceil(punto_reorden + consumo * DIAS_REVISION - stock), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cobertura = np.where(consumo > 0, stock / consumo, np.nan)
+
+    calculado_en = datetime.now()
+    registros = [{
+        "item_id": int(ids[n]),
+        "tenant_id": tenant_id,
+        "consumo_diario": round(float(consumo[n]), 4),
+        "desviacion": round(float(desviacion[n]), 4),
+        "demanda_lead_time": round(float(demanda_lt[n]), 2),
+        "punto_reorden": int(punto_reorden[n]),
+        "cantidad_sugerida": int(sugerida[n]) if punto_reorden[n] > 0 else 0,
+        "dias_cobertura": None if np.isnan(cobertura[n]) else round(float(cobertura[n]), 1),
+        "calculado_en": calculado_en
+    } for n in range(len(ids))]
+
+    db.query(models.InventoryReorderPoint).filter(
+        models.InventoryReorderPoint.tenant_id == tenant_id
+    ).delete(synchronize_session=False)
+    db.execute(insert(models.InventoryReorderPoint), registros)
+    db.commit()
+    return len(registros)
+
+def recalcular_todos():
+    """Entrada del trabajo nocturno: un tenant a la vez para no retener la BD."""
+    directorio = database.SessionLocal()
+    try:
+        tenants = [t.id for t in directorio.query(models.Tenant.id).filter(models.Tenant.deleted_at == None).all()]
+    finally:
+        directorio.close()
+
+    for tenant_id in tenants:
+        db = database.sesion_de_clinica(tenant_id)
+        try:
+            calcular_tenant(db, tenant_id)
+        except Exception:
+            db.rollback()
+            log.exception("No se pudo calcular el reorden del tenant %s", tenant_id)
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    recalcular_todos()
@@ -0,0 +1,98 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+import database
+
+# --- RÉPLICAS DE SOLO LECTURA ---
+# Los reportes y consultas pesadas (CLINICSYNC_REPLICAS_URL) no compiten con caja
+# y consultorio por el pool del primario. Después de que un usuario escribe, sus
+# lecturas siguen yendo al primario unos segundos (lectura-de-lo-escrito), para
+# que no vea datos "viejos" mientras la réplica se pone al día.
+#
+# Probar en local con una copia SQLite:
+#   CLINICSYNC_REPLICAS_URL=sqlite:///./replica.db CLINICSYNC_REPLICA_COPIA_CADA=30
+# y la copia se refresca sola desde clinicsync.db (ver copiar_sqlite).
+
+VENTANA_PEGAJOSA = float(os.getenv("CLINICSYNC_REPLICA_VENTANA", "5")) # segundos
+COPIA_CADA = float(os.getenv("CLINICSYNC_REPLICA_COPIA_CADA", "0")) # 0 = réplica externa
+
+def _crear_engine(url: str):
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url, pool_pre_ping=True)
+
+_engines = [_crear_engine(url) for url in database.REPLICAS_URL]
+_turno = itertools.cycle(range(len(_engines))) if _engines else None
+_turno_lock = threading.Lock()
+
+class EscriturasRecientes:
+    """Última escritura por usuario; se limpia sola para no crecer sin límite."""
+
+    def __init__(self, ventana: float):
+        self.ventana = ventana
+        self._lock = threading.Lock()
+        self._ultima: Dict[str, float] = {}
+
+    def marcar(self, usuario: str):
+        ahora = time.monotonic()
+        with self._lock:
+            self._ultima[usuario] = ahora
+            if len(self._ultima) > 10000:
+                limite = ahora - self.ventana
+                self._ultima = {u: t for u, t in self._ultima.items() if t >= limite}
+
+    def reciente(self, usuario: Optional[str]) -> bool:
+        if not usuario:
+            return False
+        with self._lock:
+            t = self._ultima.get(usuario)
+        return t is not None and time.monotonic() - t < self.ventana
+
+escrituras = EscriturasRecientes(VENTANA_PEGAJOSA)
+
+def sesion_lectura(usuario: Optional[str]) -> Session:
+    if not _engines or escrituras.reciente(usuario):
+        return database.SessionLocal()
+    with _turno_lock:
+        engine = _engines[next(_turno)]
+    db = database.SessionLocal(bind=engine)
+    db.info["solo_lectura"] = True
+    return db
+
+# --- EVENTOS DE SESIÓN ---
+
+@event.listens_for(database.SessionLocal, "before_flush")
+def _proteger_replica(session, flush_context, instances):
+    if session.info.get("solo_lectura"):
+        raise RuntimeError("Intento de escritura en una sesión de réplica (use get_db en esta ruta)")
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _pegar_al_primario(session):
+    # Cualquier commit en el primario cuenta (también los UPDATE en bloque, que no pasan por flush)
+    usuario = session.info.get("usuario_escritura")
+    if usuario:
+        escrituras.marcar(usuario)
+
+# --- COPIA LOCAL (DESARROLLO) ---
+
+def copiar_sqlite():
+    """Refresca las réplicas SQLite con la API de respaldo en línea (no bloquea al primario)."""
+    origen_ruta = database.engine.url.database
+    for engine in _engines:
+        if engine.url.get_backend_name() != "sqlite":
+            continue
+        origen = sqlite3.connect(origen_ruta)
+        destino = sqlite3.connect(engine.url.database)
+        try:
+            origen.backup(destino, pages=1024)
+        finally:
+            destino.close()
+            origen.close()
+        engine.dispose() # Las conexiones viejas verían el archivo anterior
@@ -0,0 +1,233 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import and_, func, not_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import database, models, mensajeria, perfil_clinica
+
+# --- REPORTE DIARIO POR CLÍNICA ---
+# A la hora que cada clínica eligió (Tenant.hora_reporte_diario, hora local del
+# servidor) se le manda al doctor (doctor_phone) un resumen por WhatsApp:
+# agenda de mañana, ingresos de ayer, presupuestos por cobrar y stock bajo.
+# El trabajo revisa cada minuto qué clínicas ya tocan; los reportes se arman en
+# un pool de hilos para que mil clínicas a las 08:00 no se formen en fila.
+# La fila de daily_reports (única por clínica y día) es la que "aparta" el envío.
+# Si el envío falla (estado "error") o el proceso murió a la mitad ("generando"
+# viejo), la fila se vuelve a apartar dentro de la ventana, hasta MAX_INTENTOS.
+
+log = logging.getLogger("clinicsync.reporte_diario")
+
+HILOS = int(os.getenv("CLINICSYNC_REPORTE_HILOS", "4"))
+VENTANA_HORAS = 3 # Si el servidor estuvo caído, se manda tarde pero no al día siguiente
+MAX_CITAS_EN_TEXTO = 15
+MAX_INTENTOS = 3
+ESPERA_REINTENTO = timedelta(minutes=5) # Tras un intento fallido, antes del siguiente
+GENERANDO_VENCE = timedelta(minutes=15) # Un "generando" más viejo es un envío que se cayó
+
+# --- CONTENIDO ---
+
+def armar(db: Session, tenant_id: int, hoy: date) -> Dict[str, Any]:
+    manana = datetime.combine(hoy + timedelta(days=1), datetime.min.time())
+    ayer = datetime.combine(hoy - timedelta(days=1), datetime.min.time())
+    inicio_hoy = datetime.combine(hoy, datetime.min.time())
+
+    agenda = db.query(
+        models.Appointment.fecha_hora, models.Appointment.motivo,
+        models.Patient.nombre, models.Patient.apellidos, models.User.nombre_completo
+    ).outerjoin(
+        models.Patient, models.Patient.id == models.Appointment.patient_id
+    ).outerjoin(
+        models.User, models.User.id == models.Appointment.doctor_id
+    ).filter(
+        models.Appointment.tenant_id == tenant_id,
+        models.Appointment.deleted_at == None,
+        models.Appointment.estado != "Cancelada",
+        models.Appointment.fecha_hora >= manana,
+        models.Appointment.fecha_hora < manana + timedelta(days=1)
+    ).order_by(models.Appointment.fecha_hora.asc()).all()
+
+    ingresos_total, ingresos_cobros = db.query(
+        func.coalesce(func.sum(models.Transaction.monto), 0.0), func.count(models.Transaction.id)
+    ).filter(
+        models.Transaction.tenant_id == tenant_id,
+        models.Transaction.tipo == "ingreso",
+        models.Transaction.deleted_at == None,
+        models.Transaction.created_at >= ayer,
+        models.Transaction.created_at < inicio_hoy
+    ).one()
+
+    por_cobrar_total, por_cobrar_cuantos = db.query(
+        func.coalesce(func.sum(models.Budget.monto_total), 0.0), func.count(models.Budget.id)
+    ).filter(
+        models.Budget.tenant_id == tenant_id,
+        models.Budget.deleted_at == None,
+        models.Budget.estado == "aprobado"
+    ).one()
+
+    # En o debajo del punto de reorden (trabajo nocturno) o ya sin existencia
+    stock_bajo = db.query(
+        models.InventoryItem.nombre, models.InventoryItem.stock, models.InventoryReorderPoint.punto_reorden
+    ).outerjoin(
+        models.InventoryReorderPoint, models.InventoryReorderPoint.item_id == models.InventoryItem.id
+    ).filter(
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryItem.deleted_at == None,
+        or_(
+            func.coalesce(models.InventoryItem.stock, 0) <= 0,
+            (models.InventoryReorderPoint.punto_reorden > 0) &
+            (models.InventoryItem.stock <= models.InventoryReorderPoint.punto_reorden)
+        )
+    ).order_by(models.InventoryItem.stock.asc(), models.InventoryItem.nombre).all()
+
+    return {
+        "fecha": hoy.isoformat(),
+        "agenda_manana": [{
+            "hora": fecha_hora.strftime("%H:%M"),
+            "paciente": f"{nombre} {apellidos}" if nombre else "Desconocido",
+            "doctor": doctor or "",
+            "motivo": motivo or ""
+        } for fecha_hora, motivo, nombre, apellidos, doctor in agenda],
+        "ingresos_ayer": {"total": round(float(ingresos_total), 2), "cobros": ingresos_cobros},
+        "presupuestos_por_cobrar": {"total": round(float(por_cobrar_total), 2), "cantidad": por_cobrar_cuantos},
+        "stock_bajo": [{"nombre": nombre, "stock": stock or 0, "punto_reorden": punto}
+                       for nombre, stock, punto in stock_bajo],
+    }
+
+def texto(reporte: Dict[str, Any], clinica: Dict[str, Any]) -> str:
+    lineas = [f"*{clinica['nombre_comercial'] or 'Clínica'}* - Resumen del {reporte['fecha']}", ""]
+
+    agenda = reporte["agenda_manana"]
+    lineas.append(f"📅 Mañana: {len(agenda)} cita(s)")
+    for cita in agenda[:MAX_CITAS_EN_TEXTO]:
+        lineas.append(f"  {cita['hora']} {cita['paciente']} - {cita['motivo']}")
+    if len(agenda) > MAX_CITAS_EN_TEXTO:
+        lineas.append(f"  ... y {len(agenda) - MAX_CITAS_EN_TEXTO} más")
+
+    ingresos = reporte["ingresos_ayer"]
+    lineas.append(f"💰 Ingresos de ayer: ${ingresos['total']:,.2f} ({ingresos['cobros']} cobro(s))")
+
+    pendientes = reporte["presupuestos_por_cobrar"]
+    lineas.append(f"🧾 Presupuestos por cobrar: {pendientes['cantidad']} (${pendientes['total']:,.2f})")
+
+    if reporte["stock_bajo"]:
+        lineas.append(f"📦 Stock bajo: {len(reporte['stock_bajo'])} artículo(s)")
+        for item in reporte["stock_bajo"][:10]:
+            lineas.append(f"  {item['nombre']}: {item['stock']}")
+    else:
+        lineas.append("📦 Inventario sin alertas")
+    return "\n".join(lineas)
+
+# --- ENVÍO ---
+
+def _reintentable(ahora: datetime):
+    """Filas del día que se pueden volver a apartar: error o "generando" abandonado, con intentos libres."""
+    R = models.DailyReport
+    return and_(R.intentos < MAX_INTENTOS, or_(
+        and_(R.estado == "error", or_(R.apartado_en == None, R.apartado_en <= ahora - ESPERA_REINTENTO)),
+        and_(R.estado == "generando", or_(R.apartado_en == None, R.apartado_en <= ahora - GENERANDO_VENCE))
+    ))
+
+def _apartar(tenant_id: int, hoy: date, destino: str, ahora: datetime) -> bool:
+    """
+    Inserta la fila del día; si ya existe solo se reaparta con un UPDATE condicionado
+    (así dos ciclos o dos procesos nunca mandan el mismo reporte a la vez).
+    """
+    db = database.SessionLocal()
+    try:
+        db.add(models.DailyReport(tenant_id=tenant_id, fecha=hoy, destino=destino, estado="generando",
+                                  intentos=1, apartado_en=ahora))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+    try:
+        R = models.DailyReport
+        reapartado = db.query(R).filter(R.tenant_id == tenant_id, R.fecha == hoy, _reintentable(ahora)).update({
+            "estado": "generando", "destino": destino, "intentos": R.intentos + 1, "apartado_en": ahora
+        }, synchronize_session=False)
+        db.commit()
+        return reapartado == 1
+    finally:
+        db.close()
+
+def _cerrar(tenant_id: int, hoy: date, estado: str, error: str = None):
+    db = database.SessionLocal()
+    try:
+        db.query(models.DailyReport).filter(
+            models.DailyReport.tenant_id == tenant_id, models.DailyReport.fecha == hoy
+        ).update({"estado": estado, "error": error, "enviado_en": datetime.now()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def generar_y_enviar(tenant_id: int, hoy: date) -> str:
+    try:
+        db = database.sesion_de_clinica(tenant_id)
+        try:
+            clinica = perfil_clinica.obtener(db, tenant_id)
+            reporte = armar(db, tenant_id, hoy)
+        finally:
+            db.close()
+        mensajeria.transporte().enviar(clinica["doctor_phone"], texto(reporte, clinica), clinica["whatsapp_number"])
+    except Exception as e:
+        _cerrar(tenant_id, hoy, "error", str(e)[:500])
+        raise
+    _cerrar(tenant_id, hoy, "enviado")
+    return "enviado"
+
+def pendientes(db: Session, ahora: datetime) -> List[tuple]:
+    """Clínicas con WhatsApp activo cuya hora ya pasó (dentro de la ventana) y sin reporte hoy (o con uno reintentable)."""
+    hoy = ahora.date()
+    ya_enviados = db.query(models.DailyReport.tenant_id).filter(
+        models.DailyReport.fecha == hoy, not_(_reintentable(ahora))
+    )
+    candidatas = db.query(
+        models.Tenant.id, models.Tenant.hora_reporte_diario, models.Tenant.doctor_phone
+    ).filter(
+        models.Tenant.deleted_at == None,
+        models.Tenant.estado == "activo",
+        models.Tenant.whatsapp_enabled == True,
+        models.Tenant.doctor_phone != None,
+        models.Tenant.id.notin_(ya_enviados)
+    ).all()
+
+    resultado = []
+    for tenant_id, hora, destino in candidatas:
+        try:
+            hh, mm = (int(x) for x in (hora or "08:00").split(":"))
+        except ValueError:
+            continue
+        programada = ahora.replace(hour=hh, minute=mm, second=0, microsecond=0)
+        if programada <= ahora < programada + timedelta(hours=VENTANA_HORAS):
+            resultado.append((tenant_id, destino))
+    return resultado
+
+def despachar(ahora: datetime = None) -> int:
+    """Entrada del trabajo de cada minuto. Devuelve cuántos reportes se enviaron."""
+    ahora = ahora or datetime.now()
+    hoy = ahora.date()
+    directorio = database.SessionLocal()
+    try:
+        turno = pendientes(directorio, ahora)
+    finally:
+        directorio.close()
+
+    apartados = [tenant_id for tenant_id, destino in turno if _apartar(tenant_id, hoy, destino, ahora)]
+    if not apartados:
+        return 0
+
+    enviados = 0
+    with ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="reporte-diario") as pool:
+        futuros = {pool.submit(generar_y_enviar, tenant_id, hoy): tenant_id for tenant_id in apartados}
+        for futuro, tenant_id in futuros.items():
+            try:
+                futuro.result()
+                enviados += 1
+            except Exception:
+                log.exception("No se pudo enviar el reporte diario del tenant %s", tenant_id)
+    return enviados
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+import json
+import database, models, security, paginacion, cambios
+
+router = APIRouter(prefix="/cambios", tags=["Bitácora de Cambios"])
+
+# --- SCHEMAS ---
+class CambioItem(BaseModel):
+    id: int
+    tabla: str
+    fila_id: Optional[int]
+    operacion: str
+    campos: Optional[List[str]]
+    creado_en: datetime
+
+class CambiosPagina(BaseModel):
+    cambios: List[CambioItem]
+    siguiente_cursor: Optional[str] = None # None = ya no hay más por ahora
+
+class CheckpointUpdate(BaseModel):
+    cursor: str
+
+def _solo_admin(current_user: models.User):
+    if current_user.rol != "admin": raise HTTPException(403, "Solo Admin")
+
+# --- ENDPOINTS ---
+
+@router.get("/", response_model=CambiosPagina)
+def leer_cambios(
+    cursor: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    tablas: Optional[str] = Query(None, description="Separadas por comas, ej. patients,appointments"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Cambios de la clínica posteriores al cursor, en orden. Sin cursor: desde el principio."""
+    _solo_admin(current_user)
+    desde = paginacion.decodificar_cursor_id(cursor) if cursor else 0
+    lista_tablas = [t.strip() for t in tablas.split(",") if t.strip()] if tablas else None
+    entradas = cambios.leer(db, desde, limit, current_user.tenant_id, lista_tablas)
+
+    return CambiosPagina(
+        cambios=[CambioItem(
+            id=e.id, tabla=e.tabla, fila_id=e.fila_id, operacion=e.operacion,
+            campos=json.loads(e.campos) if e.campos else None, creado_en=e.creado_en
+        ) for e in entradas],
+        siguiente_cursor=paginacion.codificar_cursor_id(entradas[-1].id) if entradas else cursor
+    )
+
+@router.get("/checkpoints/{consumidor}")
+def ver_checkpoint(
+    consumidor: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    _solo_admin(current_user)
+    ultimo = cambios.checkpoint(db, consumidor, current_user.tenant_id)
+    return {"consumidor": consumidor, "cursor": paginacion.codificar_cursor_id(ultimo) if ultimo else None}
+
+@router.put("/checkpoints/{consumidor}")
+def confirmar_checkpoint(
+    consumidor: str,
+    datos: CheckpointUpdate,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Guarda hasta dónde procesó el consumidor. Un cursor anterior al guardado no lo hace retroceder."""
+    _solo_admin(current_user)
+    if len(consumidor) > 50: raise HTTPException(400, "Nombre de consumidor demasiado largo")
+    vigente = cambios.confirmar(db, consumidor, paginacion.decodificar_cursor_id(datos.cursor), current_user.tenant_id)
+    return {"consumidor": consumidor, "cursor": paginacion.codificar_cursor_id(vigente)}
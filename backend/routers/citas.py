@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from typing import List
-import database, models, schemas, security
+from typing import List, Optional
+import database, models, schemas, security, eventos, recordatorios, json_rapido
 
 # Definimos el router.
 # IMPORTANTE: Al incluir esto en main.py, el prefix ya suele ser "/citas" o "/api/citas".
@@ -15,7 +15,7 @@ router = APIRouter(
 @router.get("/paciente/{patient_id}", response_model=List[schemas.AppointmentResponse])
 def ver_citas_paciente(
     patient_id: int,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_db_lectura),
     current_user: models.User = Depends(security.get_current_user)
 ):
     """
@@ -66,6 +66,10 @@ def agendar_cita(
         estado="programada" # Corregido a minúsculas para consistencia
     )
     db.add(db_appointment)
+    db.flush()
+    recordatorios.programar(db, db_appointment)
+    eventos.publicar_al_confirmar(db, current_user.tenant_id, "cita_creada",
+                                  eventos.datos_cita(db_appointment, f"{paciente.nombre} {paciente.apellidos}"))
     db.commit()
     db.refresh(db_appointment)
     return db_appointment
@@ -74,12 +78,16 @@ def agendar_cita(
 def ver_agenda(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(database.get_db),
+    fields: Optional[str] = Query(None, description="Campos a devolver, ej. id,fecha_hora,estado"),
+    db: Session = Depends(database.get_db_lectura),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    return db.query(models.Appointment).filter(
+    campos = json_rapido.campos_pedidos(fields, schemas.AppointmentResponse)
+    filas = db.query(*json_rapido.columnas(models.Appointment, schemas.AppointmentResponse, campos)).filter(
         models.Appointment.tenant_id == current_user.tenant_id
     ).order_by(models.Appointment.fecha_hora.asc()).offset(skip).limit(limit).all()
+    return json_rapido.responder(json_rapido.filas_a_dicts(filas, schemas.AppointmentResponse, campos=campos),
+                                 parcial=campos is not None)
 
 @router.delete("/{appointment_id}", status_code=status.HTTP_204_NO_CONTENT)
 def cancelar_cita(
@@ -95,6 +103,10 @@ def cancelar_cita(
     if not cita:
         raise HTTPException(status_code=404, detail="Cita no encontrada")
     
+    datos_evento = eventos.datos_cita(cita)
+    datos_evento["eliminada"] = True
+    eventos.publicar_al_confirmar(db, current_user.tenant_id, "cita_cancelada", datos_evento)
+    recordatorios.cancelar(db, current_user.tenant_id, cita.id)
     db.delete(cita)
     db.commit()
     return None
@@ -118,5 +130,8 @@ def actualizar_estado_cita(
         raise HTTPException(status_code=404, detail="Cita no encontrada")
     
     cita.estado = obj.estado
+    recordatorios.programar(db, cita) # Cancelada/atendida: se cancelan los pendientes
+    tipo_evento = "cita_cancelada" if obj.estado.lower().startswith("cancel") else "cita_estado"
+    eventos.publicar_al_confirmar(db, current_user.tenant_id, tipo_evento, eventos.datos_cita(cita))
     db.commit()
     return {"status": "updated", "nuevo_estado": cita.estado}
\ No newline at end of file
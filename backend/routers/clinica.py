@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
-import database, models, schemas, security
+import database, models, schemas, security, paginacion, recetas_pdf, eventos, stock, perfil_clinica, recordatorios
 import json
 from datetime import datetime, timedelta
 
@@ -37,6 +40,86 @@ class ConsultationInput(BaseModel):
     receta_texto: str
     finalizar: bool
     nuevos_archivos: List[Dict[str, Any]] = [] # Lista de archivos en Base64
+    servicios_realizados: List[schemas.BudgetItemCreate] = [] # Se descuentan sus materiales al finalizar
+
+# 3. Schemas para Historial Clínico paginado
+class HistorialVisita(BaseModel):
+    id: int
+    fecha_hora: datetime
+    motivo: Optional[str] = None
+    doctor_id: Optional[int] = None
+    nota_medica: Dict[str, Any]
+    signos_vitales: Dict[str, Any]
+    receta: str
+    archivos: List[Dict[str, Any]]
+
+class HistorialPagina(BaseModel):
+    visitas: List[HistorialVisita]
+    siguiente_cursor: Optional[str] = None
+
+# 4. Schema para Autoguardado por campos (PATCH)
+class NotaPatchInput(BaseModel):
+    base_version: int # Versión que el navegador tenía cuando empezó a editar
+    soap: Dict[str, str] = {} # Solo los campos SOAP que cambiaron
+    signos_vitales: Dict[str, Any] = {} # Solo los signos que cambiaron
+    receta_texto: Optional[str] = None # None = la receta no se tocó
+
+SOAP_VACIO = {"subjetivo": "", "objetivo": "", "analisis": "", "plan": ""}
+
+def _leer_json(valor, default: Dict[str, Any]) -> Dict[str, Any]:
+    """Columna JSON nativa (ya llega como dict) o texto JSON; si está vacía o rota, devuelve el default."""
+    if isinstance(valor, dict):
+        return valor
+    if not valor:
+        return dict(default)
+    try:
+        return json.loads(valor)
+    except ValueError:
+        return dict(default)
+
+def _cambios_nota(soap_actual: Dict[str, Any], vitales_actual: Dict[str, Any],
+                  soap_nuevo: Dict[str, Any], vitales_nuevo: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compara campo por campo y devuelve solo lo que realmente cambió,
+    con llaves planas: {"soap.plan": "...", "vitales.ta": "..."}.
+    """
+    cambios = {}
+    for campo, valor in soap_nuevo.items():
+        if soap_actual.get(campo) != valor:
+            cambios[f"soap.{campo}"] = valor
+    for campo, valor in vitales_nuevo.items():
+        if vitales_actual.get(campo) != valor:
+            cambios[f"vitales.{campo}"] = valor
+    return cambios
+
+def _registrar_revision(db: Session, nota_id: int, version: int, user_id: int, cambios: Dict[str, Any]):
+    db.add(models.ClinicalNoteRevision(
+        note_id=nota_id,
+        version=version,
+        user_id=user_id,
+        cambios=json.dumps(cambios, separators=(",", ":"))
+    ))
+
+def _conflicto_nota(db: Session, nota: models.ClinicalNote, base_version: int, cambios_cliente: Dict[str, Any]):
+    """
+    Arma la respuesta 409: qué cambió en el servidor desde base_version y qué campos
+    chocan con lo que manda el cliente, para que el navegador pueda fusionar y reintentar.
+    """
+    revisiones = db.query(models.ClinicalNoteRevision).filter(
+        models.ClinicalNoteRevision.note_id == nota.id,
+        models.ClinicalNoteRevision.version > base_version
+    ).order_by(models.ClinicalNoteRevision.version.asc()).all()
+
+    cambios_servidor = {}
+    for r in revisiones:
+        cambios_servidor.update(_leer_json(r.cambios, {}))
+
+    return HTTPException(409, detail={
+        "mensaje": "La nota fue modificada en otra pestaña o equipo",
+        "version_actual": nota.version,
+        "cambios_servidor": cambios_servidor,
+        "campos_en_conflicto": sorted(set(cambios_cliente) & set(cambios_servidor))
+    })
 
 # --- ENDPOINTS EXISTENTES (AGENDA) ---
 
@@ -44,7 +127,7 @@ class ConsultationInput(BaseModel):
 def obtener_agenda(
     start_date: str, 
     end_date: str,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_db_lectura),
     current_user: models.User = Depends(security.get_current_user)
 ):
     try:
@@ -101,28 +184,29 @@ def agendar_cita(
         estado="Agendada"
     )
     db.add(nueva_cita)
+    db.flush()
+    recordatorios.programar(db, nueva_cita)
+    eventos.publicar_al_confirmar(db, current_user.tenant_id, "cita_creada",
+                                  eventos.datos_cita(nueva_cita, f"{paciente.nombre} {paciente.apellidos}"))
     db.commit()
     db.refresh(nueva_cita)
     return nueva_cita
 
 # --- ENDPOINTS NUEVOS (PARA CONSULTATION.JSX) ---
 
-@router.get("/citas/{cita_id}/datos-impresion")
-def obtener_datos_impresion(
-    cita_id: int,
-    db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(security.get_current_user)
-):
-    """
-    Obtiene los datos formateados para el encabezado de la receta médica.
-    """
-    cita = db.query(models.Appointment).filter(models.Appointment.id == cita_id).first()
-    if not cita: raise HTTPException(404, "Cita no encontrada")
-    
-    doctor = db.query(models.User).filter(models.User.id == cita.doctor_id).first()
-    paciente = db.query(models.Patient).filter(models.Patient.id == cita.patient_id).first()
-    tenant = db.query(models.Tenant).filter(models.Tenant.id == current_user.tenant_id).first()
+def _consulta_impresion(db: Session, tenant_id: int):
+    """Cita + Doctor + Paciente + Receta en UNA sola consulta (la clínica sale del caché de perfiles)."""
+    return db.query(
+        models.Appointment, models.User, models.Patient, models.Prescription
+    ).outerjoin(
+        models.User, models.User.id == models.Appointment.doctor_id
+    ).outerjoin(
+        models.Patient, models.Patient.id == models.Appointment.patient_id
+    ).outerjoin(
+        models.Prescription, models.Prescription.appointment_id == models.Appointment.id
+    ).filter(models.Appointment.tenant_id == tenant_id)
 
+def _armar_datos_impresion(doctor, paciente, clinica) -> Dict[str, Any]:
     return {
         "doctor": {
             "nombre": doctor.nombre_completo if doctor else "Dr. No Asignado",
@@ -131,9 +215,9 @@ def obtener_datos_impresion(
             "especialidad": doctor.especialidad if doctor else ""
         },
         "clinica": {
-            "nombre": tenant.nombre_comercial if tenant else "Clínica",
-            "direccion": tenant.direccion_fiscal if tenant else "",
-            "telefono": tenant.telefono_contacto if tenant else ""
+            "nombre": clinica["nombre_comercial"] if clinica else "Clínica",
+            "direccion": clinica["direccion_fiscal"] if clinica else "",
+            "telefono": clinica["telefono_contacto"] if clinica else ""
         },
         "paciente": {
             "nombre": f"{paciente.nombre} {paciente.apellidos}" if paciente else "Desconocido",
@@ -141,6 +225,105 @@ def obtener_datos_impresion(
         }
     }
 
+def _datos_receta_pdf(cita, doctor, paciente, receta, clinica) -> Dict[str, Any]:
+    """Todo lo que se imprime en la receta; de aquí sale la huella del PDF."""
+    datos = _armar_datos_impresion(doctor, paciente, clinica)
+    datos["fecha"] = cita.fecha_hora.strftime("%d/%m/%Y") if cita.fecha_hora else ""
+    datos["receta"] = receta.texto_medicamentos if receta else ""
+    return datos
+
+def _url_receta(huella: str) -> str:
+    return f"/clinica/recetas/{huella}.pdf"
+
+@router.get("/citas/{cita_id}/datos-impresion")
+def obtener_datos_impresion(
+    cita_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Obtiene los datos formateados para el encabezado de la receta médica.
+    """
+    fila = _consulta_impresion(db, current_user.tenant_id).filter(models.Appointment.id == cita_id).first()
+    if not fila: raise HTTPException(404, "Cita no encontrada")
+
+    cita, doctor, paciente, receta = fila
+    return _armar_datos_impresion(doctor, paciente, perfil_clinica.obtener(db, current_user.tenant_id))
+
+@router.get("/citas/{cita_id}/receta.pdf")
+def descargar_receta_pdf(
+    cita_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    PDF de la receta generado en el servidor. Se guarda con el hash de su contenido,
+    así que las reimpresiones salen directo del disco.
+    """
+    fila = _consulta_impresion(db, current_user.tenant_id).filter(models.Appointment.id == cita_id).first()
+    if not fila: raise HTTPException(404, "Cita no encontrada")
+
+    cita, doctor, paciente, receta = fila
+    if not receta: raise HTTPException(404, "La cita no tiene receta")
+
+    clinica = perfil_clinica.obtener(db, current_user.tenant_id)
+    huella, ruta = recetas_pdf.obtener_o_generar(current_user.tenant_id, _datos_receta_pdf(*fila, clinica))
+    if receta.pdf_url != _url_receta(huella):
+        receta.pdf_url = _url_receta(huella)
+        db.commit()
+
+    return FileResponse(ruta, media_type="application/pdf", filename=f"receta_{cita_id}.pdf")
+
+@router.post("/recetas/lote")
+def generar_recetas_del_dia(
+    fecha: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Impresión masiva de fin de día: genera (en paralelo) las recetas que falten
+    y devuelve la URL de cada PDF. Las que ya existían no se vuelven a renderizar.
+    """
+    try:
+        inicio = datetime.strptime(fecha, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(400, "Formato de fecha inválido. Use YYYY-MM-DD")
+
+    filas = _consulta_impresion(db, current_user.tenant_id).filter(
+        models.Prescription.id != None,
+        models.Appointment.fecha_hora >= inicio,
+        models.Appointment.fecha_hora < inicio + timedelta(days=1),
+        models.Appointment.deleted_at == None
+    ).order_by(models.Appointment.fecha_hora.asc()).all()
+
+    clinica = perfil_clinica.obtener(db, current_user.tenant_id)
+    generados = recetas_pdf.obtener_o_generar_lote(
+        current_user.tenant_id, [_datos_receta_pdf(*f, clinica) for f in filas]
+    )
+
+    resultado = []
+    for (cita, doctor, paciente, receta), (huella, ruta) in zip(filas, generados):
+        receta.pdf_url = _url_receta(huella)
+        resultado.append({
+            "cita_id": cita.id,
+            "paciente": f"{paciente.nombre} {paciente.apellidos}" if paciente else "Desconocido",
+            "pdf_url": receta.pdf_url
+        })
+    db.commit()
+    return resultado
+
+@router.get("/recetas/{huella}.pdf")
+def ver_receta_en_cache(
+    huella: str,
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Sirve un PDF ya generado (la carpeta es por tenant, no se cruzan clínicas)."""
+    if len(huella) != 64 or any(ch not in "0123456789abcdef" for ch in huella):
+        raise HTTPException(404, "Receta no encontrada")
+    ruta = recetas_pdf.ruta_receta(current_user.tenant_id, huella)
+    if not ruta.exists(): raise HTTPException(404, "Receta no encontrada")
+    return FileResponse(ruta, media_type="application/pdf")
+
 @router.get("/citas/{cita_id}/completa")
 def obtener_consulta_completa(
     cita_id: int,
@@ -154,16 +337,11 @@ def obtener_consulta_completa(
     receta = db.query(models.Prescription).filter(models.Prescription.appointment_id == cita_id).first()
     archivos = db.query(models.AppointmentFile).filter(models.AppointmentFile.appointment_id == cita_id).all()
     
-    soap_data = { "subjetivo": "", "objetivo": "", "analisis": "", "plan": "" }
-    
-    if nota and nota.soap_data:
-        try:
-            soap_data = json.loads(nota.soap_data)
-        except:
-            pass # Si falla el parseo, enviamos vacio
+    soap_data = _leer_json(nota.soap_data if nota else None, SOAP_VACIO)
 
     return {
         "nota_medica": soap_data,
+        "version": nota.version if nota else 0,
         "receta": receta.texto_medicamentos if receta else "",
         "archivos": [{"id": f.id, "nombre": f.nombre_archivo, "url": f.url_archivo} for f in archivos]
     }
@@ -183,34 +361,49 @@ def guardar_progreso_soap(
     # 1. Guardar/Actualizar Nota SOAP
     nota = db.query(models.ClinicalNote).filter(models.ClinicalNote.appointment_id == cita_id).first()
     
-    soap_json = json.dumps({
+    soap_nuevo = {
         "subjetivo": data.subjetivo,
         "objetivo": data.objetivo,
         "analisis": data.analisis,
         "plan": data.plan
-    })
-    
-    signos_json = json.dumps(data.signos_vitales)
-
-    if nota:
-        nota.soap_data = soap_json
-        nota.signos_vitales = signos_json
-    else:
-        new_nota = models.ClinicalNote(
+    }
+    if not nota:
+        nota = models.ClinicalNote(
             appointment_id=cita_id,
-            soap_data=soap_json,
-            signos_vitales=signos_json
+            soap_data=dict(SOAP_VACIO),
+            signos_vitales={},
+            version=0
         )
-        db.add(new_nota)
+        try:
+            with db.begin_nested():
+                db.add(nota)
+        except IntegrityError:
+            # Otra pestaña creó la nota al mismo tiempo (índice único por cita): guardamos sobre la suya
+            nota = db.query(models.ClinicalNote).filter(models.ClinicalNote.appointment_id == cita_id).first()
+
+    cambios = _cambios_nota(
+        _leer_json(nota.soap_data, SOAP_VACIO), _leer_json(nota.signos_vitales, {}),
+        soap_nuevo, data.signos_vitales
+    )
+    nota.soap_data = soap_nuevo
+    nota.signos_vitales = data.signos_vitales
 
     # 2. Guardar Receta
     receta = db.query(models.Prescription).filter(models.Prescription.appointment_id == cita_id).first()
+    if (receta.texto_medicamentos if receta else "") != data.receta_texto:
+        cambios["receta"] = data.receta_texto
     if receta:
         receta.texto_medicamentos = data.receta_texto
     else:
         new_receta = models.Prescription(appointment_id=cita_id, texto_medicamentos=data.receta_texto)
         db.add(new_receta)
 
+    # Subimos la versión para que el autoguardado de otras pestañas detecte el cambio
+    if cambios:
+        nota.version = (nota.version or 0) + 1
+        db.flush()
+        _registrar_revision(db, nota.id, nota.version, current_user.id, cambios)
+
     # 3. Guardar Archivos (Imágenes)
     # Nota: Aquí guardamos la metadata. En un entorno real, guardarías el base64 en disco o S3.
     # Para este ejemplo, simulamos guardar la URL apuntando a un endpoint de archivos.
@@ -227,13 +420,118 @@ def guardar_progreso_soap(
         db.add(nuevo_archivo)
 
     # 4. Finalizar Cita
+    inventario = None
     if data.finalizar:
         cita = db.query(models.Appointment).filter(models.Appointment.id == cita_id).first()
         if cita:
+            # Los materiales se descuentan una sola vez, al pasar a Finalizada
+            if cita.estado != "Finalizada" and data.servicios_realizados:
+                inventario = stock.consumir_servicios(
+                    db, cita.tenant_id, current_user.id,
+                    [(s.service_id, s.cantidad) for s in data.servicios_realizados],
+                    motivo=f"Consumo consulta #{cita_id}",
+                    patient_id=cita.patient_id, origen="cita", referencia_id=cita_id
+                )
             cita.estado = "Finalizada"
+            eventos.publicar_al_confirmar(db, cita.tenant_id, "cita_estado", eventos.datos_cita(cita))
 
     db.commit()
-    return {"status": "success"}
+    return {"status": "success", "inventario": inventario}
+
+@router.patch("/citas/{cita_id}/nota-soap")
+def autoguardar_nota_soap(
+    cita_id: int,
+    data: NotaPatchInput,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Autoguardado por campos. El navegador manda solo lo que cambió y la versión
+    sobre la que editó; si otra pestaña guardó antes, respondemos 409 con los
+    cambios del servidor para fusionar. Solo se reescriben las columnas tocadas.
+    """
+    campos_invalidos = set(data.soap) - set(SOAP_VACIO)
+    if campos_invalidos:
+        raise HTTPException(400, f"Campos SOAP inválidos: {', '.join(sorted(campos_invalidos))}")
+
+    nota = db.query(models.ClinicalNote).join(models.Appointment).filter(
+        models.ClinicalNote.appointment_id == cita_id,
+        models.Appointment.tenant_id == current_user.tenant_id
+    ).first()
+
+    if not nota:
+        cita = db.query(models.Appointment.id).filter(
+            models.Appointment.id == cita_id,
+            models.Appointment.tenant_id == current_user.tenant_id
+        ).first()
+        if not cita: raise HTTPException(404, "Cita no encontrada")
+        if data.base_version != 0:
+            raise HTTPException(409, detail={
+                "mensaje": "La nota ya no existe en el servidor",
+                "version_actual": 0,
+                "cambios_servidor": {},
+                "campos_en_conflicto": []
+            })
+        nota = models.ClinicalNote(
+            appointment_id=cita_id,
+            soap_data=dict(SOAP_VACIO),
+            signos_vitales={},
+            version=0
+        )
+        try:
+            with db.begin_nested():
+                db.add(nota)
+        except IntegrityError:
+            # Otra pestaña creó la nota al mismo tiempo (índice único por cita): se fusiona como conflicto
+            db.rollback()
+            nota = db.query(models.ClinicalNote).filter(models.ClinicalNote.appointment_id == cita_id).first()
+            raise _conflicto_nota(db, nota, 0, _cambios_nota(SOAP_VACIO, {}, data.soap, data.signos_vitales))
+
+    soap_actual = _leer_json(nota.soap_data, SOAP_VACIO)
+    vitales_actual = _leer_json(nota.signos_vitales, {})
+    cambios = _cambios_nota(soap_actual, vitales_actual, data.soap, data.signos_vitales)
+
+    receta = None
+    if data.receta_texto is not None:
+        receta = db.query(models.Prescription).filter(models.Prescription.appointment_id == cita_id).first()
+        if (receta.texto_medicamentos if receta else "") != data.receta_texto:
+            cambios["receta"] = data.receta_texto
+
+    if nota.version != data.base_version:
+        db.rollback()
+        raise _conflicto_nota(db, nota, data.base_version, cambios)
+
+    if not cambios:
+        db.rollback()
+        return {"status": "sin cambios", "version": nota.version, "campos": []}
+
+    # Solo reescribimos las columnas que tienen campos modificados
+    valores = {models.ClinicalNote.version: models.ClinicalNote.version + 1}
+    if any(k.startswith("soap.") for k in cambios):
+        valores[models.ClinicalNote.soap_data] = {**soap_actual, **data.soap}
+    if any(k.startswith("vitales.") for k in cambios):
+        valores[models.ClinicalNote.signos_vitales] = {**vitales_actual, **data.signos_vitales}
+
+    # UPDATE condicionado a la versión: si otra petición ganó la carrera, no afecta filas
+    filas = db.query(models.ClinicalNote).filter(
+        models.ClinicalNote.id == nota.id,
+        models.ClinicalNote.version == data.base_version
+    ).update(valores, synchronize_session=False)
+    if filas == 0:
+        db.rollback()
+        nota = db.query(models.ClinicalNote).filter(models.ClinicalNote.appointment_id == cita_id).first()
+        raise _conflicto_nota(db, nota, data.base_version, cambios)
+
+    if "receta" in cambios:
+        if receta:
+            receta.texto_medicamentos = data.receta_texto
+        else:
+            db.add(models.Prescription(appointment_id=cita_id, texto_medicamentos=data.receta_texto))
+
+    nueva_version = data.base_version + 1
+    _registrar_revision(db, nota.id, nueva_version, current_user.id, cambios)
+    db.commit()
+    return {"status": "success", "version": nueva_version, "campos": sorted(cambios)}
 
 # --- UTILERÍAS DE ESTADO (TU CÓDIGO ORIGINAL) ---
 
@@ -246,6 +544,8 @@ def iniciar_consulta(
     cita = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
     if not cita: raise HTTPException(404, "Cita no encontrada")
     cita.estado = "En proceso" 
+    recordatorios.programar(db, cita)
+    eventos.publicar_al_confirmar(db, cita.tenant_id, "cita_estado", eventos.datos_cita(cita))
     db.commit()
     return {"mensaje": "Consulta iniciada", "estado": "En proceso"}
 
@@ -259,22 +559,67 @@ def cancelar_cita(
     if not cita: raise HTTPException(404, "Cita no encontrada")
     
     cita.estado = "Cancelada"
+    recordatorios.programar(db, cita)
+    eventos.publicar_al_confirmar(db, cita.tenant_id, "cita_cancelada", eventos.datos_cita(cita))
     db.commit()
     return {"mensaje": "Cita cancelada"}
-@router.get("/pacientes/{patient_id}/historial-clinico-completo")
+@router.get("/pacientes/{patient_id}/historial-clinico-completo", response_model=HistorialPagina)
 def historial_clinico_completo(
     patient_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
     """
-    Este endpoint une Citas + Notas + Recetas en un solo listado 
-    para el historial del paciente.
+    Une Citas + Notas + Signos + Recetas + Archivos en un solo listado
+    para el historial del paciente, paginado por (fecha_hora, id) descendente.
+    Cada relación se carga con UNA consulta por página (selectinload), no una por cita.
     """
-    return db.query(models.Appointment).options(
-        joinedload(models.Appointment.clinical_record),
-        joinedload(models.Appointment.clinical_record)
+    query = db.query(models.Appointment).options(
+        selectinload(models.Appointment.clinical_record),
+        selectinload(models.Appointment.receta),
+        selectinload(models.Appointment.archivos)
     ).filter(
+        models.Appointment.tenant_id == current_user.tenant_id,
         models.Appointment.patient_id == patient_id,
-        models.Appointment.estado == "Finalizada"
-    ).order_by(models.Appointment.fecha_hora.desc()).all()
\ No newline at end of file
+        models.Appointment.estado == "Finalizada",
+        models.Appointment.fecha_hora != None,
+        models.Appointment.deleted_at == None
+    )
+
+    if cursor:
+        fecha_cursor, id_cursor = paginacion.decodificar_cursor(cursor)
+        query = query.filter(or_(
+            models.Appointment.fecha_hora < fecha_cursor,
+            and_(models.Appointment.fecha_hora == fecha_cursor, models.Appointment.id < id_cursor)
+        ))
+
+    # Pedimos una fila extra para saber si hay otra página sin hacer COUNT(*)
+    citas = query.order_by(
+        models.Appointment.fecha_hora.desc(),
+        models.Appointment.id.desc()
+    ).limit(limit + 1).all()
+
+    hay_mas = len(citas) > limit
+    citas = citas[:limit]
+
+    visitas = []
+    for c in citas:
+        nota = c.clinical_record
+        visitas.append(HistorialVisita(
+            id=c.id,
+            fecha_hora=c.fecha_hora,
+            motivo=c.motivo,
+            doctor_id=c.doctor_id,
+            nota_medica=_leer_json(nota.soap_data if nota else None, SOAP_VACIO),
+            signos_vitales=_leer_json(nota.signos_vitales if nota else None, {}),
+            receta=c.receta.texto_medicamentos if c.receta else "",
+            archivos=[{"id": f.id, "nombre": f.nombre_archivo, "url": f.url_archivo} for f in c.archivos]
+        ))
+
+    siguiente = None
+    if hay_mas and citas:
+        siguiente = paginacion.codificar_cursor(citas[-1].fecha_hora, citas[-1].id)
+
+    return HistorialPagina(visitas=visitas, siguiente_cursor=siguiente)
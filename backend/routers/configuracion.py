@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-import database, models, security
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import date
+import database, models, security, perfil_clinica, reporte_diario
 
 router = APIRouter(prefix="/configuracion", tags=["Módulo Configuración"])
 
@@ -13,19 +15,38 @@ class ClinicSettingsUpdate(BaseModel):
     direccion_fiscal: str
     telefono_contacto: str
 
+# Schema para el reporte diario por WhatsApp
+class ReporteDiarioConfig(BaseModel):
+    hora_reporte_diario: str = Field(pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    whatsapp_enabled: bool
+    whatsapp_number: Optional[str] = None
+    doctor_phone: Optional[str] = None
+
 # --- ENDPOINTS ---
 
 @router.get("/mi-clinica")
 def ver_mi_clinica(
+    request: Request,
+    response: Response,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    """Obtiene los datos de la clínica del usuario actual."""
+    """
+    Obtiene los datos de la clínica del usuario actual (desde el caché de perfiles).
+    Con If-None-Match y la versión vigente responde 304 sin cuerpo.
+    """
     if not current_user.tenant_id:
         raise HTTPException(400, detail="Usuario no asociado a una clínica")
-        
-    tenant = db.query(models.Tenant).filter(models.Tenant.id == current_user.tenant_id).first()
-    return tenant
+
+    perfil = perfil_clinica.obtener(db, current_user.tenant_id)
+    if not perfil: raise HTTPException(404, "Clínica no encontrada")
+
+    etag = perfil_clinica.etag(perfil)
+    cabeceras = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cabeceras)
+    response.headers.update(cabeceras)
+    return perfil
 
 @router.put("/mi-clinica")
 def actualizar_mi_clinica(
@@ -45,6 +66,61 @@ def actualizar_mi_clinica(
     tenant.direccion_fiscal = datos.direccion_fiscal
     tenant.telefono_contacto = datos.telefono_contacto
     
+    db.commit() # Sube la versión del perfil y lo saca del caché
+    return {"mensaje": "Configuración actualizada correctamente", "data": perfil_clinica.obtener(db, tenant.id)}
+
+# --- REPORTE DIARIO ---
+
+@router.put("/reporte-diario")
+def configurar_reporte_diario(
+    datos: ReporteDiarioConfig,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Hora y teléfono del resumen diario que se manda por WhatsApp."""
+    if current_user.rol != "admin":
+        raise HTTPException(403, detail="Solo el Administrador puede editar la configuración")
+    if datos.whatsapp_enabled and not datos.doctor_phone:
+        raise HTTPException(400, "Indique el teléfono del doctor para recibir el reporte")
+
+    tenant = db.query(models.Tenant).filter(models.Tenant.id == current_user.tenant_id).first()
+    tenant.hora_reporte_diario = datos.hora_reporte_diario
+    tenant.whatsapp_enabled = datos.whatsapp_enabled
+    tenant.whatsapp_number = datos.whatsapp_number
+    tenant.doctor_phone = datos.doctor_phone
     db.commit()
-    db.refresh(tenant)
-    return {"mensaje": "Configuración actualizada correctamente", "data": tenant}
\ No newline at end of file
+    return {"mensaje": "Reporte diario configurado", "data": perfil_clinica.obtener(db, tenant.id)}
+
+@router.get("/reporte-diario/vista-previa")
+def ver_reporte_diario(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """El reporte de hoy tal como se enviaría (no lo envía)."""
+    if current_user.rol != "admin":
+        raise HTTPException(403, detail="Solo Admin")
+    clinica = perfil_clinica.obtener(db, current_user.tenant_id)
+    reporte = reporte_diario.armar(db, current_user.tenant_id, date.today())
+    return {"reporte": reporte, "texto": reporte_diario.texto(reporte, clinica)}
+
+# --- COLA DE MENSAJES (RECORDATORIOS) ---
+
+@router.get("/mensajes")
+def ver_cola_mensajes(
+    estado: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Últimos recordatorios de la clínica y su estado de envío."""
+    if current_user.rol != "admin":
+        raise HTTPException(403, detail="Solo Admin")
+    query = db.query(models.OutboundMessage).filter(models.OutboundMessage.tenant_id == current_user.tenant_id)
+    if estado:
+        query = query.filter(models.OutboundMessage.estado == estado)
+    mensajes = query.order_by(models.OutboundMessage.id.desc()).limit(limit).all()
+    return [{
+        "id": m.id, "appointment_id": m.appointment_id, "destino": m.destino, "texto": m.texto,
+        "programado_para": m.programado_para, "estado": m.estado, "intentos": m.intentos,
+        "ultimo_error": m.ultimo_error, "enviado_en": m.enviado_en
+    } for m in mensajes]
@@ -0,0 +1,48 @@
+import asyncio
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import database, security, eventos
+
+router = APIRouter(prefix="/eventos", tags=["Eventos en Vivo"])
+
+LATIDO_SEGUNDOS = 15 # Mantiene viva la conexión a través de proxies
+
+def _tenant_del_token(token: str) -> int:
+    # Validamos y soltamos la conexión a BD de inmediato: el stream puede durar horas
+    db = database.SessionLocal()
+    try:
+        return security.usuario_desde_token(token, db).tenant_id
+    finally:
+        db.close()
+
+@router.get("/agenda")
+async def escuchar_agenda(token: str, request: Request):
+    """
+    Server-Sent Events de la clínica del usuario: cita_creada, cita_estado,
+    cita_cancelada. El token va en la URL porque EventSource no manda headers.
+    """
+    # La consulta a BD es bloqueante: en un hilo, no en el event loop
+    tenant_id = await run_in_threadpool(_tenant_del_token, token)
+
+    sub = eventos.broker.suscribir(tenant_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    mensaje = await asyncio.wait_for(sub.cola.get(), timeout=LATIDO_SEGUNDOS)
+                    yield mensaje
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            eventos.broker.cancelar(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -3,8 +3,9 @@ from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime, timedelta
+from collections import defaultdict
 from sqlalchemy import func
-import database, models, schemas, security
+import database, models, schemas, security, stock, json_rapido
 
 router = APIRouter(prefix="/finanzas", tags=["Módulos D y E: Finanzas y Caja"])
 
@@ -203,15 +204,24 @@ def cobrar_presupuesto(pago: schemas.PaymentCreate, db: Session = Depends(databa
         nomina = models.DoctorCommission(doctor_id=doc.id, transaction_id=trx.id, monto_comision=comision, estado_pago="pendiente")
         db.add(nomina)
 
+    # Descontamos del inventario los materiales de los servicios cobrados (todo o nada),
+    # salvo lo que ya se descontó al finalizar la consulta del paciente (ver stock.py)
+    inventario = stock.consumir_servicios(
+        db, current_user.tenant_id, current_user.id,
+        [(item.service_id, item.cantidad) for item in budget.items],
+        motivo=f"Consumo presupuesto #{budget.id}",
+        patient_id=budget.patient_id, origen="presupuesto", referencia_id=budget.id
+    )
+
     db.commit()
-    return {"mensaje": "Cobro registrado"}
+    return {"mensaje": "Cobro registrado", "inventario": inventario}
 
 # --- 4. REPORTES Y CORTE (ACTUALIZADO CON DETALLE) ---
 @router.get("/reporte-ventas", response_model=List[ReporteVentaItem])
 def reporte_ventas(
     start_date: str, 
     end_date: str,   
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_db_lectura),
     current_user: models.User = Depends(security.get_current_user)
 ):
     try:
@@ -219,10 +229,13 @@ def reporte_ventas(
         end = datetime.strptime(end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
     except: raise HTTPException(400, "Fecha inválida")
 
-    # Traemos transacciones con sus relaciones (paciente, presupuesto -> items -> servicio)
-    ventas = db.query(models.Transaction).options(
-        joinedload(models.Transaction.paciente),
-        joinedload(models.Transaction.presupuesto).joinedload(models.Budget.items).joinedload(models.BudgetItem.servicio)
+    # Solo columnas (sin hidratar objetos ORM): transacción + nombre del paciente
+    ventas = db.query(
+        models.Transaction.created_at, models.Transaction.metodo_pago, models.Transaction.monto,
+        models.Transaction.appointment_id, models.Transaction.budget_id,
+        models.Patient.nombre, models.Patient.apellidos
+    ).outerjoin(
+        models.Patient, models.Patient.id == models.Transaction.patient_id
     ).filter(
         models.Transaction.tenant_id == current_user.tenant_id,
         models.Transaction.tipo == "ingreso",
@@ -230,19 +243,29 @@ def reporte_ventas(
         models.Transaction.created_at <= end
     ).order_by(models.Transaction.created_at.desc()).all()
 
+    # Conceptos de los presupuestos cobrados: una consulta por bloque de 500 presupuestos
+    conceptos = defaultdict(list)
+    presupuestos = sorted({v.budget_id for v in ventas if v.budget_id})
+    for inicio in range(0, len(presupuestos), 500):
+        items = db.query(
+            models.BudgetItem.budget_id, models.ServiceCatalog.nombre, models.BudgetItem.cantidad
+        ).outerjoin(
+            models.ServiceCatalog, models.ServiceCatalog.id == models.BudgetItem.service_id
+        ).filter(
+            models.BudgetItem.budget_id.in_(presupuestos[inicio:inicio + 500])
+        ).order_by(models.BudgetItem.id)
+        for budget_id, nombre_srv, cantidad in items:
+            conceptos[budget_id].append(f"{nombre_srv or 'Servicio'} (x{cantidad})")
+
     reporte = []
     for v in ventas:
         nombre_paciente = "General"
-        if v.paciente: nombre_paciente = f"{v.paciente.nombre} {v.paciente.apellidos}"
+        if v.nombre: nombre_paciente = f"{v.nombre} {v.apellidos}"
         
         # Construir string de concepto detallado
         concepto_detalle = "Pago General"
-        if v.presupuesto and v.presupuesto.items:
-            items_nombres = []
-            for item in v.presupuesto.items:
-                nombre_srv = item.servicio.nombre if item.servicio else "Servicio"
-                items_nombres.append(f"{nombre_srv} (x{item.cantidad})")
-            concepto_detalle = ", ".join(items_nombres)
+        if conceptos.get(v.budget_id):
+            concepto_detalle = ", ".join(conceptos[v.budget_id])
         elif v.appointment_id:
             concepto_detalle = f"Consulta #{v.appointment_id}"
 
@@ -253,7 +276,7 @@ def reporte_ventas(
             "metodo_pago": v.metodo_pago,
             "monto": v.monto
         })
-    return reporte
+    return json_rapido.responder(reporte)
 
 @router.post("/caja/corte", response_model=CorteCajaResponse)
 def realizar_corte_z(datos: CorteCajaRequest, db: Session = Depends(database.get_db), current_user: models.User = Depends(security.get_current_user)):
@@ -287,7 +310,7 @@ def realizar_corte_z(datos: CorteCajaRequest, db: Session = Depends(database.get
     return { "fecha": nuevo_corte.fecha, "monto_sistema": monto_sistema, "monto_real": datos.monto_final_real, "diferencia": diferencia, "estado": estado }
 
 @router.get("/caja/cortes", response_model=List[CorteCajaHistoryItem])
-def historial_cortes(start_date: str, end_date: str, db: Session = Depends(database.get_db), current_user: models.User = Depends(security.get_current_user)):
+def historial_cortes(start_date: str, end_date: str, db: Session = Depends(database.get_db_lectura), current_user: models.User = Depends(security.get_current_user)):
     try:
         start = datetime.strptime(start_date, "%Y-%m-%d")
         end = datetime.strptime(end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import and_, or_, case, func, insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
-from pydantic import BaseModel
-from datetime import datetime
-import database, models, security
+from pydantic import BaseModel, ValidationError
+from datetime import datetime, timedelta
+import database, models, security, paginacion, stock, tabulares, valuacion, json_rapido
 
 router = APIRouter(prefix="/inventario", tags=["Módulo D: Inventarios"])
 
@@ -25,6 +28,28 @@ class StockMovementRequest(BaseModel):
     cantidad: int
     tipo: str 
     motivo: str = "Ajuste manual"
+    costo_unitario: Optional[float] = None # Solo entradas: costo de compra (default: costo de catálogo)
+
+class MovimientoLoteItem(BaseModel):
+    item_id: int
+    cantidad: int
+    tipo: str # entrada | salida
+    costo_unitario: Optional[float] = None
+
+class LoteMovimientosRequest(BaseModel):
+    movimientos: List[MovimientoLoteItem]
+    motivo: str = "Escaneo"
+
+class ReordenItem(BaseModel):
+    item_id: int
+    nombre: str
+    sku: str
+    stock: int
+    punto_reorden: int
+    cantidad_sugerida: int
+    consumo_diario: float
+    dias_cobertura: Optional[float] = None
+    calculado_en: datetime
 
 class ItemResponse(BaseModel):
     id: int
@@ -44,6 +69,29 @@ class MovementResponse(BaseModel):
     item_nombre: str
     sku: str
     usuario_nombre: str # <--- NUEVO CAMPO
+
+class KardexMovimiento(BaseModel):
+    id: int
+    fecha: datetime
+    tipo: str
+    cantidad: int
+    saldo: int # Existencia después de este movimiento
+    item_id: int
+    item_nombre: str
+    sku: str
+    usuario_nombre: str
+
+class KardexPagina(BaseModel):
+    movimientos: List[KardexMovimiento]
+    siguiente_cursor: Optional[str] = None
+
+# Cómo afecta cada tipo de movimiento a la existencia
+def _signo_movimiento():
+    return case(
+        (models.InventoryMovement.tipo == "entrada", models.InventoryMovement.cantidad),
+        (models.InventoryMovement.tipo == "salida", -models.InventoryMovement.cantidad),
+        else_=0
+    )
     
 # --- ENDPOINTS ---
 
@@ -68,7 +116,8 @@ def crear_item(
         sku=item.sku,
         unidad=item.unidad,
         stock=item.stock_inicial,
-        costo=item.costo
+        costo=item.costo,
+        costo_promedio=item.costo
     )
     db.add(nuevo)
     db.commit()
@@ -80,6 +129,7 @@ def crear_item(
             user_id=current_user.id, # Registramos al creador
             tipo="entrada",
             cantidad=item.stock_inicial,
+            costo_unitario=item.costo,
             fecha=datetime.now()
         )
         db.add(kardex)
@@ -89,13 +139,17 @@ def crear_item(
 
 @router.get("/items", response_model=List[ItemResponse])
 def ver_inventario(
+    fields: Optional[str] = Query(None, description="Campos a devolver, ej. id,nombre,stock"),
     db: Session = Depends(database.get_db), 
     current_user: models.User = Depends(security.get_current_user)
 ):
-    return db.query(models.InventoryItem).filter(
+    campos = json_rapido.campos_pedidos(fields, ItemResponse)
+    filas = db.query(*json_rapido.columnas(models.InventoryItem, ItemResponse, campos)).filter(
         models.InventoryItem.tenant_id == current_user.tenant_id,
         models.InventoryItem.deleted_at == None
     ).all()
+    return json_rapido.responder(json_rapido.filas_a_dicts(filas, ItemResponse, campos=campos),
+                                 parcial=campos is not None)
 
 
 # --- NUEVO: EDITAR ITEM ---
@@ -121,7 +175,11 @@ def actualizar_item(
     item.unidad = datos.unidad
     item.costo = datos.costo
     
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(400, "El código SKU ya existe")
     return {"mensaje": "Producto actualizado"}
 
 # --- NUEVO: ELIMINAR ITEM ---
@@ -152,58 +210,441 @@ def registrar_movimiento(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    item = db.query(models.InventoryItem).filter(
+    if mov.cantidad <= 0: raise HTTPException(400, "La cantidad debe ser mayor a cero")
+
+    existe = db.query(models.InventoryItem.id).filter(
         models.InventoryItem.id == item_id,
-        models.InventoryItem.tenant_id == current_user.tenant_id
+        models.InventoryItem.tenant_id == current_user.tenant_id,
+        models.InventoryItem.deleted_at == None
     ).first()
-    
-    if not item: raise HTTPException(404, "Item no encontrado")
+    if not existe: raise HTTPException(404, "Item no encontrado")
 
-    if mov.tipo == 'entrada':
-        item.stock += mov.cantidad
-    elif mov.tipo == 'salida':
-        if item.stock < mov.cantidad:
-            raise HTTPException(400, f"Stock insuficiente. Tienes {item.stock}")
-        item.stock -= mov.cantidad
+    # El stock nunca se lee y reescribe desde Python: el UPDATE condicional
+    # decide en la BD, así dos salidas simultáneas no pueden dejarlo negativo.
+    try:
+        if mov.tipo == 'entrada':
+            stock.aplicar_entradas(
+                db, current_user.tenant_id, current_user.id, {item_id: mov.cantidad}, mov.motivo,
+                costos={item_id: mov.costo_unitario}
+            )
+        elif mov.tipo == 'salida':
+            stock.descontar(db, current_user.tenant_id, current_user.id, {item_id: mov.cantidad}, mov.motivo)
+        else:
+            db.add(models.InventoryMovement(
+                item_id=item_id,
+                user_id=current_user.id, # <--- REGISTRAMOS QUIÉN FUE
+                tipo=mov.tipo,
+                cantidad=mov.cantidad,
+                motivo=mov.motivo,
+                fecha=datetime.now()
+            ))
+    except stock.StockInsuficiente as e:
+        db.rollback()
+        raise HTTPException(400, f"Stock insuficiente. Tienes {e.faltantes[0]['disponible']}")
+    except stock.ArticuloNoEncontrado:
+        db.rollback()
+        raise HTTPException(404, "Item no encontrado")
 
-    kardex = models.InventoryMovement(
-        item_id=item.id,
-        user_id=current_user.id, # <--- REGISTRAMOS QUIÉN FUE
-        tipo=mov.tipo,
-        cantidad=mov.cantidad,
-        fecha=datetime.now()
-    )
-    db.add(kardex)
     db.commit()
-    
-    return {"mensaje": "Stock actualizado", "nuevo_stock": item.stock}
+    nuevo_stock = stock.existencias(db, current_user.tenant_id, [item_id]).get(item_id, 0)
+    return {"mensaje": "Stock actualizado", "nuevo_stock": nuevo_stock}
+
+@router.post("/movimientos/lote")
+def registrar_movimientos_lote(
+    lote: LoteMovimientosRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Muchos artículos en una sola llamada (ej. sesión de escaneo de códigos).
+    Se agrupan por artículo y se aplican con un UPDATE condicional por tipo:
+    si alguna salida no alcanza, no se aplica nada y se devuelven los faltantes.
+    """
+    entradas, salidas, valor_entradas = {}, {}, {}
+    for m in lote.movimientos:
+        if m.cantidad <= 0: raise HTTPException(400, "La cantidad debe ser mayor a cero")
+        if m.tipo == "entrada":
+            entradas[m.item_id] = entradas.get(m.item_id, 0) + m.cantidad
+            if m.costo_unitario is not None:
+                valor_entradas[m.item_id] = valor_entradas.get(m.item_id, 0.0) + m.cantidad * m.costo_unitario
+        elif m.tipo == "salida":
+            salidas[m.item_id] = salidas.get(m.item_id, 0) + m.cantidad
+        else:
+            raise HTTPException(400, f"Tipo inválido: {m.tipo}")
+
+    try:
+        # Varias entradas del mismo artículo a distinto costo se agrupan a su costo promedio
+        costos = {item_id: valor / entradas[item_id] for item_id, valor in valor_entradas.items()}
+        stock.aplicar_entradas(db, current_user.tenant_id, current_user.id, entradas, lote.motivo, costos=costos)
+        stock.descontar(db, current_user.tenant_id, current_user.id, salidas, lote.motivo)
+    except stock.StockInsuficiente as e:
+        db.rollback()
+        raise HTTPException(409, detail={"mensaje": "Stock insuficiente", "faltantes": e.faltantes})
+    except stock.ArticuloNoEncontrado:
+        db.rollback()
+        raise HTTPException(404, "Algún artículo del lote no existe en esta clínica")
+
+    db.commit()
+    return {
+        "mensaje": "Movimientos registrados",
+        "existencias": stock.existencias(db, current_user.tenant_id, set(entradas) | set(salidas))
+    }
 
 @router.get("/movimientos", response_model=List[MovementResponse])
 def ver_historial_movimientos(
     limit: int = 50,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_db_lectura),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    movimientos = db.query(models.InventoryMovement).join(models.InventoryItem).options(
-        joinedload(models.InventoryMovement.usuario) # Cargamos usuario
+    # Movimiento + Artículo + Usuario en una sola consulta
+    filas = db.query(
+        models.InventoryMovement,
+        models.InventoryItem.nombre,
+        models.InventoryItem.sku,
+        models.User.nombre_completo
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == models.InventoryMovement.item_id
+    ).outerjoin(
+        models.User, models.User.id == models.InventoryMovement.user_id
     ).filter(
         models.InventoryItem.tenant_id == current_user.tenant_id
     ).order_by(models.InventoryMovement.fecha.desc()).limit(limit).all()
 
-    resultado = []
-    for m in movimientos:
-        item = db.query(models.InventoryItem).filter(models.InventoryItem.id == m.item_id).first()
-        # Obtenemos nombre de usuario de forma segura
-        nombre_usuario = m.usuario.nombre_completo if m.usuario else "Sistema"
-
-        resultado.append({
-            "id": m.id,
-            "fecha": m.fecha,
-            "tipo": m.tipo,
-            "cantidad": m.cantidad,
-            "item_nombre": item.nombre if item else "Desconocido",
-            "sku": item.sku if item else "-",
-            "usuario_nombre": nombre_usuario # <--- ENVIAMOS NOMBRE
-        })
-    
-    return resultado
\ No newline at end of file
+    return [{
+        "id": m.id,
+        "fecha": m.fecha,
+        "tipo": m.tipo,
+        "cantidad": m.cantidad,
+        "item_nombre": item_nombre or "Desconocido",
+        "sku": sku or "-",
+        "usuario_nombre": usuario_nombre or "Sistema" # <--- ENVIAMOS NOMBRE
+    } for m, item_nombre, sku, usuario_nombre in filas]
+
+@router.get("/kardex", response_model=KardexPagina)
+def ver_kardex(
+    item_id: Optional[int] = None,
+    tipo: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_db_lectura),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Kardex con saldo acumulado calculado en SQL (función de ventana por artículo),
+    del más reciente al más antiguo, paginado por (fecha, id).
+    El saldo se calcula sobre TODO el historial; los filtros solo recortan lo que se muestra.
+    """
+    try:
+        inicio = datetime.strptime(desde, "%Y-%m-%d") if desde else None
+        fin = datetime.strptime(hasta, "%Y-%m-%d") + timedelta(days=1) if hasta else None
+    except ValueError:
+        raise HTTPException(400, "Formato de fecha inválido. Use YYYY-MM-DD")
+
+    saldo = func.sum(_signo_movimiento()).over(
+        partition_by=models.InventoryMovement.item_id,
+        order_by=(models.InventoryMovement.fecha, models.InventoryMovement.id),
+        rows=(None, 0)
+    )
+
+    base = db.query(
+        models.InventoryMovement.id.label("id"),
+        models.InventoryMovement.fecha.label("fecha"),
+        models.InventoryMovement.tipo.label("tipo"),
+        models.InventoryMovement.cantidad.label("cantidad"),
+        models.InventoryMovement.item_id.label("item_id"),
+        models.InventoryMovement.user_id.label("user_id"),
+        saldo.label("saldo")
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == models.InventoryMovement.item_id
+    ).filter(models.InventoryItem.tenant_id == current_user.tenant_id)
+    if item_id is not None:
+        base = base.filter(models.InventoryMovement.item_id == item_id)
+    kardex = base.subquery()
+
+    query = db.query(
+        kardex,
+        models.InventoryItem.nombre,
+        models.InventoryItem.sku,
+        models.User.nombre_completo
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == kardex.c.item_id
+    ).outerjoin(
+        models.User, models.User.id == kardex.c.user_id
+    )
+
+    if tipo:
+        query = query.filter(kardex.c.tipo == tipo)
+    if inicio:
+        query = query.filter(kardex.c.fecha >= inicio)
+    if fin:
+        query = query.filter(kardex.c.fecha < fin)
+    if cursor:
+        fecha_cursor, id_cursor = paginacion.decodificar_cursor(cursor)
+        query = query.filter(or_(
+            kardex.c.fecha < fecha_cursor,
+            and_(kardex.c.fecha == fecha_cursor, kardex.c.id < id_cursor)
+        ))
+
+    filas = query.order_by(kardex.c.fecha.desc(), kardex.c.id.desc()).limit(limit + 1).all()
+    hay_mas = len(filas) > limit
+    filas = filas[:limit]
+
+    movimientos = [KardexMovimiento(
+        id=f.id,
+        fecha=f.fecha,
+        tipo=f.tipo,
+        cantidad=f.cantidad,
+        saldo=f.saldo or 0,
+        item_id=f.item_id,
+        item_nombre=f.nombre or "Desconocido",
+        sku=f.sku or "-",
+        usuario_nombre=f.nombre_completo or "Sistema"
+    ) for f in filas]
+
+    siguiente = None
+    if hay_mas and filas:
+        siguiente = paginacion.codificar_cursor(filas[-1].fecha, filas[-1].id)
+    return KardexPagina(movimientos=movimientos, siguiente_cursor=siguiente)
+
+# --- ALERTAS DE REORDEN ---
+@router.get("/reorden", response_model=List[ReordenItem])
+def ver_articulos_por_pedir(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Artículos cuyo stock actual está en o debajo de su punto de reorden.
+    Lee la tabla precalculada por el trabajo nocturno (reorden.py).
+    """
+    filas = db.query(models.InventoryItem, models.InventoryReorderPoint).join(
+        models.InventoryReorderPoint, models.InventoryReorderPoint.item_id == models.InventoryItem.id
+    ).filter(
+        models.InventoryItem.tenant_id == current_user.tenant_id,
+        models.InventoryItem.deleted_at == None,
+        models.InventoryReorderPoint.punto_reorden > 0,
+        models.InventoryItem.stock <= models.InventoryReorderPoint.punto_reorden
+    ).order_by(models.InventoryItem.nombre).all()
+
+    return [ReordenItem(
+        item_id=item.id,
+        nombre=item.nombre,
+        sku=item.sku,
+        stock=item.stock or 0,
+        punto_reorden=r.punto_reorden,
+        cantidad_sugerida=r.cantidad_sugerida,
+        consumo_diario=r.consumo_diario,
+        # La cobertura se ajusta al stock de hoy, no al de la noche anterior
+        dias_cobertura=round((item.stock or 0) / r.consumo_diario, 1) if r.consumo_diario else None,
+        calculado_en=r.calculado_en
+    ) for item, r in filas]
+
+@router.post("/reorden/recalcular")
+def recalcular_reorden(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Corre el cálculo nocturno ahora mismo, solo para esta clínica."""
+    if current_user.rol != "admin": raise HTTPException(403, "Solo Admin")
+    import reorden # NumPy solo se carga cuando se usa
+    procesados = reorden.calcular_tenant(db, current_user.tenant_id)
+    return {"mensaje": "Puntos de reorden recalculados", "articulos": procesados}
+
+# --- VALUACIÓN Y COSTO DE LO CONSUMIDO ---
+@router.get("/valuacion")
+def ver_valuacion(
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    db: Session = Depends(database.get_db_lectura),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Valor del inventario al inicio y fin del periodo y costo de lo consumido (COGS),
+    leído de las fotos diarias. Por defecto: del día 1 del mes a ayer.
+    """
+    if current_user.rol not in ["admin", "dentista"]: raise HTTPException(403, "No tienes permisos")
+    ayer = datetime.now().date() - timedelta(days=1)
+    try:
+        fin = datetime.strptime(hasta, "%Y-%m-%d").date() if hasta else ayer
+        inicio = datetime.strptime(desde, "%Y-%m-%d").date() if desde else fin.replace(day=1)
+    except ValueError:
+        raise HTTPException(400, "Formato de fecha inválido. Use YYYY-MM-DD")
+    if inicio > fin: raise HTTPException(400, "La fecha inicial es posterior a la final")
+
+    return valuacion.resumen(db, current_user.tenant_id, inicio, fin)
+
+@router.post("/valuacion/recalcular")
+def recalcular_valuacion(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Toma ahora las fotos pendientes hasta ayer, solo para esta clínica."""
+    if current_user.rol != "admin": raise HTTPException(403, "Solo Admin")
+    dias = valuacion.fotos_pendientes(db, current_user.tenant_id)
+    return {"mensaje": "Valuación actualizada", "dias": dias}
+
+@router.get("/costo-servicios")
+def ver_costo_servicios(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Costo de materiales y margen de cada servicio con lista de materiales."""
+    if current_user.rol not in ["admin", "dentista"]: raise HTTPException(403, "No tienes permisos")
+    return valuacion.costo_materiales_servicios(db, current_user.tenant_id)
+
+# --- IMPORTACIÓN / EXPORTACIÓN MASIVA ---
+BLOQUE_IMPORTACION = 500
+MAX_ERRORES_REPORTADOS = 200
+COLUMNAS_EXPORTACION = ["sku", "nombre", "unidad", "stock", "costo"]
+
+def _item_desde_fila(fila: dict) -> ItemCreate:
+    return ItemCreate(
+        sku=str(fila.get("sku") or "").strip(),
+        nombre=str(fila.get("nombre") or "").strip(),
+        unidad=str(fila.get("unidad") or "pieza").strip(),
+        stock_inicial=fila.get("stock_inicial", fila.get("stock")) or 0,
+        costo=fila.get("costo") or 0.0
+    )
+
+@router.post("/importar")
+def importar_inventario(
+    archivo: UploadFile = File(...),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Alta masiva de artículos desde CSV/XLSX (columnas: sku, nombre, unidad, stock, costo).
+    El archivo se lee en streaming y por bloques: una consulta para validar todos los SKU
+    del bloque contra la clínica, un INSERT para los artículos y otro para su kardex inicial.
+    Los SKU repetidos se omiten y se reportan. Si el archivo se corta a la mitad (codificación,
+    archivo dañado) se guarda todo lo leído hasta ahí y se responde 422 con el resultado parcial.
+    """
+    if current_user.rol not in ["admin", "dentista", "medico"]:
+        raise HTTPException(403, "No tienes permisos")
+
+    creados, omitidos, errores = 0, 0, []
+
+    def reportar(numero: int, sku, error: str):
+        if len(errores) < MAX_ERRORES_REPORTADOS:
+            errores.append({"fila": numero, "sku": sku, "error": error})
+
+    corte = []
+    def filas_legibles():
+        try:
+            yield from tabulares.leer_filas(archivo, numerar=True)
+        except tabulares.ArchivoIlegible as e:
+            corte.append(e) # Termina la iteración: el último bloque incompleto sí se procesa
+
+    vistos = set()
+    for bloque in tabulares.en_bloques(filas_legibles(), BLOQUE_IMPORTACION):
+        validos = []
+        for numero, fila in bloque:
+            try:
+                item = _item_desde_fila(fila)
+            except ValidationError as e:
+                omitidos += 1
+                reportar(numero, fila.get("sku"), e.errors()[0]["msg"])
+                continue
+            if not item.sku or not item.nombre:
+                omitidos += 1
+                reportar(numero, item.sku, "SKU y nombre son obligatorios")
+                continue
+            if item.sku in vistos:
+                omitidos += 1
+                reportar(numero, item.sku, "SKU repetido en el archivo")
+                continue
+            vistos.add(item.sku)
+            validos.append((numero, item))
+
+        if not validos:
+            continue
+
+        existentes = {sku for (sku,) in db.query(models.InventoryItem.sku).filter(
+            models.InventoryItem.tenant_id == current_user.tenant_id,
+            models.InventoryItem.sku.in_([item.sku for _, item in validos])
+        )}
+        nuevos = []
+        for numero, item in validos:
+            if item.sku in existentes:
+                omitidos += 1
+                reportar(numero, item.sku, "El código SKU ya existe")
+            else:
+                nuevos.append(item)
+        if not nuevos:
+            continue
+
+        insertados = db.execute(
+            insert(models.InventoryItem).returning(models.InventoryItem.id, models.InventoryItem.sku),
+            [{
+                "tenant_id": current_user.tenant_id,
+                "nombre": item.nombre,
+                "sku": item.sku,
+                "unidad": item.unidad,
+                "stock": item.stock_inicial,
+                "costo": item.costo,
+                "costo_promedio": item.costo
+            } for item in nuevos]
+        ).all()
+
+        id_por_sku = {sku: item_id for item_id, sku in insertados}
+        ahora = datetime.now()
+        kardex = [{
+            "item_id": id_por_sku[item.sku],
+            "user_id": current_user.id,
+            "tipo": "entrada",
+            "cantidad": item.stock_inicial,
+            "costo_unitario": item.costo,
+            "motivo": "Inventario inicial (importación)",
+            "fecha": ahora
+        } for item in nuevos if item.stock_inicial > 0]
+        if kardex:
+            db.execute(insert(models.InventoryMovement), kardex)
+
+        db.commit()
+        creados += len(nuevos)
+
+    resultado = {"creados": creados, "omitidos": omitidos, "errores": errores}
+    if corte:
+        return JSONResponse(status_code=422, content={"detail": f"Fila {corte[0].fila}: {corte[0].mensaje}", **resultado})
+    return resultado
+
+@router.get("/exportar")
+def exportar_inventario(
+    formato: str = "csv",
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Catálogo completo en CSV/XLSX, enviado mientras se lee de la BD (sin cargarlo todo)."""
+    formato = tabulares.formato_de(f"inventario.{formato}")
+    if formato == "xlsx":
+        tabulares.requiere_openpyxl()
+    tenant_id = current_user.tenant_id
+
+    def filas():
+        # Sesión propia: vive lo que dure el envío, no lo que dure el handler
+        db = database.sesion_de_clinica(tenant_id)
+        try:
+            query = db.query(
+                models.InventoryItem.sku, models.InventoryItem.nombre, models.InventoryItem.unidad,
+                models.InventoryItem.stock, models.InventoryItem.costo
+            ).filter(
+                models.InventoryItem.tenant_id == tenant_id,
+                models.InventoryItem.deleted_at == None
+            ).order_by(models.InventoryItem.id).yield_per(1000)
+            for fila in query:
+                yield tuple(fila)
+        finally:
+            db.close()
+
+    if formato == "csv":
+        contenido = tabulares.csv_en_streaming(COLUMNAS_EXPORTACION, filas())
+        media_type = "text/csv; charset=utf-8"
+    else:
+        contenido = tabulares.xlsx_en_streaming(COLUMNAS_EXPORTACION, filas())
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+    return StreamingResponse(
+        contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="inventario.{formato}"'}
+    )
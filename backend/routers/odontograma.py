@@ -0,0 +1,183 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import database, models, schemas, security, odontograma
+
+router = APIRouter(prefix="/odontograma", tags=["Módulo C: Odontograma"])
+
+REINTENTOS_ESCRITURA = 3 # Guardados simultáneos del mismo paciente antes de responder 409
+
+# --- UTILERÍAS ---
+
+def _validar_paciente(db: Session, patient_id: int, tenant_id: int):
+    paciente = db.query(models.Patient.id).filter(
+        models.Patient.id == patient_id,
+        models.Patient.tenant_id == tenant_id
+    ).first()
+    if not paciente: raise HTTPException(404, "Paciente no encontrado")
+
+def _replay(db: Session, patient_id: int, hasta_evento: int = None):
+    """
+    Última foto <= hasta_evento + los eventos posteriores a ella.
+    Como hay una foto cada SNAPSHOT_CADA eventos, el replay siempre es corto.
+    """
+    snap_query = db.query(models.DentalChartSnapshot).filter(models.DentalChartSnapshot.patient_id == patient_id)
+    if hasta_evento is not None:
+        snap_query = snap_query.filter(models.DentalChartSnapshot.ultimo_evento_id <= hasta_evento)
+    snap = snap_query.order_by(models.DentalChartSnapshot.ultimo_evento_id.desc()).first()
+
+    desde = snap.ultimo_evento_id if snap else 0
+    eventos_query = db.query(
+        models.DentalChart.id, models.DentalChart.diente, models.DentalChart.cara, models.DentalChart.estado
+    ).filter(
+        models.DentalChart.patient_id == patient_id,
+        models.DentalChart.id > desde
+    )
+    if hasta_evento is not None:
+        eventos_query = eventos_query.filter(models.DentalChart.id <= hasta_evento)
+    eventos = eventos_query.order_by(models.DentalChart.id.asc()).all()
+
+    estado = odontograma.aplicar(snap.estado if snap else None, [(e.diente, e.cara, e.estado) for e in eventos])
+    ultimo = eventos[-1].id if eventos else desde
+    return estado, ultimo, len(eventos)
+
+def _estado_actual(db: Session, patient_id: int) -> models.DentalChartState:
+    """Lee el odontograma actual (1 fila). Si el paciente tiene datos previos sin empaquetar, lo reconstruye una vez."""
+    actual = db.query(models.DentalChartState).filter(models.DentalChartState.patient_id == patient_id).first()
+    if actual:
+        return actual
+
+    estado, ultimo, pendientes = _replay(db, patient_id)
+    actual = models.DentalChartState(
+        patient_id=patient_id,
+        estado=estado,
+        ultimo_evento_id=ultimo,
+        eventos_desde_snapshot=pendientes
+    )
+    try:
+        with db.begin_nested():
+            db.add(actual)
+    except IntegrityError:
+        # Otra petición lo reconstruyó al mismo tiempo (PK patient_id): usamos el suyo
+        actual = db.query(models.DentalChartState).filter(models.DentalChartState.patient_id == patient_id).one()
+    return actual
+
+def _respuesta(patient_id: int, estado: bytes, ultimo_evento_id: int):
+    return {
+        "patient_id": patient_id,
+        "ultimo_evento_id": ultimo_evento_id,
+        "dientes": odontograma.desempaquetar(estado)
+    }
+
+# --- ENDPOINTS ---
+
+@router.get("/paciente/{patient_id}")
+def ver_odontograma_actual(
+    patient_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    _validar_paciente(db, patient_id, current_user.tenant_id)
+    actual = _estado_actual(db, patient_id)
+    db.commit()
+    return _respuesta(patient_id, actual.estado, actual.ultimo_evento_id)
+
+@router.get("/paciente/{patient_id}/cita/{cita_id}")
+def ver_odontograma_en_cita(
+    patient_id: int,
+    cita_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Cómo estaba el odontograma al terminar esa visita."""
+    cita = db.query(models.Appointment).filter(
+        models.Appointment.id == cita_id,
+        models.Appointment.patient_id == patient_id,
+        models.Appointment.tenant_id == current_user.tenant_id
+    ).first()
+    if not cita: raise HTTPException(404, "Cita no encontrada")
+
+    # Último evento registrado en esta visita o en alguna anterior
+    hasta = db.query(func.max(models.DentalChart.id)).join(
+        models.Appointment, models.Appointment.id == models.DentalChart.appointment_id
+    ).filter(
+        models.DentalChart.patient_id == patient_id,
+        models.Appointment.fecha_hora <= cita.fecha_hora
+    ).scalar() or 0
+
+    estado, ultimo, _ = _replay(db, patient_id, hasta)
+    return _respuesta(patient_id, estado, ultimo)
+
+@router.post("/paciente/{patient_id}/cita/{cita_id}")
+def registrar_cambios_odontograma(
+    patient_id: int,
+    cita_id: int,
+    datos: schemas.DentalChartCreate,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Agrega a la bitácora solo las caras que realmente cambian, actualiza el
+    odontograma actual y guarda una foto cada SNAPSHOT_CADA eventos.
+    """
+    cita = db.query(models.Appointment.id).filter(
+        models.Appointment.id == cita_id,
+        models.Appointment.patient_id == patient_id,
+        models.Appointment.tenant_id == current_user.tenant_id
+    ).first()
+    if not cita: raise HTTPException(404, "Cita no encontrada")
+
+    for _ in range(REINTENTOS_ESCRITURA):
+        actual = _estado_actual(db, patient_id)
+        leido = actual.ultimo_evento_id
+        estado = actual.estado
+
+        eventos = []
+        try:
+            for cambio in datos.cambios:
+                nuevo = odontograma.aplicar(estado, [(cambio.diente, cambio.cara, cambio.estado)])
+                if nuevo == estado:
+                    continue
+                estado = nuevo
+                eventos.append(models.DentalChart(
+                    patient_id=patient_id,
+                    appointment_id=cita_id,
+                    diente=cambio.diente,
+                    cara=cambio.cara.lower(),
+                    estado=cambio.estado.lower()
+                ))
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+
+        if not eventos:
+            db.commit()
+            return _respuesta(patient_id, actual.estado, leido)
+
+        db.add_all(eventos)
+        db.flush()
+
+        ultimo = eventos[-1].id
+        pendientes = (actual.eventos_desde_snapshot or 0) + len(eventos)
+        foto = pendientes >= odontograma.SNAPSHOT_CADA
+
+        # UPDATE condicionado al último evento leído: si otra petición (otra asistente, doble clic)
+        # guardó en medio, no afecta filas y repetimos sobre su estado en vez de pisar sus caras
+        escritas = db.query(models.DentalChartState).filter(
+            models.DentalChartState.patient_id == patient_id,
+            models.DentalChartState.ultimo_evento_id == leido
+        ).update({
+            "estado": estado,
+            "ultimo_evento_id": ultimo,
+            "eventos_desde_snapshot": 0 if foto else pendientes
+        }, synchronize_session=False)
+        if escritas == 0:
+            db.rollback() # También descarta nuestros eventos: se vuelven a calcular
+            continue
+
+        if foto:
+            db.add(models.DentalChartSnapshot(patient_id=patient_id, ultimo_evento_id=ultimo, estado=estado))
+        db.commit()
+        return _respuesta(patient_id, estado, ultimo)
+
+    raise HTTPException(409, "El odontograma se modificó al mismo tiempo desde otro equipo; intente de nuevo")
@@ -1,9 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_, cast, String, func
 from typing import List, Optional
-import database, models, schemas, security
-import json
+import database, models, schemas, security, json_rapido, columnas_json, importacion_pacientes
 from datetime import datetime
 
 router = APIRouter(prefix="/pacientes", tags=["Módulo B: Pacientes"])
@@ -15,7 +14,6 @@ def crear_paciente(
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    datos_json = json.dumps(paciente.datos_personales)
     nuevo = models.Patient(
         tenant_id=current_user.tenant_id,
         nombre=paciente.nombre,
@@ -25,7 +23,7 @@ def crear_paciente(
         telefono_movil=paciente.telefono_movil,
         email=paciente.email,
         ocupacion=paciente.ocupacion,
-        datos_personales=datos_json
+        datos_personales=paciente.datos_personales
     )
     db.add(nuevo)
     db.commit()
@@ -36,9 +34,11 @@ def crear_paciente(
 @router.get("/search", response_model=List[schemas.PatientResponse])
 def buscar_paciente_rapido(
     query: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Campos a devolver, ej. id,nombre,apellidos"),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
+    campos = json_rapido.campos_pedidos(fields, schemas.PatientResponse)
     # Si no hay query, devolvemos lista vacía
     if not query or len(query.strip()) == 0:
         return [] 
@@ -62,23 +62,160 @@ def buscar_paciente_rapido(
         )
         filtros_and.append(filtro_palabra)
 
-    # Combinamos todos los filtros con AND
-    return db.query(models.Patient).filter(
+    # Combinamos todos los filtros con AND (solo las columnas pedidas)
+    filas = db.query(*json_rapido.columnas(models.Patient, schemas.PatientResponse, campos)).filter(
         models.Patient.tenant_id == current_user.tenant_id,
         models.Patient.deleted_at == None,
         and_(*filtros_and) 
     ).limit(10).all()
+    return json_rapido.responder(json_rapido.filas_a_dicts(filas, schemas.PatientResponse, campos=campos),
+                                 parcial=campos is not None)
 
 # --- 3. LISTAR ---
 @router.get("/", response_model=List[schemas.PatientResponse])
 def listar_pacientes(
+    fields: Optional[str] = Query(None, description="Campos a devolver, ej. id,nombre,apellidos"),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
-    return db.query(models.Patient).filter(
+    campos = json_rapido.campos_pedidos(fields, schemas.PatientResponse)
+    filas = db.query(*json_rapido.columnas(models.Patient, schemas.PatientResponse, campos)).filter(
         models.Patient.tenant_id == current_user.tenant_id,
         models.Patient.deleted_at == None
     ).all()
+    return json_rapido.responder(json_rapido.filas_a_dicts(filas, schemas.PatientResponse, campos=campos),
+                                 parcial=campos is not None)
+
+# --- 3B. FILTRAR POR DATOS PERSONALES (JSON, resuelto en la BD) ---
+@router.get("/por-datos", response_model=List[schemas.PatientResponse])
+def filtrar_por_datos(
+    aseguradora: Optional[str] = Query(None),
+    tipo_sangre: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Campos a devolver, ej. id,nombre,apellidos"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(database.get_db_lectura),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Pacientes por llaves de datos_personales. Cada llave usa su índice de expresión."""
+    filtros = {"aseguradora": aseguradora, "tipo_sangre": tipo_sangre}
+    filtros = {nombre: valor for nombre, valor in filtros.items() if valor}
+    if not filtros:
+        raise HTTPException(400, f"Indica al menos un filtro: {', '.join(columnas_json.CLAVES_PACIENTE)}")
+
+    campos = json_rapido.campos_pedidos(fields, schemas.PatientResponse)
+    query = db.query(*json_rapido.columnas(models.Patient, schemas.PatientResponse, campos)).filter(
+        models.Patient.tenant_id == current_user.tenant_id,
+        models.Patient.deleted_at == None
+    )
+    for nombre, valor in filtros.items():
+        query = query.filter(columnas_json.clave(models.Patient.datos_personales, nombre) == valor)
+    filas = query.order_by(models.Patient.id).limit(limit).all()
+    return json_rapido.responder(json_rapido.filas_a_dicts(filas, schemas.PatientResponse, campos=campos),
+                                 parcial=campos is not None)
+
+@router.get("/por-datos/conteo")
+def contar_por_dato(
+    clave: str = Query(..., description="aseguradora o tipo_sangre"),
+    db: Session = Depends(database.get_db_lectura),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Cuántos pacientes hay por cada valor de la llave (ej. por aseguradora), agrupado en la BD."""
+    if clave not in columnas_json.CLAVES_PACIENTE:
+        raise HTTPException(400, f"Llave no válida. Disponibles: {', '.join(columnas_json.CLAVES_PACIENTE)}")
+    valor = columnas_json.clave(models.Patient.datos_personales, clave)
+    filas = db.query(valor, func.count(models.Patient.id)).filter(
+        models.Patient.tenant_id == current_user.tenant_id,
+        models.Patient.deleted_at == None
+    ).group_by(valor).order_by(func.count(models.Patient.id).desc()).all()
+    return [{"valor": v, "pacientes": n} for v, n in filas]
+
+# --- 3C. IMPORTACIÓN MASIVA (CSV/XLSX DESDE OTRO SISTEMA) ---
+class ImportacionResponse(schemas.BaseModel):
+    id: int
+    nombre_archivo: str
+    estado: str
+    filas_totales: Optional[int] = None
+    filas_leidas: int
+    porcentaje: Optional[float] = None
+    creados: int
+    omitidos: int
+    errores: List[dict] = []
+    error: Optional[str] = None
+    creado_en: datetime
+    terminado_en: Optional[datetime] = None
+
+def _importacion(job: models.PatientImportJob, con_errores: bool = True) -> dict:
+    porcentaje = None
+    if job.estado == "completado":
+        porcentaje = 100.0
+    elif job.filas_totales:
+        porcentaje = round(min(99.9, 100.0 * (job.filas_leidas or 0) / job.filas_totales), 1)
+    return {
+        "id": job.id, "nombre_archivo": job.nombre_archivo, "estado": job.estado,
+        "filas_totales": job.filas_totales, "filas_leidas": job.filas_leidas or 0, "porcentaje": porcentaje,
+        "creados": job.creados or 0, "omitidos": job.omitidos or 0,
+        "errores": (job.errores or []) if con_errores else [], "error": job.error,
+        "creado_en": job.creado_en, "terminado_en": job.terminado_en
+    }
+
+def _buscar_importacion(db: Session, importacion_id: int, tenant_id: int) -> models.PatientImportJob:
+    job = db.query(models.PatientImportJob).filter(
+        models.PatientImportJob.id == importacion_id,
+        models.PatientImportJob.tenant_id == tenant_id
+    ).first()
+    if not job: raise HTTPException(404, "Importación no encontrada")
+    return job
+
+@router.post("/importar", response_model=ImportacionResponse, status_code=status.HTTP_202_ACCEPTED)
+def importar_pacientes(
+    archivo: UploadFile = File(...),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Alta masiva desde CSV/XLSX. Columnas: nombre, apellidos, fecha_nacimiento, sexo,
+    telefono_movil, email, ocupacion, aseguradora, tipo_sangre y, para la historia
+    clínica: enfermedades, medicamentos, alergias, anticonceptivos, neurologico,
+    heredofamiliares, diagnostico, tratamiento. Responde de inmediato; el avance
+    se consulta en GET /pacientes/importaciones/{id}.
+    """
+    if current_user.rol != "admin":
+        raise HTTPException(403, "Solo Admin puede importar pacientes.")
+    job = importacion_pacientes.crear(db, archivo, current_user)
+    importacion_pacientes.iniciar(current_user.tenant_id, job.id)
+    return _importacion(job)
+
+@router.get("/importaciones", response_model=List[ImportacionResponse])
+def listar_importaciones(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Últimas importaciones de la clínica (sin el detalle de errores)."""
+    trabajos = db.query(models.PatientImportJob).filter(
+        models.PatientImportJob.tenant_id == current_user.tenant_id
+    ).order_by(models.PatientImportJob.id.desc()).limit(20).all()
+    return [_importacion(job, con_errores=False) for job in trabajos]
+
+@router.get("/importaciones/{importacion_id}", response_model=ImportacionResponse)
+def ver_importacion(
+    importacion_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    return _importacion(_buscar_importacion(db, importacion_id, current_user.tenant_id))
+
+@router.post("/importaciones/{importacion_id}/reanudar", response_model=ImportacionResponse)
+def reanudar_importacion(
+    importacion_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Continúa una importación fallida desde su último bloque guardado."""
+    if current_user.rol != "admin":
+        raise HTTPException(403, "Solo Admin puede importar pacientes.")
+    job = _buscar_importacion(db, importacion_id, current_user.tenant_id)
+    importacion_pacientes.reintentar(db, job)
+    return _importacion(job)
 
 # --- 4. OBTENER UNO (Ruta Dinámica) ---
 @router.get("/{patient_id}", response_model=schemas.PatientResponse)
@@ -117,7 +254,7 @@ def actualizar_paciente(
     paciente.fecha_nacimiento = datos.fecha_nacimiento
     paciente.sexo = datos.sexo
     paciente.ocupacion = datos.ocupacion
-    paciente.datos_personales = json.dumps(datos.datos_personales)
+    paciente.datos_personales = datos.datos_personales
 
     db.commit()
     db.refresh(paciente)
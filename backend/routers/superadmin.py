@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy import or_, func
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import Optional
-import database, models, security
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
+from datetime import datetime
+import database, models, schemas, security, paginacion, uso_clinicas, aprovisionamiento, compresion
 
 router = APIRouter(prefix="/superadmin", tags=["Super Admin"])
 
@@ -20,6 +22,57 @@ class TenantCreate(BaseModel):
     razon_social: Optional[str] = None
     direccion_fiscal: Optional[str] = None
 
+# --- ALTA MASIVA ---
+class PersonalAlta(BaseModel):
+    nombre_completo: str
+    email: EmailStr
+    password: str
+    rol: str # dentista, medico, recepcion...
+    cedula: Optional[str] = None
+    comision_default: float = 0.0
+
+class ArticuloPlantilla(BaseModel):
+    nombre: str
+    sku: str
+    unidad: str = "pieza"
+    stock_inicial: int = Field(0, ge=0)
+    costo: float = 0.0
+
+class ClinicaAlta(TenantCreate):
+    admin_email: EmailStr
+    personal: List[PersonalAlta] = []
+    servicios: List[schemas.ServiceCreate] = [] # Además de la plantilla común
+    inventario: List[ArticuloPlantilla] = []
+
+class AltaMasivaRequest(BaseModel):
+    clinicas: List[ClinicaAlta] = Field(..., min_length=1, max_length=500)
+    # Plantillas que reciben todas las clínicas del lote (ej. una franquicia)
+    servicios: List[schemas.ServiceCreate] = []
+    inventario: List[ArticuloPlantilla] = []
+
+class UsoClinica(BaseModel):
+    usuarios: int = 0
+    pacientes: int = 0
+    citas_mes: int = 0
+    ingresos_mes: float = 0.0
+    archivos: int = 0
+    almacenamiento_bytes: int = 0
+    calculado_en: Optional[datetime] = None
+
+class ClinicaDirectorio(BaseModel):
+    id: int
+    nombre_comercial: Optional[str] = None
+    razon_social: Optional[str] = None
+    rfc: Optional[str] = None
+    plan_suscripcion: Optional[str] = None
+    estado: Optional[str] = None
+    uso: Optional[UsoClinica] = None # None = aún no se calcula (clínica recién creada)
+
+class DirectorioPagina(BaseModel):
+    clinicas: List[ClinicaDirectorio]
+    total: int
+    siguiente_cursor: Optional[str] = None
+
 @router.post("/clinicas", status_code=status.HTTP_201_CREATED)
 def crear_clinica_v5(
     datos: TenantCreate, 
@@ -40,12 +93,11 @@ def crear_clinica_v5(
         rfc=datos.rfc,
         razon_social=razon_final,
         direccion_fiscal=direccion_final, # <--- Usamos el nombre correcto de la BD
-        config_ui_json='{"logo": null}',
+        config_ui_json={"logo": None},
         estado="activo"
     )
     db.add(nuevo_tenant)
-    db.commit()
-    db.refresh(nuevo_tenant)
+    db.flush() # Solo para obtener el id: clínica y admin se confirman juntos
 
     # 2. Crear Admin
     hashed_pwd = security.get_password_hash(datos.admin_password)
@@ -63,14 +115,95 @@ def crear_clinica_v5(
 
     return {"mensaje": "Clínica creada", "tenant_id": nuevo_tenant.id}
 
-@router.get("/clinicas")
+@router.post("/clinicas/lote", status_code=status.HTTP_201_CREATED)
+def crear_clinicas_en_lote(
+    datos: AltaMasivaRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Alta de muchas clínicas en una llamada: admin, personal, catálogo e inventario inicial.
+    Cada clínica se crea completa o no se crea; el resultado se reporta por clínica.
+    """
+    if current_user.rol != "super_admin":
+        raise HTTPException(status_code=403, detail="Acceso denegado.")
+
+    resultados = aprovisionamiento.provisionar(db, datos.clinicas, datos.servicios, datos.inventario)
+    creadas = sum(1 for r in resultados if r["ok"])
+    return {
+        "mensaje": f"{creadas} de {len(resultados)} clínicas creadas",
+        "creadas": creadas,
+        "resultados": resultados
+    }
+
+@router.get("/clinicas", response_model=DirectorioPagina)
 def listar_clinicas(
+    q: Optional[str] = None,
+    plan: Optional[str] = None,
+    estado: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=100),
+    cursor: Optional[str] = None,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
+    """
+    Directorio paginado (por id) y con búsqueda por nombre, razón social o RFC.
+    Cada clínica trae su uso precalculado: una sola consulta con LEFT JOIN a las estadísticas.
+    """
     if current_user.rol != "super_admin":
         raise HTTPException(status_code=403, detail="Acceso denegado.")
-    return db.query(models.Tenant).all()
+
+    filtros = [models.Tenant.deleted_at == None]
+    if q and q.strip():
+        for termino in q.strip().split():
+            term = f"%{termino.lower()}%"
+            filtros.append(or_(
+                func.lower(models.Tenant.nombre_comercial).like(term),
+                func.lower(models.Tenant.razon_social).like(term),
+                func.lower(models.Tenant.rfc).like(term)
+            ))
+    if plan: filtros.append(models.Tenant.plan_suscripcion == plan)
+    if estado: filtros.append(models.Tenant.estado == estado)
+
+    total = db.query(func.count(models.Tenant.id)).filter(*filtros).scalar()
+
+    query = db.query(models.Tenant, models.TenantUsageStats).outerjoin(
+        models.TenantUsageStats, models.TenantUsageStats.tenant_id == models.Tenant.id
+    ).filter(*filtros)
+    if cursor:
+        query = query.filter(models.Tenant.id > paginacion.decodificar_cursor_id(cursor))
+    filas = query.order_by(models.Tenant.id.asc()).limit(limit + 1).all()
+
+    siguiente = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        siguiente = paginacion.codificar_cursor_id(filas[-1][0].id)
+
+    clinicas = [ClinicaDirectorio(
+        id=t.id,
+        nombre_comercial=t.nombre_comercial,
+        razon_social=t.razon_social,
+        rfc=t.rfc,
+        plan_suscripcion=t.plan_suscripcion,
+        estado=t.estado,
+        uso=UsoClinica(
+            usuarios=uso.usuarios, pacientes=uso.pacientes, citas_mes=uso.citas_mes,
+            ingresos_mes=uso.ingresos_mes, archivos=uso.archivos,
+            almacenamiento_bytes=uso.almacenamiento_bytes, calculado_en=uso.calculado_en
+        ) if uso else None
+    ) for t, uso in filas]
+    return DirectorioPagina(clinicas=clinicas, total=total, siguiente_cursor=siguiente)
+
+@router.post("/clinicas/estadisticas/recalcular")
+def recalcular_estadisticas(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Corre ahora el cálculo periódico de uso."""
+    if current_user.rol != "super_admin":
+        raise HTTPException(status_code=403, detail="Acceso denegado.")
+    clinicas = uso_clinicas.calcular(db)
+    return {"mensaje": "Estadísticas actualizadas", "clinicas": clinicas}
 
 @router.get("/clinicas/{tenant_id}/usuarios")
 def ver_usuarios_por_clinica(
@@ -83,4 +216,17 @@ def ver_usuarios_por_clinica(
     
     # Buscamos usuarios que pertenezcan a ese ID
     users = db.query(models.User).filter(models.User.tenant_id == tenant_id).all()
-    return users
\ No newline at end of file
+    return users
+
+@router.get("/metricas/compresion")
+def ver_metricas_compresion(
+    reiniciar: bool = False,
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """Bytes ahorrados y CPU de compresión por ruta (de este proceso, desde que arrancó o se reinició)."""
+    if current_user.rol != "super_admin":
+        raise HTTPException(status_code=403, detail="Acceso denegado.")
+    resumen = compresion.metricas.resumen()
+    if reiniciar:
+        compresion.metricas.reiniciar()
+    return {"algoritmos_disponibles": compresion.DISPONIBLES, "rutas": resumen}
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel, EmailStr
-import database, models, security
+import database, models, security, json_rapido
 
 router = APIRouter(prefix="/usuarios", tags=["RRHH (Usuarios de Clínica)"])
 
@@ -40,14 +40,18 @@ class UserResponse(BaseModel):
 
 @router.get("/", response_model=List[UserResponse])
 def listar_personal(
+    fields: Optional[str] = Query(None, description="Campos a devolver, ej. id,nombre_completo,rol"),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
     """Lista todos los usuarios activos de la clínica."""
-    return db.query(models.User).filter(
+    campos = json_rapido.campos_pedidos(fields, UserResponse)
+    filas = db.query(*json_rapido.columnas(models.User, UserResponse, campos)).filter(
         models.User.tenant_id == current_user.tenant_id,
         models.User.deleted_at == None
     ).all()
+    return json_rapido.responder(json_rapido.filas_a_dicts(filas, UserResponse, campos=campos),
+                                 parcial=campos is not None)
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 def contratar_personal(
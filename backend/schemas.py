@@ -46,7 +46,7 @@ class PatientResponse(PatientBase):
     created_at: datetime
 
     # --- EL FIX MÁGICO ---
-    # Este validador convierte el String de la BD en el Diccionario que espera el Frontend
+    # La columna ya es JSON nativo (llega como dict); esto cubre valores que aún vengan como texto
     @field_validator('datos_personales', mode='before')
     @classmethod
     def parse_datos_personales(cls, v):
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -18,6 +19,18 @@ def get_password_hash(password):
     """Encripta la contraseña para guardarla en la BD"""
     return pwd_context.hash(password)
 
+def hashes_en_paralelo(passwords):
+    """
+    bcrypt es lento a propósito (~0.2 s c/u) pero suelta el GIL:
+    para altas masivas se reparten en hilos, en el mismo orden de entrada.
+    """
+    passwords = list(passwords)
+    if len(passwords) <= 1:
+        return [get_password_hash(p) for p in passwords]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(len(passwords), os.cpu_count() or 2)) as pool:
+        return list(pool.map(get_password_hash, passwords))
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Genera el JWT string"""
     to_encode = data.copy()
@@ -46,6 +59,13 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     3. Si es falso o expiró, te saca (401).
     4. Si es real, devuelve tus datos de usuario y tenant.
     """
+    return usuario_desde_token(token, db)
+
+def usuario_desde_token(token: str, db: Session):
+    """
+    Misma validación que get_current_user, para rutas donde el token no viaja
+    en el header (ej. EventSource del navegador, que no permite headers).
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudieron validar las credenciales",
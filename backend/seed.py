@@ -43,7 +43,7 @@ def create_initial_data():
             nombre_comercial="Clínica Dental Premium",
             plan_suscripcion="pro",
             rfc=rfc_demo,
-            config_ui_json='{"logo": "default.png"}',
+            config_ui_json={"logo": "default.png"},
             estado="activo"
         )
         db.add(new_tenant)
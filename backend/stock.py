@@ -0,0 +1,247 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, insert, update
+from sqlalchemy.orm import Session
+import models
+
+# --- OPERACIONES DE STOCK EN BLOQUE ---
+# Todas las salidas se aplican con UN UPDATE condicional: o alcanza el stock
+# de todos los artículos y se descuentan juntos, o no se toca ninguno.
+# Valuación por costo promedio ponderado: las entradas recalculan el promedio
+# en el mismo UPDATE y cada movimiento guarda su costo unitario en el kardex.
+
+class StockInsuficiente(Exception):
+    def __init__(self, faltantes: List[dict]):
+        super().__init__("Stock insuficiente")
+        self.faltantes = faltantes
+
+class ArticuloNoEncontrado(Exception):
+    pass
+
+def costo_vigente():
+    """Costo promedio del artículo; si aún no tiene, el costo de catálogo."""
+    return func.coalesce(models.InventoryItem.costo_promedio, models.InventoryItem.costo, 0.0)
+
+def materiales_de_servicios(db: Session, tenant_id: int, servicios: Iterable[Tuple[int, int]]) -> List[dict]:
+    """
+    Lista de materiales (BOM) de varios servicios en una sola consulta:
+    [(service_id, veces)] -> [{item_id, nombre, requerido, disponible}]
+    """
+    veces_por_servicio: Dict[int, int] = {}
+    for service_id, veces in servicios:
+        if veces and veces > 0:
+            veces_por_servicio[service_id] = veces_por_servicio.get(service_id, 0) + veces
+    if not veces_por_servicio:
+        return []
+
+    veces = case(veces_por_servicio, value=models.ServiceMaterial.service_id, else_=0)
+    filas = db.query(
+        models.InventoryItem.id,
+        models.InventoryItem.nombre,
+        models.InventoryItem.stock,
+        func.sum(models.ServiceMaterial.cantidad * veces).label("requerido")
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == models.ServiceMaterial.item_id
+    ).filter(
+        models.ServiceMaterial.service_id.in_(veces_por_servicio),
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryItem.deleted_at == None
+    ).group_by(
+        models.InventoryItem.id, models.InventoryItem.nombre, models.InventoryItem.stock
+    ).all()
+
+    return [
+        {"item_id": f.id, "nombre": f.nombre, "requerido": int(f.requerido), "disponible": f.stock or 0}
+        for f in filas if f.requerido
+    ]
+
+def descontar(db: Session, tenant_id: int, user_id: Optional[int], requeridos: Dict[int, int],
+              motivo: str = None, tipo: str = "salida") -> int:
+    """
+    Descuenta {item_id: cantidad} con un UPDATE ... SET stock = stock - CASE ... WHERE stock >= CASE ...
+    Si algún artículo no alcanza (incluso por una carrera con otra petición), lanza
+    StockInsuficiente y no deja nada aplicado. Devuelve el número de movimientos escritos.
+    """
+    requeridos = {item_id: cant for item_id, cant in requeridos.items() if cant > 0}
+    if not requeridos:
+        return 0
+
+    cantidad = case(requeridos, value=models.InventoryItem.id, else_=0)
+    # SAVEPOINT: si falla, se revierte solo el descuento y no la operación que lo llamó
+    with db.begin_nested():
+        # RETURNING: el costo al que sale cada artículo viene en la misma sentencia
+        descontados = db.execute(
+            update(models.InventoryItem)
+            .where(
+                models.InventoryItem.id.in_(requeridos),
+                models.InventoryItem.tenant_id == tenant_id,
+                models.InventoryItem.deleted_at == None,
+                models.InventoryItem.stock >= cantidad
+            )
+            .values(stock=models.InventoryItem.stock - cantidad)
+            .returning(models.InventoryItem.id, costo_vigente())
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(descontados) != len(requeridos):
+            faltantes = _faltantes(db, tenant_id, requeridos)
+            raise StockInsuficiente(faltantes)
+
+        _registrar_movimientos(db, user_id, [
+            (item_id, tipo, requeridos[item_id], costo) for item_id, costo in descontados
+        ], motivo)
+    return len(requeridos)
+
+def aplicar_entradas(db: Session, tenant_id: int, user_id: Optional[int], entradas: Dict[int, int],
+                     motivo: str = None, costos: Dict[int, float] = None) -> int:
+    """
+    Entradas en bloque: stock = stock + CASE ... (no dependen de la existencia actual).
+    `costos` = {item_id: costo unitario de compra}; sin él se usa el costo de catálogo.
+    El promedio ponderado se recalcula en el mismo UPDATE (los SET leen los valores previos).
+    """
+    entradas = {item_id: cant for item_id, cant in entradas.items() if cant > 0}
+    if not entradas:
+        return 0
+
+    cantidad = case(entradas, value=models.InventoryItem.id, else_=0)
+    costo_catalogo = func.coalesce(models.InventoryItem.costo, 0.0)
+    costos = {item_id: c for item_id, c in (costos or {}).items() if item_id in entradas and c is not None}
+    costo_entrada = case(costos, value=models.InventoryItem.id, else_=costo_catalogo) if costos else costo_catalogo
+    # Una existencia negativa heredada no debe "diluir" el promedio
+    existencia = case((models.InventoryItem.stock > 0, models.InventoryItem.stock), else_=0)
+
+    actualizados = db.execute(
+        update(models.InventoryItem)
+        .where(
+            models.InventoryItem.id.in_(entradas),
+            models.InventoryItem.tenant_id == tenant_id,
+            models.InventoryItem.deleted_at == None
+        )
+        .values(
+            stock=func.coalesce(models.InventoryItem.stock, 0) + cantidad,
+            costo_promedio=(existencia * costo_vigente() + cantidad * costo_entrada) / (existencia + cantidad)
+        )
+        .returning(models.InventoryItem.id, costo_catalogo)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if len(actualizados) != len(entradas):
+        raise ArticuloNoEncontrado()
+
+    _registrar_movimientos(db, user_id, [
+        (item_id, "entrada", entradas[item_id], costos.get(item_id, catalogo)) for item_id, catalogo in actualizados
+    ], motivo)
+    return len(entradas)
+
+def existencias(db: Session, tenant_id: int, item_ids: Iterable[int]) -> Dict[int, int]:
+    filas = db.query(models.InventoryItem.id, models.InventoryItem.stock).filter(
+        models.InventoryItem.id.in_(list(item_ids)),
+        models.InventoryItem.tenant_id == tenant_id
+    ).all()
+    return {f.id: f.stock or 0 for f in filas}
+
+# --- CONSUMO POR PACIENTE: CONSULTA Y COBRO ---
+# Los materiales de un servicio se descuentan al finalizar la consulta (servicios
+# realizados) o al cobrar su presupuesto en caja. Regla: descuenta el PRIMERO de
+# los dos eventos; el segundo solo descuenta lo que el primero no cubrió para ese
+# paciente y servicio. Cada descuento queda en service_consumptions; `pendiente`
+# son las unidades que el otro evento todavía no ha emparejado.
+
+ORIGENES = ("cita", "presupuesto")
+
+def consumir_servicios(db: Session, tenant_id: int, user_id: Optional[int],
+                       servicios: Iterable[Tuple[int, int]], motivo: str,
+                       patient_id: Optional[int] = None, origen: Optional[str] = None,
+                       referencia_id: Optional[int] = None) -> dict:
+    """
+    Descuenta los materiales de los servicios realizados. Si falta algo no se
+    descuenta nada y se reportan los faltantes (la operación clínica/cobro sigue).
+    Con patient_id y origen ("cita" o "presupuesto") no se vuelve a descontar lo que
+    el otro evento ya descontó para ese paciente.
+    """
+    veces: Dict[int, int] = {}
+    for service_id, n in servicios:
+        if n and n > 0:
+            veces[service_id] = veces.get(service_id, 0) + n
+
+    cubiertos, emparejados = {}, []
+    if patient_id is not None:
+        cubiertos, emparejados = _ya_descontados(db, tenant_id, patient_id, origen, veces)
+    ya_descontados = [{"service_id": sid, "cantidad": n} for sid, n in cubiertos.items()]
+
+    materiales = materiales_de_servicios(db, tenant_id, [(sid, n - cubiertos.get(sid, 0)) for sid, n in veces.items()])
+    faltantes = [m for m in materiales if m["disponible"] < m["requerido"]]
+    if not faltantes:
+        try:
+            movimientos = descontar(db, tenant_id, user_id, {m["item_id"]: m["requerido"] for m in materiales}, motivo)
+        except StockInsuficiente as e:
+            faltantes = e.faltantes
+        else:
+            if patient_id is not None:
+                _anotar_consumo(db, tenant_id, patient_id, origen, referencia_id, veces, cubiertos, emparejados)
+            return {"aplicado": True, "movimientos": movimientos, "faltantes": [], "ya_descontados": ya_descontados}
+    return {"aplicado": False, "movimientos": 0, "faltantes": faltantes, "ya_descontados": ya_descontados}
+
+def _ya_descontados(db: Session, tenant_id: int, patient_id: int, origen: str, veces: Dict[int, int]):
+    """Unidades de cada servicio que el otro evento ya descontó y aún no se emparejan: ({service_id: n}, [(registro, n)])."""
+    if origen not in ORIGENES:
+        raise ValueError(f"Origen de consumo no válido: {origen}")
+    if not veces:
+        return {}, []
+    otro = ORIGENES[1] if origen == ORIGENES[0] else ORIGENES[0]
+    registros = db.query(models.ServiceConsumption).filter(
+        models.ServiceConsumption.tenant_id == tenant_id,
+        models.ServiceConsumption.patient_id == patient_id,
+        models.ServiceConsumption.service_id.in_(veces),
+        models.ServiceConsumption.origen == otro,
+        models.ServiceConsumption.pendiente > 0
+    ).order_by(models.ServiceConsumption.id).with_for_update().all()
+
+    cubiertos: Dict[int, int] = {}
+    emparejados = []
+    for registro in registros:
+        usar = min(registro.pendiente, veces[registro.service_id] - cubiertos.get(registro.service_id, 0))
+        if usar > 0:
+            cubiertos[registro.service_id] = cubiertos.get(registro.service_id, 0) + usar
+            emparejados.append((registro, usar))
+    return cubiertos, emparejados
+
+def _anotar_consumo(db: Session, tenant_id: int, patient_id: int, origen: str, referencia_id: Optional[int],
+                    veces: Dict[int, int], cubiertos: Dict[int, int], emparejados: list):
+    for registro, usar in emparejados:
+        registro.pendiente -= usar
+    ahora = datetime.now()
+    db.add_all([models.ServiceConsumption(
+        tenant_id=tenant_id, patient_id=patient_id, service_id=service_id, origen=origen,
+        referencia_id=referencia_id, cantidad=n, pendiente=n - cubiertos.get(service_id, 0), fecha=ahora
+    ) for service_id, n in veces.items()])
+
+# --- INTERNOS ---
+
+def _faltantes(db: Session, tenant_id: int, requeridos: Dict[int, int]) -> List[dict]:
+    filas = db.query(models.InventoryItem.id, models.InventoryItem.nombre, models.InventoryItem.stock).filter(
+        models.InventoryItem.id.in_(requeridos),
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryItem.deleted_at == None
+    ).all()
+    encontrados = {f.id: f for f in filas}
+    faltantes = []
+    for item_id, requerido in requeridos.items():
+        fila = encontrados.get(item_id)
+        disponible = (fila.stock or 0) if fila else 0
+        if disponible < requerido:
+            faltantes.append({
+                "item_id": item_id,
+                "nombre": fila.nombre if fila else "No encontrado",
+                "requerido": requerido,
+                "disponible": disponible
+            })
+    return faltantes
+
+def _registrar_movimientos(db: Session, user_id: Optional[int], movimientos: List[Tuple[int, str, int, float]], motivo: str):
+    """Todo el kardex de la operación en un solo INSERT (executemany)."""
+    ahora = datetime.now()
+    db.execute(insert(models.InventoryMovement), [
+        {"item_id": item_id, "user_id": user_id, "tipo": tipo, "cantidad": cant,
+         "costo_unitario": costo, "motivo": motivo, "fecha": ahora}
+        for item_id, tipo, cant, costo in movimientos
+    ])
@@ -0,0 +1,114 @@
+import csv
+import io
+import tempfile
+import zipfile
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from fastapi import HTTPException, UploadFile
+
+# --- ARCHIVOS CSV / XLSX EN STREAMING ---
+# Se leen fila por fila (nunca el archivo completo en memoria) y se procesan
+# en bloques, para importar catálogos o padrones de cualquier tamaño.
+
+FORMATOS = ("csv", "xlsx")
+
+class ArchivoIlegible(Exception):
+    """El archivo no se pudo seguir leyendo (codificación, CSV o XLSX dañado) a partir de `fila`."""
+    def __init__(self, fila: int, mensaje: str):
+        super().__init__(mensaje)
+        self.fila = fila
+        self.mensaje = mensaje
+
+def requiere_openpyxl():
+    """openpyxl es opcional: sin él solo se acepta CSV."""
+    try:
+        import openpyxl
+    except ImportError:
+        raise HTTPException(400, "El servidor no tiene soporte para .xlsx (instale openpyxl); use .csv")
+    return openpyxl
+
+def formato_de(nombre_archivo: str) -> str:
+    extension = (nombre_archivo or "").rsplit(".", 1)[-1].lower()
+    if extension not in FORMATOS:
+        raise HTTPException(400, "Formato no soportado. Use .csv o .xlsx")
+    return extension
+
+def _normalizar(encabezado: Any) -> str:
+    return str(encabezado or "").strip().lower().replace(" ", "_")
+
+def leer_filas(archivo: UploadFile, saltar: int = 0, numerar: bool = False) -> Iterator[Any]:
+    """
+    Devuelve un dict por fila con encabezados en minúsculas.
+    `saltar` omite las primeras N filas de datos (para reanudar una importación).
+    Con `numerar` devuelve (número de fila en el archivo, dict); los encabezados son la fila 1.
+    """
+    formato = formato_de(archivo.filename)
+    numero = 0 # Última fila leída, para decir dónde se cortó el archivo
+    try:
+        if formato == "csv":
+            texto = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", newline="")
+            lector = csv.reader(texto)
+            encabezados = [_normalizar(h) for h in next(lector, [])]
+            filas: Iterable[Sequence[Any]] = lector
+        else:
+            openpyxl = requiere_openpyxl()
+            try:
+                libro = openpyxl.load_workbook(archivo.file, read_only=True, data_only=True)
+            except openpyxl.utils.exceptions.InvalidFileException as e:
+                raise ArchivoIlegible(1, f"Archivo dañado o ilegible: {e}")
+            filas = libro.active.iter_rows(values_only=True)
+            encabezados = [_normalizar(h) for h in next(filas, [])]
+        numero = saltar + 1
+
+        for numero, fila in enumerate(islice(filas, saltar, None), start=saltar + 2):
+            if not any(v not in (None, "") for v in fila):
+                continue
+            datos = {encabezados[i]: v for i, v in enumerate(fila) if i < len(encabezados)}
+            yield (numero, datos) if numerar else datos
+    except UnicodeDecodeError:
+        raise ArchivoIlegible(numero + 1, "El archivo no está en UTF-8; guárdelo como «CSV UTF-8» e intente de nuevo")
+    except (csv.Error, zipfile.BadZipFile, KeyError) as e:
+        raise ArchivoIlegible(numero + 1, f"Archivo dañado o ilegible: {e}")
+
+def en_bloques(filas: Iterable[Any], tamano: int) -> Iterator[List[Any]]:
+    iterador = iter(filas)
+    while True:
+        bloque = list(islice(iterador, tamano))
+        if not bloque:
+            return
+        yield bloque
+
+def csv_en_streaming(encabezados: List[str], filas: Iterable[Sequence[Any]], filas_por_envio: int = 500) -> Iterator[str]:
+    """Genera el CSV en pedazos para StreamingResponse."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(encabezados)
+    for n, fila in enumerate(filas, start=1):
+        escritor.writerow(fila)
+        if n % filas_por_envio == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def xlsx_en_streaming(encabezados: List[str], filas: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    """
+    XLSX con openpyxl en modo write_only (no guarda el libro en memoria);
+    el archivo se arma en un temporal y se envía por pedazos.
+    Llamar requiere_openpyxl() antes de crear la respuesta.
+    """
+    libro = requiere_openpyxl().Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(encabezados)
+    for fila in filas:
+        hoja.append(list(fila))
+
+    with tempfile.TemporaryFile() as temporal:
+        libro.save(temporal)
+        temporal.seek(0)
+        while True:
+            pedazo = temporal.read(64 * 1024)
+            if not pedazo:
+                break
+            yield pedazo
@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+# --- TAREAS PROGRAMADAS EN PROCESO ---
+# Hilos en segundo plano para los trabajos nocturnos/periódicos.
+# Con varios workers de uvicorn, activar solo en uno: CLINICSYNC_TAREAS=0 en los demás.
+# Ojo: el canal de /eventos/agenda (eventos.broker) tampoco sale del proceso; una
+# pantalla conectada a un worker no ve las citas creadas en otro. Mientras no haya un
+# canal compartido, la API que sirve la agenda en vivo debe correr con un solo worker.
+
+log = logging.getLogger("clinicsync.tareas")
+
+HABILITADAS = os.getenv("CLINICSYNC_TAREAS", "1") == "1"
+
+class Tarea:
+    def __init__(self, nombre: str, funcion: Callable[[], None], siguiente: Callable[[datetime], datetime]):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.siguiente = siguiente # Calcula la próxima ejecución a partir de "ahora"
+
+    def ciclo(self, detener: threading.Event):
+        while not detener.is_set():
+            espera = (self.siguiente(datetime.now()) - datetime.now()).total_seconds()
+            if detener.wait(max(espera, 0)):
+                break
+            try:
+                self.funcion()
+            except Exception:
+                # Un fallo no debe matar el hilo: se reintenta en la siguiente ventana
+                log.exception("Falló la tarea %s", self.nombre)
+
+_tareas: List[Tarea] = []
+_hilos: List[threading.Thread] = []
+_detener = threading.Event()
+
+def programar_diario(nombre: str, hora: str, funcion: Callable[[], None]):
+    """Ejecuta funcion() todos los días a la hora local "HH:MM"."""
+    hh, mm = (int(x) for x in hora.split(":"))
+
+    def siguiente(ahora: datetime) -> datetime:
+        objetivo = ahora.replace(hour=hh, minute=mm, second=0, microsecond=0)
+        return objetivo if objetivo > ahora else objetivo + timedelta(days=1)
+
+    _tareas.append(Tarea(nombre, funcion, siguiente))
+
+def programar_cada(nombre: str, segundos: float, funcion: Callable[[], None]):
+    """Ejecuta funcion() cada N segundos."""
+    _tareas.append(Tarea(nombre, funcion, lambda ahora: ahora + timedelta(seconds=segundos)))
+
+def iniciar():
+    if not HABILITADAS or _hilos:
+        return
+    _detener.clear()
+    for tarea in _tareas:
+        hilo = threading.Thread(target=tarea.ciclo, args=(_detener,), name=f"tarea-{tarea.nombre}", daemon=True)
+        hilo.start()
+        _hilos.append(hilo)
+
+def detener():
+    _detener.set()
+    for hilo in _hilos:
+        hilo.join(timeout=5)
+    _hilos.clear()
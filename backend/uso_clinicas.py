@@ -0,0 +1,115 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+import database, models, recetas_pdf
+
+# --- USO POR CLÍNICA (TRABAJO PERIÓDICO) ---
+# El directorio del backoffice lee una fila precalculada por clínica.
+# Cada métrica es UNA consulta agrupada por tenant_id para todas las clínicas,
+# sin importar cuántas haya (nada de consultas por clínica).
+
+log = logging.getLogger("clinicsync.uso_clinicas")
+
+CADA_SEGUNDOS = 15 * 60
+
+def _por_tenant(filas) -> Dict[int, float]:
+    return {tenant_id: valor or 0 for tenant_id, valor in filas if tenant_id is not None}
+
+def _almacenamiento() -> Dict[int, int]:
+    """Bytes de PDFs generados por clínica (un directorio por tenant)."""
+    resultado = {}
+    if not recetas_pdf.RECETAS_DIR.is_dir():
+        return resultado
+    for carpeta in recetas_pdf.RECETAS_DIR.iterdir():
+        if not carpeta.is_dir() or not carpeta.name.isdigit():
+            continue
+        with os.scandir(carpeta) as entradas:
+            resultado[int(carpeta.name)] = sum(e.stat().st_size for e in entradas if e.is_file())
+    return resultado
+
+def _metricas(db: Session, inicio_mes: datetime) -> Dict[str, Dict[int, float]]:
+    """Cada métrica agrupada por tenant_id: {"usuarios": {tenant_id: n}, ...}."""
+    inicio_mes_siguiente = (inicio_mes + timedelta(days=32)).replace(day=1)
+    return {
+        "usuarios": _por_tenant(db.query(models.User.tenant_id, func.count(models.User.id)).filter(
+            models.User.deleted_at == None
+        ).group_by(models.User.tenant_id)),
+
+        "pacientes": _por_tenant(db.query(models.Patient.tenant_id, func.count(models.Patient.id)).filter(
+            models.Patient.deleted_at == None
+        ).group_by(models.Patient.tenant_id)),
+
+        "citas_mes": _por_tenant(db.query(models.Appointment.tenant_id, func.count(models.Appointment.id)).filter(
+            models.Appointment.fecha_hora >= inicio_mes,
+            models.Appointment.fecha_hora < inicio_mes_siguiente, # Las citas ya agendadas a futuro no son uso del mes
+            models.Appointment.deleted_at == None
+        ).group_by(models.Appointment.tenant_id)),
+
+        "ingresos_mes": _por_tenant(db.query(models.Transaction.tenant_id, func.sum(models.Transaction.monto)).filter(
+            models.Transaction.tipo == "ingreso",
+            models.Transaction.deleted_at == None,
+            models.Transaction.created_at >= inicio_mes
+        ).group_by(models.Transaction.tenant_id)),
+
+        "archivos": _por_tenant(db.query(models.Appointment.tenant_id, func.count(models.AppointmentFile.id)).join(
+            models.Appointment, models.Appointment.id == models.AppointmentFile.appointment_id
+        ).group_by(models.Appointment.tenant_id)),
+    }
+
+def calcular(db: Session, ahora: datetime = None) -> int:
+    """Recalcula las estadísticas de todas las clínicas. Devuelve cuántas guardó."""
+    ahora = ahora or datetime.now()
+    inicio_mes = ahora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    tenants = [t.id for t in db.query(models.Tenant.id).all()]
+
+    if database.BD_POR_CLINICA:
+        # Cada clínica en su archivo: las mismas consultas, una BD a la vez
+        metricas = {nombre: {} for nombre in ("usuarios", "pacientes", "citas_mes", "ingresos_mes", "archivos")}
+        for tenant_id in tenants:
+            clinica = database.sesion_de_clinica(tenant_id)
+            try:
+                for nombre, valores in _metricas(clinica, inicio_mes).items():
+                    metricas[nombre][tenant_id] = valores.get(tenant_id, 0)
+            finally:
+                clinica.close()
+    else:
+        metricas = _metricas(db, inicio_mes)
+
+    almacenamiento = _almacenamiento()
+
+    registros = [{
+        "tenant_id": tenant_id,
+        "usuarios": int(metricas["usuarios"].get(tenant_id, 0)),
+        "pacientes": int(metricas["pacientes"].get(tenant_id, 0)),
+        "citas_mes": int(metricas["citas_mes"].get(tenant_id, 0)),
+        "ingresos_mes": round(float(metricas["ingresos_mes"].get(tenant_id, 0)), 2),
+        "archivos": int(metricas["archivos"].get(tenant_id, 0)),
+        "almacenamiento_bytes": almacenamiento.get(tenant_id, 0),
+        "calculado_en": ahora
+    } for tenant_id in tenants]
+
+    db.query(models.TenantUsageStats).delete(synchronize_session=False)
+    if registros:
+        db.execute(insert(models.TenantUsageStats), registros)
+    db.commit()
+    return len(registros)
+
+def recalcular():
+    """Entrada del trabajo periódico."""
+    db = database.SessionLocal()
+    try:
+        calcular(db)
+    except Exception:
+        db.rollback()
+        log.exception("No se pudieron calcular las estadísticas de uso")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    recalcular()
@@ -0,0 +1,218 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, case, func, insert
+from sqlalchemy.orm import Session
+
+import database, models, stock
+
+# --- VALUACIÓN DE INVENTARIO (FOTOS DIARIAS) ---
+# Cada movimiento ya guarda su costo unitario (costo promedio ponderado, ver stock.py),
+# así que el valor de un día se obtiene del estado actual del artículo "deshaciendo"
+# solo los movimientos posteriores a ese día. La foto nocturna guarda existencia,
+# valor y costo de lo consumido por artículo; los reportes leen las fotos, no el kardex.
+
+log = logging.getLogger("clinicsync.valuacion")
+
+MAX_DIAS_RECUPERACION = 31 # Si el trabajo no corrió, se reponen como máximo estos días
+
+def _inicio(dia: date) -> datetime:
+    return datetime(dia.year, dia.month, dia.day)
+
+def tomar_foto(db: Session, tenant_id: int, dia: date) -> int:
+    """Guarda (o reemplaza) la foto del cierre de `dia`. Devuelve cuántos artículos registró."""
+    inicio, fin = _inicio(dia), _inicio(dia) + timedelta(days=1)
+
+    items = db.query(
+        models.InventoryItem.id, models.InventoryItem.stock, stock.costo_vigente().label("costo")
+    ).filter(
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryItem.deleted_at == None
+    ).all()
+
+    # Un solo barrido de los movimientos desde `dia`: los del día se suman como
+    # actividad del día, los posteriores se "deshacen" del estado actual.
+    mov = models.InventoryMovement
+    valor_mov = mov.cantidad * func.coalesce(mov.costo_unitario, 0.0)
+    del_dia = mov.fecha < fin
+    def suma(condicion, expr):
+        return func.coalesce(func.sum(case((condicion, expr), else_=0)), 0)
+
+    actividad = db.query(
+        mov.item_id,
+        suma(and_(del_dia, mov.tipo == "entrada"), mov.cantidad).label("entradas"),
+        suma(and_(del_dia, mov.tipo == "entrada"), valor_mov).label("valor_entradas"),
+        suma(and_(del_dia, mov.tipo == "salida"), mov.cantidad).label("salidas"),
+        suma(and_(del_dia, mov.tipo == "salida"), valor_mov).label("costo_consumo"),
+        suma(and_(~del_dia, mov.tipo == "entrada"), mov.cantidad).label("entradas_despues"),
+        suma(and_(~del_dia, mov.tipo == "salida"), mov.cantidad).label("salidas_despues"),
+        suma(and_(~del_dia, mov.tipo == "entrada"), valor_mov).label("valor_entradas_despues"),
+        suma(and_(~del_dia, mov.tipo == "salida"), valor_mov).label("valor_salidas_despues"),
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == mov.item_id
+    ).filter(
+        models.InventoryItem.tenant_id == tenant_id,
+        mov.fecha >= inicio
+    ).group_by(mov.item_id).all()
+    por_item = {a.item_id: a for a in actividad}
+
+    registros = []
+    for item in items:
+        a = por_item.get(item.id)
+        existencia = item.stock or 0
+        valor = existencia * item.costo
+        if a:
+            existencia -= a.entradas_despues - a.salidas_despues
+            valor -= a.valor_entradas_despues - a.valor_salidas_despues
+        if existencia == 0 and not a:
+            continue # Sin existencia ni actividad: no ocupa espacio en la foto
+        registros.append({
+            "tenant_id": tenant_id,
+            "item_id": item.id,
+            "fecha": dia,
+            "existencia": existencia,
+            "costo_promedio": round(valor / existencia, 4) if existencia > 0 else round(item.costo, 4),
+            "valor": round(max(valor, 0.0), 2),
+            "entradas": a.entradas if a else 0,
+            "valor_entradas": round(a.valor_entradas, 2) if a else 0.0,
+            "salidas": a.salidas if a else 0,
+            "costo_consumo": round(a.costo_consumo, 2) if a else 0.0,
+        })
+
+    db.query(models.InventoryValuationSnapshot).filter(
+        models.InventoryValuationSnapshot.tenant_id == tenant_id,
+        models.InventoryValuationSnapshot.fecha == dia
+    ).delete(synchronize_session=False)
+    if registros:
+        db.execute(insert(models.InventoryValuationSnapshot), registros)
+    db.commit()
+    return len(registros)
+
+def fotos_pendientes(db: Session, tenant_id: int, hasta: Optional[date] = None) -> int:
+    """Toma las fotos que falten hasta `hasta` (por defecto ayer). Devuelve cuántos días procesó."""
+    hasta = hasta or date.today() - timedelta(days=1)
+    ultima = db.query(func.max(models.InventoryValuationSnapshot.fecha)).filter(
+        models.InventoryValuationSnapshot.tenant_id == tenant_id
+    ).scalar()
+    desde = max(
+        (ultima + timedelta(days=1)) if ultima else hasta,
+        hasta - timedelta(days=MAX_DIAS_RECUPERACION - 1)
+    )
+    dias = 0
+    dia = desde
+    while dia <= hasta:
+        tomar_foto(db, tenant_id, dia)
+        dia += timedelta(days=1)
+        dias += 1
+    return dias
+
+def resumen(db: Session, tenant_id: int, desde: date, hasta: date, top: int = 10) -> dict:
+    """Valor inicial/final y costo de lo consumido en [desde, hasta], leído de las fotos."""
+    foto = models.InventoryValuationSnapshot
+
+    def fecha_foto(limite: date):
+        return db.query(func.max(foto.fecha)).filter(foto.tenant_id == tenant_id, foto.fecha <= limite).scalar()
+
+    def valor_en(fecha: Optional[date]) -> float:
+        if not fecha:
+            return 0.0
+        return float(db.query(func.coalesce(func.sum(foto.valor), 0.0)).filter(
+            foto.tenant_id == tenant_id, foto.fecha == fecha
+        ).scalar())
+
+    fecha_inicial = fecha_foto(desde - timedelta(days=1))
+    fecha_final = fecha_foto(hasta)
+
+    totales = db.query(
+        func.coalesce(func.sum(foto.valor_entradas), 0.0),
+        func.coalesce(func.sum(foto.costo_consumo), 0.0),
+        func.count(func.distinct(foto.fecha))
+    ).filter(foto.tenant_id == tenant_id, foto.fecha >= desde, foto.fecha <= hasta).one()
+
+    consumo_por_item = db.query(
+        foto.item_id, models.InventoryItem.nombre, models.InventoryItem.sku,
+        func.sum(foto.salidas).label("salidas"),
+        func.sum(foto.costo_consumo).label("costo_consumo")
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == foto.item_id
+    ).filter(
+        foto.tenant_id == tenant_id, foto.fecha >= desde, foto.fecha <= hasta, foto.costo_consumo > 0
+    ).group_by(
+        foto.item_id, models.InventoryItem.nombre, models.InventoryItem.sku
+    ).order_by(func.sum(foto.costo_consumo).desc()).limit(top).all()
+
+    valor_actual = db.query(
+        func.coalesce(func.sum(models.InventoryItem.stock * stock.costo_vigente()), 0.0)
+    ).filter(
+        models.InventoryItem.tenant_id == tenant_id,
+        models.InventoryItem.deleted_at == None,
+        models.InventoryItem.stock > 0
+    ).scalar()
+
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "fecha_foto_inicial": fecha_inicial,
+        "fecha_foto_final": fecha_final,
+        "dias_con_foto": totales[2],
+        "valor_inicial": round(valor_en(fecha_inicial), 2),
+        "valor_final": round(valor_en(fecha_final), 2),
+        "compras": round(float(totales[0]), 2),
+        "costo_consumo": round(float(totales[1]), 2),
+        "valor_actual": round(float(valor_actual), 2),
+        "mayor_consumo": [{
+            "item_id": c.item_id,
+            "nombre": c.nombre,
+            "sku": c.sku,
+            "salidas": int(c.salidas),
+            "costo_consumo": round(float(c.costo_consumo), 2)
+        } for c in consumo_por_item]
+    }
+
+def costo_materiales_servicios(db: Session, tenant_id: int) -> list:
+    """Costo de materiales de cada servicio del catálogo (BOM x costo promedio), en una consulta."""
+    filas = db.query(
+        models.ServiceCatalog.id,
+        models.ServiceCatalog.nombre,
+        models.ServiceCatalog.precio,
+        func.sum(models.ServiceMaterial.cantidad * stock.costo_vigente()).label("costo_materiales")
+    ).join(
+        models.ServiceMaterial, models.ServiceMaterial.service_id == models.ServiceCatalog.id
+    ).join(
+        models.InventoryItem, models.InventoryItem.id == models.ServiceMaterial.item_id
+    ).filter(
+        models.ServiceCatalog.tenant_id == tenant_id,
+        models.ServiceCatalog.deleted_at == None
+    ).group_by(
+        models.ServiceCatalog.id, models.ServiceCatalog.nombre, models.ServiceCatalog.precio
+    ).order_by(models.ServiceCatalog.nombre).all()
+
+    return [{
+        "service_id": f.id,
+        "nombre": f.nombre,
+        "precio": float(f.precio or 0),
+        "costo_materiales": round(float(f.costo_materiales or 0), 2),
+        "margen": round(float(f.precio or 0) - float(f.costo_materiales or 0), 2)
+    } for f in filas]
+
+def recalcular_todos():
+    """Entrada del trabajo nocturno: fotos pendientes de cada tenant, uno a la vez."""
+    directorio = database.SessionLocal()
+    try:
+        tenants = [t.id for t in directorio.query(models.Tenant.id).filter(models.Tenant.deleted_at == None).all()]
+    finally:
+        directorio.close()
+
+    for tenant_id in tenants:
+        db = database.sesion_de_clinica(tenant_id)
+        try:
+            fotos_pendientes(db, tenant_id)
+        except Exception:
+            db.rollback()
+            log.exception("No se pudo valuar el inventario del tenant %s", tenant_id)
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    recalcular_todos()
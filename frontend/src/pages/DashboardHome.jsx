@@ -31,7 +31,7 @@ const DashboardHome = () => {
                     client.get(`/clinica/agenda?start_date=${today}&end_date=${today}`), // Citas de HOY
                     client.get(`/finanzas/reporte-ventas?start_date=${today}&end_date=${today}`), // Ventas de HOY
                     client.get('/finanzas/caja/pendientes'), // Deuda pendiente total
-                    client.get('/pacientes/') // Total pacientes
+                    client.get('/pacientes/?fields=id') // Total pacientes
                 ]);
 
                 // Cálculos
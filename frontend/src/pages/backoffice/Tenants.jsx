@@ -6,6 +6,9 @@ import { UserCircleIcon, BuildingOfficeIcon, XMarkIcon } from '@heroicons/react/
 const Tenants = () => {
     const [clinicas, setClinicas] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [busqueda, setBusqueda] = useState('');
+    const [total, setTotal] = useState(0);
+    const [siguienteCursor, setSiguienteCursor] = useState(null);
 
     // Estado para el Modal de Detalles
     const [selectedClinic, setSelectedClinic] = useState(null);
@@ -19,14 +22,22 @@ const Tenants = () => {
         admin_nombre: '', admin_email: '', admin_password: ''
     });
 
+    // Búsqueda con pequeño retraso para no pedir una página por tecla
     useEffect(() => {
-        fetchClinicas();
-    }, []);
+        const timer = setTimeout(() => fetchClinicas(), 300);
+        return () => clearTimeout(timer);
+    }, [busqueda]);
 
-    const fetchClinicas = async () => {
+    const fetchClinicas = async (cursor = null) => {
+        setLoading(true);
         try {
-            const res = await client.get('/superadmin/clinicas');
-            setClinicas(res.data);
+            const params = { limit: 25 };
+            if (busqueda.trim()) params.q = busqueda.trim();
+            if (cursor) params.cursor = cursor;
+            const res = await client.get('/superadmin/clinicas', { params });
+            setClinicas(prev => cursor ? [...prev, ...res.data.clinicas] : res.data.clinicas);
+            setTotal(res.data.total);
+            setSiguienteCursor(res.data.siguiente_cursor);
         } catch (error) {
             toast.error("Error cargando datos");
         } finally {
@@ -34,6 +45,12 @@ const Tenants = () => {
         }
     };
 
+    const formatoBytes = (bytes) => {
+        if (!bytes) return '0 KB';
+        if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(0)} KB`;
+        return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+    };
+
     // Cuando das clic en una clínica
     const handleOpenDetails = async (clinic) => {
         setSelectedClinic(clinic);
@@ -110,6 +127,17 @@ const Tenants = () => {
                 </div>
             )}
 
+            {/* BUSCADOR */}
+            <div className="flex justify-between items-center">
+                <input
+                    placeholder="Buscar por nombre, razón social o RFC..."
+                    className="p-2 border rounded-lg w-full md:w-96"
+                    value={busqueda}
+                    onChange={e => setBusqueda(e.target.value)}
+                />
+                <span className="text-sm text-gray-500 ml-4">{clinicas.length} de {total} clínicas</span>
+            </div>
+
             {/* TABLA PRINCIPAL */}
             <div className="bg-white rounded-xl shadow overflow-hidden border border-gray-200">
                 <table className="min-w-full divide-y divide-gray-200">
@@ -119,11 +147,12 @@ const Tenants = () => {
                             <th className="px-6 py-3 text-left text-xs font-bold text-gray-500 uppercase">Clínica</th>
                             <th className="px-6 py-3 text-left text-xs font-bold text-gray-500 uppercase">Plan</th>
                             <th className="px-6 py-3 text-left text-xs font-bold text-gray-500 uppercase">Ingreso Mensual</th>
+                            <th className="px-6 py-3 text-left text-xs font-bold text-gray-500 uppercase">Uso (mes)</th>
                             <th className="px-6 py-3 text-left text-xs font-bold text-gray-500 uppercase">Acción</th>
                         </tr>
                     </thead>
                     <tbody className="divide-y divide-gray-200">
-                        {loading ? <tr><td colSpan="5" className="p-4 text-center">Cargando...</td></tr> :
+                        {loading && clinicas.length === 0 ? <tr><td colSpan="6" className="p-4 text-center">Cargando...</td></tr> :
                             clinicas.map((t) => (
                                 <tr key={t.id} className="hover:bg-blue-50 cursor-pointer transition-colors" onClick={() => handleOpenDetails(t)}>
                                     <td className="px-6 py-4 text-sm text-gray-500">#{t.id}</td>
@@ -142,6 +171,15 @@ const Tenants = () => {
                                     <td className="px-6 py-4 font-bold text-gray-700">
                                         {getPrecio(t.plan_suscripcion)}
                                     </td>
+                                    <td className="px-6 py-4 text-xs text-gray-600">
+                                        {t.uso ? (
+                                            <>
+                                                <div>{t.uso.usuarios} usuarios · {t.uso.pacientes} pacientes</div>
+                                                <div>{t.uso.citas_mes} citas · ${t.uso.ingresos_mes.toLocaleString('es-MX')}</div>
+                                                <div className="text-gray-400">{formatoBytes(t.uso.almacenamiento_bytes)}</div>
+                                            </>
+                                        ) : <span className="text-gray-400">Pendiente</span>}
+                                    </td>
                                     <td className="px-6 py-4">
                                         <button className="text-blue-600 hover:text-blue-900 text-sm font-medium">Ver Detalles</button>
                                     </td>
@@ -149,6 +187,17 @@ const Tenants = () => {
                             ))}
                     </tbody>
                 </table>
+                {siguienteCursor && (
+                    <div className="p-4 text-center border-t">
+                        <button
+                            onClick={() => fetchClinicas(siguienteCursor)}
+                            disabled={loading}
+                            className="text-blue-600 hover:text-blue-900 text-sm font-medium"
+                        >
+                            {loading ? 'Cargando...' : 'Cargar más'}
+                        </button>
+                    </div>
+                )}
             </div>
 
             {/* MODAL DE DETALLES (Drill Down) */}
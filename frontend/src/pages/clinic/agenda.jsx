@@ -36,7 +36,7 @@ const Agenda = () => {
     useEffect(() => {
         const timer = setTimeout(() => {
             if (searchPatientTerm.length > 1 && !selectedPatientName) {
-                client.get(`/pacientes/search?query=${searchPatientTerm}`)
+                client.get(`/pacientes/search?query=${searchPatientTerm}&fields=id,nombre,apellidos`)
                     .then(res => setSearchResults(res.data))
                     .catch(() => setSearchResults([]));
             } else { setSearchResults([]); }
@@ -49,7 +49,7 @@ const Agenda = () => {
             setLoading(true);
             let realDoctors = [];
             try {
-                const resDocs = await client.get('/usuarios/');
+                const resDocs = await client.get('/usuarios/?fields=id,nombre_completo,rol');
                 realDoctors = resDocs.data.filter(u => ['admin', 'dentista', 'medico'].includes(u.rol));
                 setDoctors(realDoctors);
             } catch (e) {
@@ -64,28 +64,67 @@ const Agenda = () => {
             let res;
             try { res = await client.get(`/clinica/agenda?start_date=${startDate}&end_date=${endDate}`); } catch { res = { data: [] }; }
 
-            const processedApps = res.data.map(appt => {
-                const parts = appt.fecha_hora.split(/[-T:]/);
-                const localDate = new Date(parts[0], parts[1] - 1, parts[2], parts[3], parts[4]);
-                const doctor = realDoctors.find(d => d.id === appt.doctor_id);
-
-                return {
-                    ...appt,
-                    doctor_name: doctor ? doctor.nombre_completo.split(' ')[0] : 'Dr.',
-                    localStartDate: localDate,
-                    hour: localDate.getHours(),
-                    minutes: localDate.getMinutes(),
-                    duration: appt.duracion_minutos || 60,
-                    patient_name: appt.patient_name || `Paciente #${appt.patient_id}`,
-                    startMin: localDate.getHours() * 60 + localDate.getMinutes(),
-                    endMin: localDate.getHours() * 60 + localDate.getMinutes() + (appt.duracion_minutos || 60)
-                };
-            });
+            const processedApps = res.data.map(appt => toAgendaItem(appt, realDoctors));
 
             setAppointments(processedApps);
         } catch (error) { toast.error("Error sincronizando agenda"); } finally { setLoading(false); }
     };
 
+    const toAgendaItem = (appt, doctorList) => {
+        const parts = appt.fecha_hora.split(/[-T:]/);
+        const localDate = new Date(parts[0], parts[1] - 1, parts[2], parts[3], parts[4]);
+        const doctor = doctorList.find(d => d.id === appt.doctor_id);
+
+        return {
+            ...appt,
+            doctor_name: doctor ? doctor.nombre_completo.split(' ')[0] : 'Dr.',
+            localStartDate: localDate,
+            hour: localDate.getHours(),
+            minutes: localDate.getMinutes(),
+            duration: appt.duracion_minutos || 60,
+            patient_name: appt.patient_name || `Paciente #${appt.patient_id}`,
+            startMin: localDate.getHours() * 60 + localDate.getMinutes(),
+            endMin: localDate.getHours() * 60 + localDate.getMinutes() + (appt.duracion_minutos || 60)
+        };
+    };
+
+    // --- EVENTOS EN VIVO: otras pantallas de la clínica nos avisan de cada cambio ---
+    useEffect(() => {
+        const token = localStorage.getItem('token');
+        if (!token) return;
+        const source = new EventSource(`${client.defaults.baseURL}/eventos/agenda?token=${token}`);
+
+        const upsert = (e) => {
+            const appt = JSON.parse(e.data);
+            setAppointments(prev => {
+                const existing = prev.find(a => a.id === appt.id);
+                const item = toAgendaItem({ ...existing, ...appt }, doctors);
+                return existing ? prev.map(a => a.id === appt.id ? item : a) : [...prev, item];
+            });
+        };
+        const cancel = (e) => {
+            const appt = JSON.parse(e.data);
+            if (appt.eliminada) setAppointments(prev => prev.filter(a => a.id !== appt.id));
+            else upsert(e);
+        };
+
+        source.addEventListener('cita_creada', upsert);
+        source.addEventListener('cita_estado', upsert);
+        source.addEventListener('cita_cancelada', cancel);
+        source.addEventListener('resync', () => loadAgendaData());
+
+        // Si el canal se corta, pudimos perder eventos: al reconectar (o si ya no reconecta) recargamos todo
+        let perdido = false;
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) loadAgendaData();
+            else perdido = true;
+        };
+        source.onopen = () => {
+            if (perdido) { perdido = false; loadAgendaData(); }
+        };
+        return () => source.close();
+    }, [doctors]);
+
     const updateStatus = async (id, nuevoEstado) => {
         try {
             await client.put(`/citas/${id}/status`, { estado: nuevoEstado });
@@ -95,8 +134,9 @@ const Agenda = () => {
             if (nuevoEstado === 'en_proceso' || nuevoEstado === 'En proceso') {
                 navigate(`/dashboard/consulta/${id}`);
             } else {
-                loadAgendaData();
+                // El evento "cita_estado" avisa a las demás pantallas; la nuestra no depende de él
                 setSelectedEvent(null);
+                loadAgendaData();
             }
             // -------------------------------------------------------
 